@@ -7,28 +7,24 @@ Figures and facts for the poster at the SFB INF workshop on Cologne 2 - 3 Decemb
 
 - Data publications per year from PANGAEA and Zenodo
 - Metadataviews, downloads, ... from both repositories
+- Map of the number of data sets per 1° cell of their location
+
+The figures are made by :func:`main`, which is also run by ``python cli.py plot`` and ``python cli.py wordcloud``.
+Matplotlib and wordcloud are only imported when the figures are made.
+With ``--query`` only the data sets matching a full-text search (see :class:`functions.SearchIndex`) are plotted,
+with ``--bbox`` only the ones within a bounding box (see :class:`functions.SpatialIndex`).
 """
 # %% import packages
 import argparse
-from PIL import Image
-from wordcloud import WordCloud, STOPWORDS
-import datetime as dt
-import json
 import logging
 import functions as fn
-import matplotlib.pyplot as plt
-import numpy as np
-import pandas as pd
-import seaborn as sns
+import re
 import sys
 import time
 
-# Set up logging
-logging.basicConfig(level=logging.INFO,
-                    format='%(message)s')
-console = logging.StreamHandler()
-console.setLevel(logging.INFO)
-logging.getLogger(__name__).addHandler(console)
+# Words left out of the word cloud besides wordcloud.STOPWORDS
+EXTRA_STOPWORDS = ('borne', 'tethered', 'VISSS', 'Situ', 'Snowfall', 'Sensor', 'Hyytiäla', 'Video')
+
 
 # %% set date of metadata retrieval
 def get_args(debug=False, date=None):
@@ -39,6 +35,12 @@ def get_args(debug=False, date=None):
                         help="Date (yyyymmdd) for which the plots should be made.",
                         default=time.strftime("%Y%m%d", time.localtime()),
                         nargs='?')
+    parser.add_argument("--exclude-duplicates", action="store_true",
+                        help="Count only one data set of each cluster of near-duplicates.")
+    parser.add_argument("--query",
+                        help="Only plot the data sets matching a full-text search, e.g. 'Ny-Ålesund radiosonde'.")
+    parser.add_argument("--bbox", nargs=4, type=float, metavar=('SOUTH', 'WEST', 'NORTH', 'EAST'),
+                        help="Only plot the data sets whose coverage overlaps a bounding box.")
 
     if debug:
         # Simulate command-line input
@@ -49,279 +51,206 @@ def get_args(debug=False, date=None):
 
     return args
 
-# Debug mode
-# args = get_args(debug=True, date="20251022")
-
-args = get_args()
-date = args.date
-
-# %% Get views and downloads from Zenodo
-logging.info("\N{book} Get views and downloads from Zenodo...")
-community = 'crc172-ac3'
-records = fn.query_zenodo(community)
-total_views = 0
-total_downloads = 0
-
-for record in records:
-    stats = record.get('stats', {})
-    total_views += stats.get('unique_views', 0)
-    total_downloads += stats.get('unique_downloads', 0)
-
-logging.info(f'Total Views from Zenodo: {total_views}')
-logging.info(f'Total Downloads from Zenodo: {total_downloads}')
-
-# %% Load JSON files with all AC3 publications and do some preprocessing
-with open(f'./data/{date}-datasets_ac3_zenodo.json', 'r', encoding='utf-8') as z_file:
-    zenodo_data = json.load(z_file)
-
-with open(f'./data/{date}-datasets_ac3_pangaea.json', 'r', encoding='utf-8') as p_file:
-    pangaea_data = json.load(p_file)
-
-# Merge the datasets
-all_data = zenodo_data + pangaea_data
-
-# Create a DataFrame
-df = pd.DataFrame(all_data)
-# get values out of a single valued lists
-df = df.map(fn.extract_single_value)
-
-# Convert date to actual dates
-dates = []
-for d in df['date']:
-    if d == 'No date':
-        dates.append(pd.NaT)
-        continue
-    try:
-        dates.append(pd.to_datetime(d))
-    except:
-        dates.append(pd.to_datetime(d, format='%Y'))
-
-df['date'] = dates
-
-# drop rows with no dates -> data set is still in review
-df = df.dropna(subset='date')
-
-# create categorical columns
-categorical_columns = ['type', 'publisher']  # Modify this based on your data
-df[categorical_columns] = df[categorical_columns].apply(lambda x: x.astype('category') if x.name in categorical_columns else x)
-
-# %% remove dataset collections
-df = df[~df.type.isin(['dataset bundled publication', 'dataset bibliography', 'dataset publication series'])]
-
-# %% keep only the latest version of each Zenodo data set
-df_sub = df[df.publisher == 'Zenodo']
-df_sub = df_sub.sort_values(by='title').reset_index(drop=True)
-
-# Extract the last relation as the common DOI
-df_sub['common_doi'] = df_sub['relation'].apply(lambda x: x[-1] if isinstance(x, list) and x else None)
-
-# Sort by 'created' and keep only the latest version per common DOI
-latest_versions = df_sub.sort_values('date').groupby('common_doi', as_index=False).last()
-
-# %% add cleaned zenodo df to df
-df = pd.concat([df[df['publisher'] == 'PANGAEA'], latest_versions.drop('common_doi', axis=1)]).reset_index(drop=True)
-
-# %% Add year column
-df['year'] = df['date'].dt.year
-
-# Calculate the number of publications per year
-yearly_publications = df.groupby(['year', 'publisher'], observed=False).size().reset_index(name='count')
-
-# Calculate cumulative publications
-yearly_publications['cumulative_count'] = yearly_publications['count'].cumsum()
-publisher_sel = yearly_publications['publisher'] == 'Zenodo'
-yearly_publications['cumulative_count_zenodo'] = yearly_publications[publisher_sel]['count'].cumsum()
-yearly_publications['cumulative_count_pangaea'] = yearly_publications[~publisher_sel]['count'].cumsum()
-
-# %% Formatting for plots
-cm = 1 / 2.54
-fmt_dict = dict(presentation=
-                dict(figsize=(15 * cm, 7.5 * cm),
-                     lw=2,
-                     fontsize=12,
-                     legendfontsize=10),
-                poster=
-                dict(figsize=(40 * cm, 15 * cm),
-                     lw=6,
-                     fontsize=40,
-                     legendfontsize=24
-                     )
-                )
-
-# %% Create mask for wordcloud
-from matplotlib.patches import Ellipse
-
-ellipse = Ellipse((0, 0), 8, 4, angle=0)
-_, ax = plt.subplots()
-ax.set(xlim=(-4.2, 4.2), ylim=(-2.2, 2.2))  # , aspect="equal")
-ax.add_artist(ellipse)
-plt.savefig('./figures/ellipse_mask.png')
-# plt.show()
-plt.close()
-
-# %% Generate and plot a wordcloud made out of the most common words in the data sets
-titles = df['title'].to_list()
-mask = np.array(Image.open('figures/ellipse_mask.png'))
-
-logging.info(f'\N{cloud} Number of titles for word cloud: {len(titles)}')
-
-titles_combined = ''
-
-for t in titles:
-    t1 = t
-    for rr in ['Ny-Ålesund', 'Ny-Alesund']:
-        t1 = t1.replace(rr, 'NyÅlesund')
-    for rr in ['in situ', 'in-situ']:
-        t1 = t1.replace(rr, 'InSitu')
-    for rr in ['measurements']:
-        t1 = t1.replace(rr, 'measurement')
-    t1 = ' ' + t1
-    titles_combined += t1
-
-stopwords = set(STOPWORDS)
-stopwords.add('borne')
-stopwords.add('tethered')
-stopwords.add('VISSS')
-stopwords.add('Situ')
-stopwords.add('Snowfall')
-stopwords.add('Sensor')
-stopwords.add('Hyytiäla')
-stopwords.add('Video')
-
-wordcloud = WordCloud(mask=mask, collocations=True,
-                      stopwords=stopwords, max_words=100,
-                      collocation_threshold=50,
-                      background_color=None,
-                      max_font_size=60, relative_scaling=0.2,
-                      contour_width=0, mode='RGBA')
-
-wordcloud = wordcloud.generate(titles_combined)
-
-fig, ax = plt.subplots(1)
-ax.imshow(wordcloud, interpolation='bilinear')
-ax.axis('off')
-fig.savefig('figures/wordcloud_ellipse_{date}.png', dpi=300, transparent=False)
-# plt.show()
-plt.close()
-
-# %% Plot cumulative publications and yearly publications
-mode = 'presentation'
-fmt = fmt_dict[mode]
-plt.rc('font', size=fmt['fontsize'])
-yearly_publications = yearly_publications[(yearly_publications['year'] >= 2016) &
-                                          (yearly_publications['year'] < 2028)]
-fig, ax = plt.subplots(figsize=fmt['figsize'], layout='constrained')
-# Plot the bar chart for yearly publications
-sns.barplot(data=yearly_publications, x='year', y='count', hue='publisher')
-
-# Plot the line chart for cumulative publications
-sns.pointplot(data=yearly_publications, x='year', y='cumulative_count',
-             marker='o', label='Cumulative\npublications',
-             color='orange', lw=fmt['lw'],
-             ax=ax)
-
-# Get x-axis categorical positions
-x_positions = range(len(yearly_publications['year'].unique()))
-
-# Loop through points to annotate
-y_pubs = pd.DataFrame(yearly_publications.groupby('year')['count'].sum())
-y_pubs['cumsum'] = y_pubs.cumsum()
-for x, y, label in zip(x_positions, y_pubs['cumsum'], y_pubs['cumsum']):
-    ax.text(x, y + 0.2, str(label), ha='right', fontsize=fmt['legendfontsize'])
-
-# Add labels and title
-ax.set(
-    # title='Yearly Publications and Cumulative Publications',
-    title='',
-    xlabel='Year',
-    ylabel='Count',
-)
-ax.legend(fontsize=fmt['legendfontsize'])
-ax.tick_params(axis='x', rotation=45)  # Rotates the x-axis tick labels by 45 degrees
-ax.yaxis.set_major_locator(plt.MultipleLocator(base=500))
-
-figname = f'./figures/{date}_yearly_cumulative_publications_{mode}.png'
-plt.savefig(figname, dpi=300)
-# plt.show()
-plt.close()
-logging.info(f'Saved {figname}')
-
-# %% Plot cumulative publications and yearly publications separated by repository
-mode = 'presentation'
-fmt = fmt_dict[mode]
-plt.rc('font', size=fmt['fontsize'])
-
-# Filter data
-yearly_publications = yearly_publications[
-    (yearly_publications['year'] >= 2016) &
-    (yearly_publications['year'] < 2028)
-    ]
-
-# Create figure with two rows (one per publisher)
-fig, axes = plt.subplots(
-    2, 1, figsize=fmt['figsize'], layout='constrained'
-)
-
-# Set up the barplot and pointplot for each publisher
-publishers = yearly_publications['publisher'].unique()
-for i, publisher in enumerate(publishers):
-    # Filter data for this publisher
-    df_pub = yearly_publications[yearly_publications['publisher'] == publisher]
-
-    # Bar plot (yearly count)
-    sns.barplot(
-        data=df_pub,
-        x='year',
-        y='count',
-        ax=axes[i],
-        color='steelblue',
-        alpha=0.8
-    )
-
-    # Point plot (cumulative count)
-    sns.pointplot(
-        data=df_pub,
-        x='year',
-        y=f'cumulative_count_{publisher.lower()}',
-        marker='o',
-        color='orange',
-        lw=fmt['lw'],
-        ax=axes[i],
-        label='Cumulative publications',
-        legend=None,
-    )
 
-    # Annotate cumulative values
-    y_pubs = df_pub.groupby('year')['count'].sum().cumsum()
-    for x, y in enumerate(y_pubs):
-        axes[i].text(x, y + 0.2, str(int(y)), ha='center', fontsize=fmt['legendfontsize'])
+@fn.metrics.stage('zenodo_usage')
+def log_zenodo_usage(community='crc172-ac3'):
+    """Log the total views and downloads of all data sets of a Zenodo community."""
+    logging.info("\N{book} Get views and downloads from Zenodo...")
+    total_views = 0
+    total_downloads = 0
+    for record in fn.query_zenodo(community):
+        stats = record.get('stats', {})
+        total_views += stats.get('unique_views', 0)
+        total_downloads += stats.get('unique_downloads', 0)
+
+    logging.info(f'Total Views from Zenodo: {total_views}')
+    logging.info(f'Total Downloads from Zenodo: {total_downloads}')
+
+
+@fn.metrics.stage('load_publications')
+def load_publications(date, exclude_duplicates=False, query=None, bbox=None):
+    """
+    Load the latest version of every AC3 data set of a harvest and the number of publications per year.
+
+    :param date: Date of the harvest (yyyymmdd).
+    :param exclude_duplicates: (False) count only the earliest data set of each cluster of near-duplicates.
+    :param query: (None) only data sets matching this full-text search, see :meth:`functions.SearchIndex.search`.
+    :param bbox: (None) only data sets overlapping this bounding box (south, west, north, east),
+                 see :meth:`functions.SpatialIndex.within`.
+    :return: Tuple of the corpus (pandas.DataFrame) and the yearly publications, see
+             :meth:`functions.PublicationAggregates.yearly_publications`.
+    """
+    # only load the columns needed for the plots
+    columns = ['oai_identifier', 'doi', 'title', 'date', 'type', 'publisher', 'concept_doi', 'authors', 'relation']
+    df = fn.load_corpus(date, columns)
+
+    # Publications per year and publisher and the latest version of each data set, materialised by the harvest
+    aggregates = fn.publication_aggregates(df, date)
+
+    # keep only the latest version of each data set
+    # publications have a date (the others are still in review) and are no collections, see fn.PublicationAggregates
+    df = df[df['oai_identifier'].isin(aggregates.latest_version_ids())].reset_index(drop=True)
+
+    if exclude_duplicates:
+        # Flag near-duplicate data sets, e.g. published on both PANGAEA and Zenodo
+        duplicates = fn.find_duplicates(df)
+        clusters = df.join(duplicates)[duplicates['duplicate_cluster'].notna()]
+        clusters = clusters.sort_values(['duplicate_cluster', 'date'])
+        clusters[['duplicate_cluster', 'duplicate', 'oai_identifier', 'publisher', 'doi', 'title']].to_csv(
+            f'./data/{date}-duplicate_clusters.csv', index=False)
+        # count only the earliest data set of each cluster
+        df = df[~duplicates['duplicate']].reset_index(drop=True)
+    if query:
+        # the search index is kept up to date by the harvest
+        df = df[df['oai_identifier'].isin(fn.load_search_index(date).matching_ids(query))].reset_index(drop=True)
+        logging.info(f'\N{left-pointing magnifying glass} {len(df)} data sets match "{query}"')
+    if bbox:
+        df = df[df['oai_identifier'].isin(fn.load_spatial_index(date).matching_ids(*bbox))].reset_index(drop=True)
+        logging.info(f'\N{globe with meridians} {len(df)} data sets within {bbox}')
+    if exclude_duplicates or query or bbox:
+        aggregates = fn.PublicationAggregates(':memory:')
+        aggregates.apply_frame(df)
+
+    return df, aggregates.yearly_publications()
+
+
+def figure_name(date, query=None, bbox=None):
+    """Date of the figure file names, followed by the words of a search query and the bounding box."""
+    return '_'.join([date, *re.findall(r'\w+', (query or '').lower()), *(f'{value:g}' for value in bbox or ())])
+
+
+def yearly_publication_jobs(date, yearly_publications, mode='presentation'):
+    """Render jobs (see :func:`plots.render_figures`) of the yearly and cumulative publications."""
+    import plots
+
+    fmt = plots.FMT_DICT[mode]
+    yearly_publications = yearly_publications[(yearly_publications['year'] >= 2016) &
+                                              (yearly_publications['year'] < 2028)]
+    # the figures are drawn from the aggregated numbers only
+    arrays = plots.yearly_publication_arrays(yearly_publications)
+    return [
+        # Plot cumulative publications and yearly publications
+        dict(func=plots.render_yearly_publications,
+             output=f'./figures/{date}_yearly_cumulative_publications_{mode}.png',
+             kwargs=dict(years=arrays['years'], publishers=arrays['publishers'], counts=arrays['counts'],
+                         cumulative=arrays['cumulative'], fmt=fmt, dpi=300)),
+        # Plot cumulative publications and yearly publications separated by repository
+        dict(func=plots.render_yearly_publications_per_repo,
+             output=f'./figures/{date}_yearly_cumulative_publications_per_repo_{mode}.png',
+             kwargs=dict(years=arrays['years'], publishers=arrays['publishers'], counts=arrays['counts'],
+                         cumulative_per_publisher=arrays['cumulative_per_publisher'], fmt=fmt, dpi=300)),
+    ]
 
-    # Labels and formatting
-    axes[i].set(
-        xlabel='Year',
-        ylabel='Count',
-        title=f'{publisher}',
-    )
 
-# Adjust legend (only one needed)
-handles, labels = axes[0].get_legend_handles_labels()
-fig.legend(handles, labels, loc='upper left',
-           bbox_to_anchor=(0.15, 0.9),
-           fontsize=fmt['legendfontsize'])
-# First row
-axes[0].set(
-    xlabel='',
-    xticklabels=''
-)
-axes[0].yaxis.set_major_locator(plt.MultipleLocator(base=500))
-# Second row
-axes[1].tick_params(axis='x', rotation=45)
-axes[1].yaxis.set_major_locator(plt.MultipleLocator(base=10))
-
-# Save and show
-figname = f'./figures/{date}_yearly_cumulative_publications_per_repo_{mode}.png'
-plt.savefig(figname,
-            dpi=300,
-            bbox_inches='tight')
-# plt.show()
-plt.close()
+@fn.metrics.stage('wordcloud_counts')
+def wordcloud_job(date, df, keep_counts=True):
+    """
+    Render job (see :func:`plots.render_figures`) of a word cloud made out of the most common words in the titles.
+
+    :param date: Date of the harvest (yyyymmdd), see :func:`figure_name`.
+    :param df: Data sets with the columns doi and title.
+    :param keep_counts: (True) update the word counts kept between runs, False for a subset of the data sets.
+    """
+    from wordcloud import STOPWORDS
+    import plots
+
+    titles = df['title'].to_list()
+    logging.info(f'\N{cloud} Number of titles for word cloud: {len(titles)}')
+    stopwords = set(STOPWORDS) | set(EXTRA_STOPWORDS)
+
+    if keep_counts:
+        # the word counts are kept between runs, only titles of new or changed data sets are tokenised
+        counter = fn.TitleWordCounter.load('./data/title_word_counts.json', stopwords)
+        n_added, n_removed = counter.sync(dict(zip(df['doi'], titles)))
+        counter.save('./data/title_word_counts.json')
+        logging.info(f'Word counts updated with {n_added} new and {n_removed} removed titles')
+    else:
+        counter = fn.TitleWordCounter(stopwords)
+        counter.sync(dict(zip(df['doi'], titles)))
+
+    return dict(func=plots.render_wordcloud,
+                output=f'./figures/wordcloud_ellipse_{date}.png',
+                kwargs=dict(frequencies=counter.frequencies(collocation_threshold=50),
+                            # same size as the ellipse in the former matplotlib mask (8 x 4 data units in 640 x 480 px)
+                            mask=dict(shape='ellipse', width=472, height=336),
+                            wordcloud_kwargs=dict(max_words=100, background_color=None, max_font_size=60,
+                                                  relative_scaling=0.2, contour_width=0, mode='RGBA'),
+                            dpi=300))
+
+
+@fn.metrics.stage('density_counts')
+def density_map_job(name, df, spatial_index, resolution=1.):
+    """
+    Render job (see :func:`plots.render_figures`) of a map of the number of data sets per grid cell of their location.
+
+    :param name: Name of the figure, see :func:`figure_name`.
+    :param df: Data sets with the column oai_identifier.
+    :param spatial_index: functions.SpatialIndex of the harvest.
+    :param resolution: (1.) size of the grid cells in degrees.
+    :return: Render job or None if no data set has a location.
+    """
+    import plots
+
+    # counted in the index, only the cells with data sets are passed on
+    density = spatial_index.density(resolution, identifiers=df['oai_identifier'])
+    logging.info(f'\N{world map} {sum(density["counts"])} data sets with a location in {len(density["counts"])} cells')
+    if not density['counts']:
+        return None
+    return dict(func=plots.render_density_map,
+                output=f'./figures/{name}_density_map.png',
+                kwargs=dict(**density, fmt=plots.FMT_DICT['square'], dpi=300))
+
+
+def main(date, exclude_duplicates=False, yearly=True, wordcloud=True, density_map=True, query=None, bbox=None):
+    """
+    Make the publication figures of a harvest.
+    All figures are rendered in parallel, figures whose numbers did not change are not rendered again.
+
+    :param date: Date of the harvest (yyyymmdd).
+    :param exclude_duplicates: (False) count only the earliest data set of each cluster of near-duplicates.
+    :param yearly: (True) plot the yearly and cumulative publications.
+    :param wordcloud: (True) plot the word cloud of the titles.
+    :param density_map: (True) plot the map of the number of data sets per 1° cell of their location.
+    :param query: (None) only plot the data sets matching this full-text search,
+                  the words of the query are added to the file names.
+    :param bbox: (None) only plot the data sets overlapping this bounding box (south, west, north, east),
+                 it is added to the file names.
+    :return: Report of :func:`plots.render_figures`.
+    """
+    import plots
+
+    subset = query or bbox
+    if yearly and not subset:
+        log_zenodo_usage()
+    df, yearly_publications = load_publications(date, exclude_duplicates, query, bbox)
+    if df.empty:
+        logging.warning('No data sets to plot.')
+        return plots.render_figures([])
+    name = figure_name(date, query, bbox)
+    jobs = []
+    if wordcloud:
+        jobs.append(wordcloud_job(name, df, keep_counts=not subset))
+    if yearly:
+        jobs += yearly_publication_jobs(name, yearly_publications)
+    if density_map:
+        jobs.append(density_map_job(name, df, fn.load_spatial_index(date)))
+    return plots.render_figures([job for job in jobs if job])
+
+
+if __name__ == '__main__':
+    # Set up logging
+    logging.basicConfig(level=logging.INFO,
+                        format='%(message)s')
+    console = logging.StreamHandler()
+    console.setLevel(logging.INFO)
+    logging.getLogger(__name__).addHandler(console)
+
+    # Serve repeated requests within a day from ./data/http_cache.sqlite
+    fn.enable_http_cache()
+
+    # Debug mode
+    # args = get_args(debug=True, date="20251022")
+    args = get_args()
+    main(args.date, args.exclude_duplicates, query=args.query, bbox=args.bbox)
+    # timings, requests and counters of this run
+    fn.metrics.write_report(f'./data/{args.date}-run_report_plot.json', command='plot', args=vars(args))
@@ -3,164 +3,157 @@
 | *created*: 10.02.26
 | *author*: Johannes Röttenbacher
 
-Get usage statistics from Zenodo and PANGAEA and plot a pie chart from it
+Get usage statistics from Zenodo and PANGAEA and plot a pie chart from it.
+Every run adds a snapshot for its date to ``data/usage_statistics.sqlite``,
+so the usage trend over all snapshots is plotted as well.
+Also run by ``python cli.py stats``.
 """
-from os import WCONTINUED
-
+import argparse
 import functions as fn
 import json
 import logging
-import matplotlib.pyplot as plt
-import matplotlib.ticker as ticker
-import pandas as pd
 from pathlib import Path
-import requests
 import time
-from tqdm import tqdm
-
-# Set up logging
-logging.basicConfig(level=logging.INFO,
-                    format='%(message)s')
-console = logging.StreamHandler()
-console.setLevel(logging.INFO)
-logging.getLogger(__name__).addHandler(console)
-
-date = 20260210
-# %% Get Zenodo stats
-zenodo_stats_path = Path(f'./data/{date}_usage_stats_zenodo.json')
-if zenodo_stats_path.exists():
-    print('File already exists.')
-    with open(zenodo_stats_path, 'r', encoding='utf-8') as f:
-        stats_zenodo = json.load(f)
-else:
-    logging.info("\N{book} Get views and downloads from Zenodo...")
-    community = 'crc172-ac3'
-    records = fn.query_zenodo(community)
-    total_views = 0
-    total_downloads = 0
-
-    stats_zenodo = dict(doi=[], metadata_views=[], data_views=[], downloads=[])
-    for record in records:
-        stats = record.get('stats', {})
-        total_views += stats.get('unique_views', 0)
-        total_downloads += stats.get('unique_downloads', 0)
-        stats_zenodo['doi'].append(record.get('doi_url', ''))
-        stats_zenodo['metadata_views'].append(0)
-        stats_zenodo['data_views'].append(stats.get('unique_views', 0))
-        stats_zenodo['downloads'].append(stats.get('unique_downloads', 0))
-
-    with open(zenodo_stats_path, 'w') as f:
-        json.dump(stats_zenodo, f)
-
-zenodo_df = pd.DataFrame(stats_zenodo)
-zenodo_df['publisher'] = 'Zenodo'
-
-# %% Get PANGAEA stats
-stats_path = Path(f'./data/{date}_usage_stats_pangaea.json')
-if stats_path.exists():
-    print('File already exists.')
-    with open(stats_path, 'r', encoding='utf-8') as f:
-        stats_dict = json.load(f)
-else:
-    logging.info("\N{book} Get views and downloads from PANGAEA...")
-    # get all ac3 datasets from latest metadata harvest
-    with open(f'./data/{date}-datasets_ac3_pangaea.json', 'r', encoding='utf-8') as p_file:
-        pangaea_data = json.load(p_file)
-
-    # Create a DataFrame
-    df = pd.DataFrame(pangaea_data)
-    # get values out of a single valued lists
-    df = df.map(fn.extract_single_value)
-
-    stats = []
-    stats_dict = dict(doi=[], metadata_views=[], data_views=[], downloads=[])
-    # Query the PANGAEA website
-    for doi in tqdm(df['doi']):
-        r = requests.get(doi + '?format=statistics')
-        try:
-            j = json.loads(r.text)
-        except:
-            print('Problem with get_usage_statistics(', doi, ')')
-            j = {}
-        stats_dict['doi'].append(doi)
-        stats_dict['metadata_views'].append(j.get('metadata_views', 0))
-        stats_dict['data_views'].append(j.get('data_views', 0))
-        stats_dict['downloads'].append(j.get('downloads', 0))
-        stats.append(j)
-        time.sleep(0.1)
-
-    # save to json file for reuse
-    with open(f'./data/{date}_usage_stats_pangaea.json', 'w') as outfile:
-        json.dump(stats_dict, outfile)
-
-pangaea_df = pd.DataFrame(stats_dict)
-pangaea_df['publisher'] = 'PANGAEA'
-
-# %% merge data frames
-df = pd.concat([pangaea_df, zenodo_df])
-
-# %% create pie and bar charts
-cm = 1/2.54
-fmt_dict = dict(presentation=
-                dict(figsize=(15 * cm, 15 * cm),
-                     lw=2,
-                     fontsize=12,
-                     legendfontsize=10),
-                )
-mode = 'presentation'
-fmt = fmt_dict[mode]
-plt.rc('font', size=fmt['fontsize'])
-# Funktion zum Erzeugen eines Pie-Charts
-def create_pie_chart(df, title):
-    sums = df[['metadata_views', 'data_views', 'downloads']].sum()
-    labels = ['Metadata Views', 'Data Views', 'Downloads']
-    plt.figure(figsize=fmt['figsize'], dpi=300)
-    plt.pie(sums,
-            labels=labels,
-            labeldistance=0.6,
-            pctdistance=0.5,
-            autopct=lambda p: f'{int(p * sum(sums) / 100):,}',
-            startangle=140
-            )
-    plt.title(title)
-
-
-def create_bar_chart(df, title):
-    sums = df[['metadata_views', 'data_views', 'downloads']].sum()
-    labels = ['Metadata Views', 'Data Views', 'Downloads']
-    plt.figure(figsize=fmt['figsize'], dpi=300, constrained_layout=True)
-    bars = plt.bar(labels, sums, color=['tab:blue', 'tab:orange', 'tab:green'])
-    plt.ylabel('Count')
-    formatter = ticker.FuncFormatter(lambda x, p: format(int(x), ','))
-    plt.gca().yaxis.set_major_formatter(formatter)
-    for bar in bars:
-        yval = bar.get_height()
-        plt.text(bar.get_x() + bar.get_width() / 2, yval, f'{int(yval):,}', ha='center', va='bottom')
-    plt.title(title)
-
-# Pie-Chart für PANGAEA
-pangaea_df = df[df['publisher'] == 'PANGAEA']
-create_pie_chart(pangaea_df, 'PANGAEA Publications')
-plt.savefig(f'./figures/{date}_usage_statistics_pangaea_pie.png', dpi=300)
-plt.show()
-create_bar_chart(pangaea_df, 'PANGAEA Publications')
-plt.savefig(f'./figures/{date}_usage_statistics_pangaea_bar.png', dpi=300)
-plt.show()
-
-# Pie-Chart für Zenodo (falls vorhanden)
-zenodo_df = df[df['publisher'] == 'Zenodo']
-if not zenodo_df.empty:
-    create_pie_chart(zenodo_df, 'Zenodo Publications')
-    plt.savefig(f'./figures/{date}_usage_statistics_zenodo_pie.png', dpi=300)
-    plt.show()
-    create_bar_chart(zenodo_df, 'Zenodo Publications')
-    plt.savefig(f'./figures/{date}_usage_statistics_zenodo_bar.png', dpi=300)
-    plt.show()
-
-# Pie-Chart für alle Publikationen
-create_pie_chart(df, 'All Publications on PANGAEA and Zenodo')
-plt.savefig(f'./figures/{date}_usage_statistics_pie.png', dpi=300)
-plt.show()
-create_bar_chart(df, 'All Publications on PANGAEA and Zenodo')
-plt.savefig(f'./figures/{date}_usage_statistics_bar.png', dpi=300)
-plt.show()
\ No newline at end of file
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description="Get usage statistics from Zenodo and PANGAEA for the (AC)³ community")
+    parser.add_argument("date",
+                        help="Date (yyyymmdd) of the metadata harvest to get the usage statistics for.",
+                        default=time.strftime("%Y%m%d", time.localtime()),
+                        nargs='?')
+    parser.add_argument("--exclude-duplicates", action="store_true",
+                        help="Leave out the usage of near-duplicates of other data sets.")
+    return parser.parse_args()
+
+
+def import_json_snapshot(store, date, path, publisher):
+    # snapshots from before the store was introduced
+    import pandas as pd
+
+    with open(path, 'r', encoding='utf-8') as f:
+        stats = json.load(f)
+    store.add_snapshot(date, publisher, pd.DataFrame(stats).to_dict('records'))
+
+
+@fn.metrics.stage('collect_snapshot')
+def collect_snapshot(store, date):
+    """Add the usage statistics of Zenodo and PANGAEA at `date` to the store unless they are stored already."""
+    # Get Zenodo stats
+    zenodo_stats_path = Path(f'./data/{date}_usage_stats_zenodo.json')
+    if store.has_snapshot(date, 'Zenodo'):
+        logging.info(f'Zenodo usage statistics for {date} already stored.')
+    elif zenodo_stats_path.exists():
+        import_json_snapshot(store, date, zenodo_stats_path, 'Zenodo')
+    else:
+        logging.info("\N{book} Get views and downloads from Zenodo...")
+        community = 'crc172-ac3'
+        records = fn.query_zenodo(community)
+        results = []
+        for record in records:
+            stats = record.get('stats', {})
+            results.append(dict(doi=record.get('doi_url', ''),
+                                metadata_views=0,
+                                data_views=stats.get('unique_views', 0),
+                                downloads=stats.get('unique_downloads', 0)))
+        store.add_snapshot(date, 'Zenodo', results)
+
+    # Get PANGAEA stats
+    stats_path = Path(f'./data/{date}_usage_stats_pangaea.json')
+    if store.has_snapshot(date, 'PANGAEA'):
+        logging.info(f'PANGAEA usage statistics for {date} already stored.')
+    elif stats_path.exists():
+        import_json_snapshot(store, date, stats_path, 'PANGAEA')
+    else:
+        logging.info("\N{book} Get views and downloads from PANGAEA...")
+        # get all ac3 datasets from latest metadata harvest
+        df = fn.load_corpus(date, ['doi', 'publisher'])
+        df = df[df['publisher'] == 'PANGAEA']
+
+        # Query the PANGAEA website concurrently, results are checkpointed so a rerun only fetches missing DOIs
+        results = fn.fetch_pangaea_usage_statistics(df['doi'],
+                                                    checkpoint_file=f'./data/{date}_usage_stats_pangaea.ndjson')
+        store.add_snapshot(date, 'PANGAEA', results)
+
+
+@fn.metrics.stage('usage_charts')
+def usage_charts(store, date, exclude_duplicates=False):
+    """
+    Pie and bar charts of the usage statistics at `date` and the usage trend over all snapshots.
+
+    :param store: functions.UsageStore with the snapshots.
+    :param date: Date of the snapshot (yyyymmdd).
+    :param exclude_duplicates: (False) leave out the usage of near-duplicates of other data sets.
+    :return: Report of :func:`plots.render_figures`.
+    """
+    import plots
+
+    # usage statistics of both repositories at this date
+    df = store.snapshot(date)
+    if exclude_duplicates:
+        # near-duplicates among the latest versions, Zenodo only reports the usage of the latest versions
+        corpus = fn.load_corpus(date, ['oai_identifier', 'doi', 'title', 'date', 'type', 'publisher', 'concept_doi',
+                                       'authors', 'relation'])
+        corpus = corpus[corpus['oai_identifier'].isin(fn.publication_aggregates(corpus, date).latest_version_ids())]
+        duplicates = fn.find_duplicates(corpus)
+        duplicate_dois = set(corpus.loc[duplicates['duplicate'], 'doi'].map(fn.normalise_doi))
+        df = df[~df['doi'].map(fn.normalise_doi).isin(duplicate_dois)]
+
+    # create pie and bar charts
+    mode = 'square'
+    fmt = plots.FMT_DICT[mode]
+    columns = ['metadata_views', 'data_views', 'downloads']
+    charts = [('pangaea', 'PANGAEA Publications', df[df['publisher'] == 'PANGAEA']),
+              ('zenodo', 'Zenodo Publications', df[df['publisher'] == 'Zenodo']),
+              (None, 'All Publications on PANGAEA and Zenodo', df)]
+    jobs = []
+    for name, title, df_sel in charts:
+        # Zenodo charts only if there are Zenodo publications
+        if df_sel.empty:
+            continue
+        suffix = f'_{name}' if name else ''
+        sums = df_sel[columns].sum().to_list()
+        jobs += [dict(func=plots.render_usage_pie, output=f'./figures/{date}_usage_statistics{suffix}_pie.png',
+                      kwargs=dict(sums=sums, title=title, fmt=fmt, dpi=300)),
+                 dict(func=plots.render_usage_bar, output=f'./figures/{date}_usage_statistics{suffix}_bar.png',
+                      kwargs=dict(sums=sums, title=title, fmt=fmt, dpi=300))]
+
+    # Usage of each repository over all snapshots
+    totals = store.repository_totals()
+    if totals['snapshot_date'].nunique() > 1:
+        jobs.append(dict(func=plots.render_usage_trend, output=f'./figures/{date}_usage_statistics_trend.png',
+                         kwargs=dict(totals=totals, fmt=plots.FMT_DICT['presentation'], dpi=300)))
+    return plots.render_figures(jobs)
+
+
+def main(date, exclude_duplicates=False, store_file='./data/usage_statistics.sqlite'):
+    """
+    Get the usage statistics of all AC3 data sets of a harvest, store them as snapshot and plot them.
+
+    :param date: Date of the harvest (yyyymmdd).
+    :param exclude_duplicates: (False) leave out the usage of near-duplicates of other data sets.
+    :param store_file: ('./data/usage_statistics.sqlite') store of all snapshots, see functions.UsageStore.
+    :return: Report of :func:`plots.render_figures`.
+    """
+    # Snapshots of all dates are kept in one store, so trends can be plotted without reading older files
+    store = fn.UsageStore(store_file)
+    collect_snapshot(store, date)
+    return usage_charts(store, date, exclude_duplicates)
+
+
+if __name__ == '__main__':
+    # Set up logging
+    logging.basicConfig(level=logging.INFO,
+                        format='%(message)s')
+    console = logging.StreamHandler()
+    console.setLevel(logging.INFO)
+    logging.getLogger(__name__).addHandler(console)
+
+    # Serve repeated requests within a day from ./data/http_cache.sqlite
+    fn.enable_http_cache()
+
+    args = get_args()
+    main(args.date, args.exclude_duplicates)
+    # timings, requests and counters of this run
+    fn.metrics.write_report(f'./data/{args.date}-run_report_stats.json', command='stats', args=vars(args))
@@ -0,0 +1,563 @@
+#!/usr/bin/env python
+"""
+| *author*: Johannes Röttenbacher
+| *created*: 17.10.2026
+
+Offline benchmark of the harvest, the usage statistics and the plots.
+
+Local stand-ins for the OAI-PMH ListRecords endpoint (with resumption tokens), the Zenodo records API
+(paging, `hits`, `stats`) and the PANGAEA statistics endpoint (`?format=statistics`) serve a synthetic corpus,
+so the numbers neither hit nor depend on the load of the real services.
+Latency and error rate of the stand-ins can be set, failed requests are answered with a 503.
+
+Every stage runs in a fresh process and is reported with its duration, records/s and peak memory (RSS)
+in ``data/<date>-benchmark_report.json``, e.g.::
+
+    python benchmark.py --records 1000 10000 100000 --latency 0.02 --error-rate 0.01
+
+Also run by ``python cli.py benchmark``.
+"""
+import argparse
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import http.server
+import json
+import logging
+import multiprocessing
+import os
+import random
+import resource
+import tempfile
+import threading
+import time
+from urllib.parse import parse_qsl, urlparse
+from xml.sax.saxutils import escape
+
+# Words the synthetic titles are made of
+TITLE_WORDS = ('Radiosonde', 'measurements', 'at', 'Ny-Ålesund', 'in situ', 'aircraft', 'Polar 5', 'Polar 6',
+               'cloud', 'radar', 'snowfall', 'Arctic', 'amplification', 'lidar', 'ship', 'Polarstern', 'campaign',
+               'AFLUX', 'MOSAiC', 'ACLOUD', 'PASCAL', 'HALO-(AC)3', 'tethered', 'balloon', 'aerosol', 'temperature',
+               'humidity', 'sea ice', 'albedo', 'microwave', 'radiometer', 'dropsonde', 'profiles', 'during',
+               'broadband', 'irradiance', 'liquid water path', 'precipitation', 'surface', 'fluxes', 'model',
+               'output', 'ICON', 'satellite', 'retrieval', 'ice nucleating particles', 'turbulence', 'wind',
+               'Svalbard', 'Fram Strait', 'boundary layer', 'water vapour', 'spectra', 'level 1', 'level 2')
+# Queries of the search stage
+SEARCH_QUERIES = ('Ny-Ålesund radiosonde', 'HALO-(AC)3 dropsonde', 'Polarstern', 'sea ice albedo', 'MOSAiC',
+                  'tethered balloon turbulence', 'Author42', 'LATITUDE 78')
+# Bounding boxes (south, west, north, east) of the spatial stage: Ny-Ålesund, Svalbard, Fram Strait, the Arctic
+BOUNDING_BOXES = ((78.8, 11.5, 79.0, 12.3), (76., 10., 81., 35.), (77., -10., 81., 10.), (66., -180., 90., 180.))
+# Stages in the order they depend on each other, see STAGES
+DEFAULT_STAGES = ('harvest_sickle', 'harvest_iterparse', 'zenodo', 'stats', 'corpus', 'aggregates', 'search',
+                  'spatial', 'duplicates', 'wordcloud_counts', 'render_yearly', 'render_yearly_per_repo',
+                  'render_wordcloud', 'render_usage', 'render_density_map')
+
+OAI_HEADER = ('<?xml version="1.0" encoding="UTF-8"?>'
+              '<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/"><responseDate>{now}</responseDate>')
+DC_HEADER = ('<oai_dc:dc xmlns:oai_dc="http://www.openarchives.org/OAI/2.0/oai_dc/" '
+             'xmlns:dc="http://purl.org/dc/elements/1.1/">')
+
+
+class SyntheticCorpus:
+    """
+    Reproducible synthetic corpus of Zenodo and PANGAEA data sets.
+    Records are generated on demand from their index, so even large corpora need no memory.
+    The datestamps increase with the index, one in four records is from Zenodo
+    and the Zenodo records come in groups of three versions sharing one concept DOI.
+
+    :param n_records: Number of records.
+    :param seed: (1) seed of the random titles, authors and usage statistics.
+    """
+
+    def __init__(self, n_records, seed=1):
+        self.n_records = n_records
+        self.seed = seed
+        self.n_zenodo = n_records // 4
+        self.sets = dict(zenodo=(0, self.n_zenodo), pangaea=(self.n_zenodo, n_records))
+        self._start = datetime(2016, 1, 1)
+        self._step = timedelta(days=10 * 365) / max(n_records, 1)
+        self._datestamps = _DatestampIndex(self)
+
+    def datestamp(self, i):
+        return (self._start + i * self._step).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+    def doi(self, i):
+        if i < self.n_zenodo:
+            return f'10.5281/zenodo.{1000000 + 2 * i}'
+        return f'10.1594/PANGAEA.{900000 + i}'
+
+    def record(self, i):
+        """Metadata of record `i` as dictionary of lists like the Dublin Core fields."""
+        rng = random.Random(self.seed * 1000003 + i)
+        zenodo = i < self.n_zenodo
+        record = dict(
+            oai_identifier=f'oai:zenodo.org:{1000000 + 2 * i}' if zenodo else f'oai:pangaea.de:doi:{self.doi(i)}',
+            datestamp=self.datestamp(i),
+            identifier=[f'https://doi.org/{self.doi(i)}'],
+            title=[' '.join(rng.choices(TITLE_WORDS, k=rng.randint(5, 10)))],
+            creator=[f'Author{rng.randint(0, 500)}, {chr(65 + rng.randint(0, 25))}.'
+                     for _ in range(rng.randint(1, 6))],
+            date=[str(2016 + i * 10 // max(self.n_records, 1))],
+            type=['Dataset' if rng.random() < 0.95 else 'Dataset publication series'],
+            coverage=[f'LATITUDE: {rng.uniform(60, 89):.4f} * LONGITUDE: {rng.uniform(-30, 40):.4f}'],
+            description=['Synthetic data set for the benchmark. ' * rng.randint(1, 10)],
+            publisher=['Zenodo' if zenodo else 'PANGAEA'],
+            relation=['https://zenodo.org/communities/crc172-ac3'],
+            subject=rng.sample(TITLE_WORDS, k=rng.randint(0, 3)),
+        )
+        if zenodo:
+            # versions of one data set share a concept DOI with a smaller record id
+            record['relation'].append(f'https://doi.org/10.5281/zenodo.{1000000 + 6 * (i // 3) - 1}')
+        return record
+
+    def stats(self, i):
+        """Usage statistics of record `i`."""
+        rng = random.Random(-self.seed * 1000003 - i)
+        return dict(metadata_views=rng.randint(0, 500), data_views=rng.randint(0, 200), downloads=rng.randint(0, 50))
+
+    def index_of_doi(self, doi):
+        """Index of the record with `doi` or None."""
+        prefix, _, number = doi.lower().rpartition('.')
+        if not number.isdigit():
+            return None
+        number = int(number)
+        if prefix.endswith('10.5281/zenodo') and number % 2 == 0 and 0 <= (number - 1000000) // 2 < self.n_zenodo:
+            return (number - 1000000) // 2
+        if prefix.endswith('10.1594/pangaea') and self.n_zenodo <= number - 900000 < self.n_records:
+            return number - 900000
+        return None
+
+
+class _DatestampIndex:
+    # sequence view of the datestamps for bisect
+    def __init__(self, corpus):
+        self.corpus = corpus
+
+    def __len__(self):
+        return self.corpus.n_records
+
+    def __getitem__(self, i):
+        return self.corpus.datestamp(i)
+
+
+def _oai_record(corpus, i):
+    record = corpus.record(i)
+    header = (f'<header><identifier>{record["oai_identifier"]}</identifier>'
+              f'<datestamp>{record["datestamp"]}</datestamp></header>')
+    fields = ''.join(f'<dc:{name}>{escape(value)}</dc:{name}>'
+                     for name in ('title', 'creator', 'identifier', 'date', 'type', 'coverage', 'description',
+                                  'publisher', 'relation', 'subject')
+                     for value in record[name])
+    return f'<record>{header}<metadata>{DC_HEADER}{fields}</oai_dc:dc></metadata></record>'
+
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Request handler of the stand-in services, configured by the attributes of its server (see :func:`start_stand_ins`):
+
+    - ``/oai``: OAI-PMH Identify and ListRecords with the sets `zenodo` and `pangaea`
+    - ``/api/records/``: Zenodo records API
+    - ``/<doi>?format=statistics``: PANGAEA usage statistics
+    """
+    # keep-alive connections like the real services
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        url = urlparse(self.path)
+        query = dict(parse_qsl(url.query))
+        with server.lock:
+            server.requests += 1
+            fail = server.rng.random() < server.error_rate
+            server.errors += fail
+        time.sleep(server.latency)
+        if fail:
+            return self._send(503, b'Service unavailable', 'text/plain')
+        if url.path == '/oai':
+            return self._send(200, self._oai(query).encode(), 'text/xml; charset=utf-8')
+        if url.path == '/api/records/':
+            return self._send(200, json.dumps(self._zenodo(query)).encode(), 'application/json')
+        if query.get('format') == 'statistics':
+            i = server.corpus.index_of_doi(url.path.lstrip('/'))
+            if i is None:
+                return self._send(404, b'{}', 'application/json')
+            return self._send(200, json.dumps(server.corpus.stats(i)).encode(), 'application/json')
+        self._send(404, b'Not found', 'text/plain')
+
+    def _send(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _oai(self, query):
+        corpus = self.server.corpus
+        body = OAI_HEADER.format(now=datetime.now().strftime('%Y-%m-%dT%H:%M:%SZ'))
+        if query.get('verb') == 'Identify':
+            return (f'{body}<Identify><repositoryName>Stand-in</repositoryName>'
+                    f'<earliestDatestamp>{corpus.datestamp(0)}</earliestDatestamp>'
+                    f'<granularity>YYYY-MM-DDThh:mm:ssZ</granularity></Identify></OAI-PMH>')
+        if 'resumptionToken' in query:
+            # the token holds the set, the next record and the end of the selection
+            set_name, start, stop = query['resumptionToken'].split('|')
+            start, stop = int(start), int(stop)
+        else:
+            set_name = query.get('set')
+            if set_name not in corpus.sets:
+                return f'{body}<error code="noSetHierarchy">Unknown set {set_name}</error></OAI-PMH>'
+            first, last = corpus.sets[set_name]
+            start = bisect_left(corpus._datestamps, query['from'], first, last) if 'from' in query else first
+            stop = bisect_right(corpus._datestamps, query['until'], first, last) if 'until' in query else last
+        if start >= stop:
+            return f'{body}<error code="noRecordsMatch">No records</error></OAI-PMH>'
+        end = min(start + self.server.page_size, stop)
+        body += '<ListRecords>' + ''.join(_oai_record(corpus, i) for i in range(start, end))
+        token = f'{set_name}|{end}|{stop}' if end < stop else ''
+        return f'{body}<resumptionToken cursor="{start}">{token}</resumptionToken></ListRecords></OAI-PMH>'
+
+    def _zenodo(self, query):
+        corpus = self.server.corpus
+        size = int(query.get('size', 10))
+        start = (int(query.get('page', 1)) - 1) * size
+        hits = []
+        for i in range(start, min(start + size, corpus.n_zenodo)):
+            stats = corpus.stats(i)
+            hits.append(dict(id=1000000 + 2 * i, doi=corpus.doi(i), doi_url=f'https://doi.org/{corpus.doi(i)}',
+                             metadata=dict(title=corpus.record(i)['title'][0]),
+                             stats=dict(unique_views=stats['data_views'], unique_downloads=stats['downloads'])))
+        return dict(hits=dict(hits=hits, total=corpus.n_zenodo))
+
+
+def start_stand_ins(corpus, latency=0., error_rate=0., page_size=100, seed=1):
+    """
+    Serve a synthetic corpus with the stand-in services in a background thread.
+
+    :param corpus: :class:`SyntheticCorpus` to serve.
+    :param latency: (0.) seconds to wait before answering a request.
+    :param error_rate: (0.) fraction of requests answered with a 503.
+    :param page_size: (100) number of records per OAI-PMH page.
+    :param seed: (1) seed of the injected errors.
+    :return: The running `http.server.ThreadingHTTPServer`, stop it with `shutdown()`.
+    """
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+    server.daemon_threads = True
+    server.corpus, server.latency, server.error_rate, server.page_size = corpus, latency, error_rate, page_size
+    server.rng, server.lock, server.requests, server.errors = random.Random(seed), threading.Lock(), 0, 0
+    server.url = f'http://127.0.0.1:{server.server_address[1]}'
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# %% benchmark stages
+# Every stage gets the context of the run and a timer, it only times the code under test and returns the number of
+# processed records. Stages read the files written by the stages before them.
+def _harvest(ctx, timer, parser):
+    import functions as fn
+
+    n_records = 0
+    with timer():
+        for set_name in ('zenodo', 'pangaea'):
+            output_file = f'{ctx["data_dir"]}/{ctx["date"]}-{parser}-datasets_ac3_{set_name}.ndjson.gz'
+            n_records += fn.get_metadata_from_repository(f'{ctx["url"]}/oai', set_name, output_file,
+                                                         parser=parser)['records']
+    return n_records
+
+
+def stage_harvest_sickle(ctx, timer):
+    return _harvest(ctx, timer, 'sickle')
+
+
+def stage_harvest_iterparse(ctx, timer):
+    n_records = _harvest(ctx, timer, 'iterparse')
+    # the later stages read the records files of this harvest
+    for set_name in ('zenodo', 'pangaea'):
+        os.replace(f'{ctx["data_dir"]}/{ctx["date"]}-iterparse-datasets_ac3_{set_name}.ndjson.gz',
+                   f'{ctx["data_dir"]}/{ctx["date"]}-datasets_ac3_{set_name}.ndjson.gz')
+    return n_records
+
+
+def stage_zenodo(ctx, timer):
+    import functions as fn
+
+    # a token gets pages of 100 instead of 25 records
+    os.environ['ACCESS_TOKEN'] = 'benchmark'
+    with timer():
+        records = fn.query_zenodo('crc172-ac3', base_url=f'{ctx["url"]}/api/records/')
+    return len(records)
+
+
+def stage_stats(ctx, timer):
+    import functions as fn
+
+    corpus = SyntheticCorpus(ctx['n_records'], ctx['seed'])
+    dois = [f'{ctx["url"]}/{corpus.doi(i)}' for i in range(*corpus.sets['pangaea'])]
+    store = fn.UsageStore(f'{ctx["data_dir"]}/usage_statistics.sqlite')
+    with timer():
+        results = fn.fetch_pangaea_usage_statistics(dois, rate=None)
+        store.add_snapshot(ctx['date'], 'PANGAEA', results)
+    return len(results)
+
+
+def stage_corpus(ctx, timer):
+    import functions as fn
+
+    record_files = [f'{ctx["data_dir"]}/{ctx["date"]}-datasets_ac3_{set_name}.ndjson.gz'
+                    for set_name in ('zenodo', 'pangaea')]
+    with timer():
+        return fn.write_corpus(f'{ctx["data_dir"]}/{ctx["date"]}-corpus_ac3.parquet', record_files)
+
+
+def stage_search(ctx, timer):
+    import functions as fn
+
+    index = fn.SearchIndex(f'{ctx["data_dir"]}/search_index.sqlite')
+    with timer():
+        for set_name in ('zenodo', 'pangaea'):
+            index.apply(fn.read_records(f'{ctx["data_dir"]}/{ctx["date"]}-datasets_ac3_{set_name}.ndjson.gz'),
+                        source=set_name, reset=True)
+        for query in SEARCH_QUERIES:
+            index.search(query)
+    return ctx['n_records']
+
+
+def stage_spatial(ctx, timer):
+    import functions as fn
+
+    index = fn.SpatialIndex(f'{ctx["data_dir"]}/spatial_index.sqlite')
+    with timer():
+        for set_name in ('zenodo', 'pangaea'):
+            index.apply(fn.read_records(f'{ctx["data_dir"]}/{ctx["date"]}-datasets_ac3_{set_name}.ndjson.gz'),
+                        source=set_name, reset=True)
+        for south, west, north, east in BOUNDING_BOXES:
+            index.within(south, west, north, east)
+        index.density()
+    return ctx['n_records']
+
+
+def _corpus(ctx):
+    import functions as fn
+
+    columns = ['oai_identifier', 'doi', 'title', 'date', 'type', 'publisher', 'concept_doi', 'authors', 'relation']
+    return fn.load_corpus(ctx['date'], columns, data_dir=ctx['data_dir'])
+
+
+def _yearly_publications(ctx):
+    import functions as fn
+    import plots
+
+    aggregates = fn.PublicationAggregates(':memory:')
+    aggregates.apply_frame(_corpus(ctx))
+    return plots.yearly_publication_arrays(aggregates.yearly_publications())
+
+
+def stage_aggregates(ctx, timer):
+    import functions as fn
+
+    df = _corpus(ctx)
+    with timer():
+        aggregates = fn.PublicationAggregates(':memory:')
+        aggregates.apply_frame(df)
+        aggregates.yearly_publications()
+        df[df['oai_identifier'].isin(aggregates.latest_version_ids())]
+    return len(df)
+
+
+def stage_duplicates(ctx, timer):
+    import functions as fn
+
+    df = _corpus(ctx)
+    with timer():
+        fn.find_duplicates(df)
+    return len(df)
+
+
+def _word_counter(ctx, df):
+    from wordcloud import STOPWORDS
+    import functions as fn
+
+    counter = fn.TitleWordCounter(set(STOPWORDS))
+    counter.sync(dict(zip(df['doi'], df['title'])))
+    return counter
+
+
+def stage_wordcloud_counts(ctx, timer):
+    df = _corpus(ctx)
+    with timer():
+        _word_counter(ctx, df).frequencies()
+    return len(df)
+
+
+def stage_render_yearly(ctx, timer):
+    import plots
+
+    arrays = _yearly_publications(ctx)
+    with timer():
+        plots.render_yearly_publications(f'{ctx["figure_dir"]}/yearly.png', arrays['years'], arrays['publishers'],
+                                         arrays['counts'], arrays['cumulative'], plots.FMT_DICT['presentation'])
+    return ctx['n_records']
+
+
+def stage_render_yearly_per_repo(ctx, timer):
+    import plots
+
+    arrays = _yearly_publications(ctx)
+    with timer():
+        plots.render_yearly_publications_per_repo(f'{ctx["figure_dir"]}/yearly_per_repo.png', arrays['years'],
+                                                  arrays['publishers'], arrays['counts'],
+                                                  arrays['cumulative_per_publisher'], plots.FMT_DICT['presentation'])
+    return ctx['n_records']
+
+
+def stage_render_wordcloud(ctx, timer):
+    import plots
+
+    frequencies = _word_counter(ctx, _corpus(ctx)).frequencies()
+    with timer():
+        plots.render_wordcloud(f'{ctx["figure_dir"]}/wordcloud.png', frequencies,
+                               mask=dict(shape='ellipse', width=472, height=336),
+                               wordcloud_kwargs=dict(max_words=100, background_color=None, max_font_size=60,
+                                                     relative_scaling=0.2, contour_width=0, mode='RGBA'))
+    return ctx['n_records']
+
+
+def stage_render_usage(ctx, timer):
+    import functions as fn
+    import plots
+
+    df = fn.UsageStore(f'{ctx["data_dir"]}/usage_statistics.sqlite').snapshot(ctx['date'])
+    sums = df[list(fn.USAGE_COLUMNS)].sum().to_list()
+    fmt = plots.FMT_DICT['square']
+    with timer():
+        plots.render_usage_pie(f'{ctx["figure_dir"]}/usage_pie.png', sums, 'Benchmark', fmt)
+        plots.render_usage_bar(f'{ctx["figure_dir"]}/usage_bar.png', sums, 'Benchmark', fmt)
+    return len(df)
+
+
+def stage_render_density_map(ctx, timer):
+    import functions as fn
+    import plots
+
+    density = fn.SpatialIndex(f'{ctx["data_dir"]}/spatial_index.sqlite').density()
+    with timer():
+        plots.render_density_map(f'{ctx["figure_dir"]}/density_map.png', **density, fmt=plots.FMT_DICT['square'])
+    return sum(density['counts'])
+
+
+STAGES = {name: globals()[f'stage_{name}'] for name in DEFAULT_STAGES}
+
+
+def _run_stage(name, ctx):
+    # runs in a fresh process, so the peak RSS only belongs to this stage
+    logging.basicConfig(level=logging.WARNING, format='%(message)s')
+    os.environ['TQDM_DISABLE'] = '1'
+    seconds = []
+
+    @contextmanager
+    def timer():
+        start = time.perf_counter()
+        yield
+        seconds.append(time.perf_counter() - start)
+
+    n_records = STAGES[name](ctx, timer)
+    # ru_maxrss is given in KiB on Linux
+    return n_records, sum(seconds), resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_benchmark(n_records, stages=DEFAULT_STAGES, latency=0., error_rate=0., page_size=100, seed=1, work_dir=None):
+    """
+    Serve a synthetic corpus with the stand-in services and run the benchmark stages against it.
+
+    :param n_records: Number of records of the synthetic corpus, see :class:`SyntheticCorpus`.
+    :param stages: (:data:`DEFAULT_STAGES`) stages to run, later stages need the files of `corpus` and the harvests.
+    :param latency: (0.) seconds the stand-ins wait before answering a request.
+    :param error_rate: (0.) fraction of requests the stand-ins answer with a 503.
+    :param page_size: (100) number of records per OAI-PMH page.
+    :param seed: (1) seed of the synthetic corpus and the injected errors.
+    :param work_dir: (None) directory for the harvested files and figures, a temporary directory otherwise.
+    :return: List with one dictionary per stage with the keys `records` (size of the corpus), `stage`,
+             `processed` (records processed by the stage), `seconds`, `records_per_second` and `peak_rss_mib`.
+    """
+    server = start_stand_ins(SyntheticCorpus(n_records, seed), latency, error_rate, page_size, seed)
+    results = []
+    with tempfile.TemporaryDirectory(prefix='benchmark_') as tmp_dir:
+        work_dir = work_dir or tmp_dir
+        ctx = dict(url=server.url, n_records=n_records, seed=seed, date=time.strftime('%Y%m%d'),
+                   data_dir=f'{work_dir}/data', figure_dir=f'{work_dir}/figures')
+        os.makedirs(ctx['data_dir'], exist_ok=True)
+        os.makedirs(ctx['figure_dir'], exist_ok=True)
+        try:
+            for name in stages:
+                with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+                    processed, seconds, peak_rss = executor.submit(_run_stage, name, ctx).result()
+                results.append(dict(records=n_records, stage=name, processed=processed, seconds=seconds,
+                                    records_per_second=processed / seconds if seconds else 0.,
+                                    peak_rss_mib=peak_rss))
+                logging.info(f'{n_records:>9} {name:<24} {processed:>9} {seconds:>9.2f} s '
+                             f'{results[-1]["records_per_second"]:>11.0f} records/s {peak_rss:>8.0f} MiB')
+        finally:
+            server.shutdown()
+    logging.info(f'Stand-ins answered {server.requests} requests, {server.errors} with an injected error')
+    return results
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description="Benchmark harvest, usage statistics and plots against local stand-ins of the services")
+    add_arguments(parser)
+    return parser.parse_args()
+
+
+def add_arguments(parser):
+    parser.add_argument("--records", type=int, nargs='+', default=[1000, 10000],
+                        help="Sizes of the synthetic corpora, e.g. 1000 10000 100000 1000000.")
+    parser.add_argument("--stages", nargs='+', default=list(DEFAULT_STAGES), choices=DEFAULT_STAGES,
+                        metavar='STAGE', help=f"Stages to run: {', '.join(DEFAULT_STAGES)}.")
+    parser.add_argument("--latency", type=float, default=0.,
+                        help="Seconds the stand-ins wait before answering a request.")
+    parser.add_argument("--error-rate", type=float, default=0.,
+                        help="Fraction of requests the stand-ins answer with a 503.")
+    parser.add_argument("--page-size", type=int, default=100,
+                        help="Number of records per OAI-PMH page.")
+    parser.add_argument("--report", default=f"./data/{time.strftime('%Y%m%d')}-benchmark_report.json",
+                        help="JSON file for the results.")
+
+
+def main(records=(1000, 10000), stages=DEFAULT_STAGES, latency=0., error_rate=0., page_size=100,
+         report_file=None):
+    """
+    Run the benchmark for corpora of several sizes.
+
+    :param records: ((1000, 10000)) sizes of the synthetic corpora.
+    :param stages: (:data:`DEFAULT_STAGES`) stages to run.
+    :param latency: (0.) seconds the stand-ins wait before answering a request.
+    :param error_rate: (0.) fraction of requests the stand-ins answer with a 503.
+    :param page_size: (100) number of records per OAI-PMH page.
+    :param report_file: (None) JSON file to write the results to.
+    :return: List of the results of :func:`run_benchmark`.
+    """
+    logging.info(f'{"records":>9} {"stage":<24} {"processed":>9} {"duration":>11} {"throughput":>21} '
+                 f'{"peak RSS":>12}')
+    results = []
+    for n_records in records:
+        results += run_benchmark(n_records, stages, latency, error_rate, page_size)
+    if report_file:
+        with open(report_file, 'w', encoding='utf-8') as f:
+            json.dump(dict(latency=latency, error_rate=error_rate, page_size=page_size, results=results), f,
+                      indent=4)
+        logging.info(f'Benchmark report written to {report_file}')
+    return results
+
+
+if __name__ == '__main__':
+    # Set up logging
+    logging.basicConfig(level=logging.INFO,
+                        format='%(message)s')
+
+    args = get_args()
+    main(args.records, args.stages, args.latency, args.error_rate, args.page_size, args.report)
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+"""
+| *author*: Johannes Röttenbacher
+| *created*: 17.10.2026
+
+Command line interface for all steps of the (AC)³ data publication statistics.
+
+- ``python cli.py harvest [--config harvest.toml] [--full]``: harvest the metadata, see :mod:`metadata_harvest`
+- ``python cli.py stats [date] [--exclude-duplicates]``: usage statistics, see :mod:`ac3_data_usage_statistics`
+- ``python cli.py plot [date] [--exclude-duplicates]``: publications per year, see :mod:`ac3_data_publication_plots`
+- ``python cli.py wordcloud [date] [--exclude-duplicates]``: word cloud of the titles
+- ``python cli.py map [date] [--exclude-duplicates]``: number of data sets per 1° cell of their location
+- ``python cli.py search "Ny-Ålesund radiosonde" [--date yyyymmdd]``: DOIs of the matching data sets,
+  ``plot``, ``wordcloud`` and ``map`` take the same search with ``--query``
+- ``python cli.py within SOUTH WEST NORTH EAST [--date yyyymmdd]``: DOIs of the data sets in a bounding box,
+  ``plot``, ``wordcloud`` and ``map`` take the same box with ``--bbox``
+- ``python cli.py benchmark [--records 1000 10000] ...``: offline benchmark, see :mod:`benchmark`
+
+Every subcommand only imports the modules it needs, e.g. a harvest does not load pandas, matplotlib or wordcloud.
+Each run writes the duration of its stages, its HTTP metrics and counters to a JSON run report
+(see :class:`functions.RunMetrics`), ``--profile <file>`` additionally dumps cProfile statistics.
+"""
+import argparse
+import logging
+import sys
+import time
+
+
+def get_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Harvest, count and plot the data publications of the (AC)³ community")
+    parser.add_argument("--run-report",
+                        help="JSON file for the timings, requests and counters of the run, "
+                             "default: data/<date>-run_report_<command>.json.")
+    parser.add_argument("--profile",
+                        help="File to write cProfile statistics of the run to.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    harvest = subparsers.add_parser('harvest', help="Harvest metadata from Zenodo and PANGAEA.")
+    harvest.add_argument("--config", default="harvest.toml",
+                         help="TOML file with the harvest jobs.")
+    harvest.add_argument("--full", action="store_true",
+                         help="Ignore the harvest state and harvest the complete sets again.")
+
+    for command, help_text in (('stats', "Get and plot the usage statistics of a harvest."),
+                               ('plot', "Plot the publications per year of a harvest."),
+                               ('wordcloud', "Plot a word cloud of the titles of a harvest."),
+                               ('map', "Plot the number of data sets per 1° cell of their location.")):
+        subparser = subparsers.add_parser(command, help=help_text)
+        subparser.add_argument("date",
+                               help="Date (yyyymmdd) of the metadata harvest.",
+                               default=time.strftime("%Y%m%d", time.localtime()),
+                               nargs='?')
+        subparser.add_argument("--exclude-duplicates", action="store_true",
+                               help="Leave out near-duplicates of other data sets.")
+        if command != 'stats':
+            subparser.add_argument("--query",
+                                   help="Only plot the data sets matching a full-text search, see the search command.")
+            subparser.add_argument("--bbox", nargs=4, type=float, metavar=('SOUTH', 'WEST', 'NORTH', 'EAST'),
+                                   help="Only plot the data sets whose coverage overlaps a bounding box.")
+
+    search = subparsers.add_parser('search', help="Full-text search over titles, descriptions, coverage, authors "
+                                                  "and keywords of the harvested data sets.")
+    search.add_argument("query",
+                        help="Words which all have to occur, e.g. 'Ny-Ålesund radiosonde'.")
+    search.add_argument("--date",
+                        help="Date (yyyymmdd) of the metadata harvest, default: the latest harvest.")
+    search.add_argument("--publisher",
+                        help="Only data sets of this repository, e.g. PANGAEA.")
+    search.add_argument("--limit", type=int,
+                        help="Maximum number of data sets.")
+    search.add_argument("--raw", action="store_true",
+                        help="The query is an SQLite FTS5 expression, e.g. 'title:dropsonde AND (HALO OR P5)'.")
+    search.add_argument("--titles", action="store_true",
+                        help="Print the publisher, date and title next to the DOIs.")
+
+    within = subparsers.add_parser('within', help="Data sets whose coverage overlaps a bounding box.")
+    for name, coordinate in (('south', 'latitude'), ('west', 'longitude'), ('north', 'latitude'),
+                             ('east', 'longitude')):
+        within.add_argument(name, type=float, help=f"{name.capitalize()}ern {coordinate} of the box.")
+    within.add_argument("--contained", action="store_true",
+                        help="Only data sets whose coverage lies completely within the box.")
+    within.add_argument("--date",
+                        help="Date (yyyymmdd) of the metadata harvest, default: the latest harvest.")
+    within.add_argument("--publisher",
+                        help="Only data sets of this repository, e.g. PANGAEA.")
+
+    import benchmark
+    benchmark.add_arguments(subparsers.add_parser(
+        'benchmark', help="Benchmark harvest, usage statistics and plots against local stand-ins of the services."))
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """
+    Run a subcommand.
+
+    :param argv: (None) command line arguments, default: ``sys.argv[1:]``.
+    :return: Exit status.
+    """
+    args = get_args(argv)
+
+    # Set up logging
+    logging.basicConfig(level=logging.INFO,
+                        format='%(message)s')
+
+    if args.command == 'benchmark':
+        import benchmark
+        benchmark.main(args.records, args.stages, args.latency, args.error_rate, args.page_size, args.report)
+        return 0
+
+    import functions as fn
+    # Serve repeated requests within a day from ./data/http_cache.sqlite
+    fn.enable_http_cache()
+
+    status = 0
+    try:
+        with fn.profiled(args.profile), fn.metrics.stage(args.command):
+            if args.command == 'harvest':
+                import metadata_harvest
+                status = 0 if metadata_harvest.main(args.config, args.full) else 1
+            elif args.command == 'stats':
+                import ac3_data_usage_statistics
+                ac3_data_usage_statistics.main(args.date, args.exclude_duplicates)
+            elif args.command == 'search':
+                results = fn.load_search_index(args.date).search(args.query, publisher=args.publisher,
+                                                                 limit=args.limit, raw=args.raw)
+                for result in results:
+                    print('\t'.join([result['doi'] or result['oai_identifier'],
+                                      *([result['publisher'] or '', result['date'] or '', result['title']]
+                                        if args.titles else [])]))
+                logging.info(f'{len(results)} data sets match "{args.query}"')
+            elif args.command == 'within':
+                results = fn.load_spatial_index(args.date).within(args.south, args.west, args.north, args.east,
+                                                                  contained=args.contained, publisher=args.publisher)
+                for result in results:
+                    print(f'{result["doi"] or result["oai_identifier"]}\t{result["latitude"]}\t{result["longitude"]}')
+                logging.info(f'{len(results)} data sets within {args.south}, {args.west}, {args.north}, {args.east}')
+            else:
+                import ac3_data_publication_plots
+                ac3_data_publication_plots.main(args.date, args.exclude_duplicates, yearly=args.command == 'plot',
+                                                wordcloud=args.command == 'wordcloud',
+                                                density_map=args.command == 'map', query=args.query, bbox=args.bbox)
+    except Exception:
+        status = 1
+        raise
+    finally:
+        # timings, requests and counters of this run, also of a failed one
+        date = getattr(args, 'date', None) or time.strftime("%Y%m%d", time.localtime())
+        fn.metrics.write_report(args.run_report or f'./data/{date}-run_report_{args.command}.json',
+                                command=args.command, args=vars(args), status=status)
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
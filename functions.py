@@ -5,120 +5,2449 @@
 
 Description of script
 """
+import abc
+from array import array
+from collections import Counter, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager, nullcontext
+import cProfile
+from datetime import datetime, timedelta, timezone
+import functools
+import gzip
+import importlib
+import io
+import itertools
 import json
 import logging
+import math
 import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+import unicodedata
+import zlib
+from types import SimpleNamespace
+from urllib.parse import urlparse
 from dotenv import load_dotenv
+from lxml import etree
 import requests
-from sickle import Sickle
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+from sickle import Sickle, oaiexceptions
+from sickle.models import ResumptionToken
+from sickle.oaiexceptions import BadResumptionToken, NoRecordsMatch
 from tqdm import tqdm
+from urllib3.util.retry import Retry
 
 log = logging.getLogger(__name__)
 load_dotenv()
 
-# Query Zenodo API and return all records of one community
-def query_zenodo(community, page=1, size=100, base_url='https://zenodo.org/api/records/'):
-    all_records = []
-    while True:
+# HTTP status codes which are worth retrying
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+class _LazyModule:
+    """Stand-in for a module which is only imported when one of its attributes is used."""
+
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attr):
+        return getattr(importlib.import_module(self._name), attr)
+
+
+# pandas and numpy are only needed for the corpus and the plots, not to start a harvest
+np = _LazyModule('numpy')
+pd = _LazyModule('pandas')
+
+
+class HTTPCache:
+    """
+    On-disk cache of HTTP responses in a SQLite database, keyed on the request URL including its parameters.
+    Responses younger than `ttl` are served without a request.
+    Older responses are revalidated with a conditional request (`If-None-Match`/`If-Modified-Since`)
+    if the server sent an `ETag` or `Last-Modified` header and are served from the cache on `304 Not Modified`.
+    The least recently used responses are evicted once the cached bodies grow beyond `max_size`.
+
+    :param path: Path to the SQLite database.
+    :param ttl: (86400) seconds a response is served without asking the server.
+    :param max_size: (500 MiB) maximum size of all cached bodies in bytes.
+    """
+
+    def __init__(self, path, ttl=86400, max_size=500 * 2 ** 20):
+        self.path = path
+        self.ttl = ttl
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, status INTEGER, headers TEXT, '
+                         'body BLOB, etag TEXT, last_modified TEXT, stored REAL, accessed REAL, size INTEGER)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+        self._size = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    def get(self, key):
+        """Return the cached response for `key` as a dictionary or None."""
+        with self._lock:
+            row = self._db.execute('SELECT status, headers, body, etag, last_modified, stored FROM responses '
+                                   'WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            self._db.execute('UPDATE responses SET accessed = ? WHERE key = ?', (time.time(), key))
+            self._db.commit()
+        status, headers, body, etag, last_modified, stored = row
+        return dict(status=status, headers=json.loads(headers), body=body, etag=etag, last_modified=last_modified,
+                    stored=stored)
+
+    def set(self, key, response):
+        """Store a `requests.Response` under `key`."""
+        # the body is stored decoded, so the transfer headers do not apply anymore
+        headers = {k: v for k, v in response.headers.items()
+                   if k.lower() not in ('content-encoding', 'content-length', 'transfer-encoding')}
+        body = response.content
+        now = time.time()
+        with self._lock:
+            old = self._db.execute('SELECT size FROM responses WHERE key = ?', (key,)).fetchone()
+            self._db.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                             (key, response.status_code, json.dumps(headers), body, response.headers.get('ETag'),
+                              response.headers.get('Last-Modified'), now, now, len(body)))
+            self._size += len(body) - (old[0] if old else 0)
+            self._evict()
+            self._db.commit()
+
+    def touch(self, key):
+        """Mark the response for `key` as fresh again after a successful revalidation."""
+        with self._lock:
+            self._db.execute('UPDATE responses SET stored = ? WHERE key = ?', (time.time(), key))
+            self._db.commit()
+
+    def clear(self):
+        """Remove all cached responses."""
+        with self._lock:
+            self._db.execute('DELETE FROM responses')
+            self._db.commit()
+            self._size = 0
+
+    def _evict(self):
+        # remove the least recently used responses until the cache is 10 % below its maximum size
+        if self._size <= self.max_size:
+            return
+        rows = self._db.execute('SELECT key, size FROM responses ORDER BY accessed').fetchall()
+        for key, size in rows:
+            if self._size <= 0.9 * self.max_size:
+                break
+            self._db.execute('DELETE FROM responses WHERE key = ?', (key,))
+            self._size -= size
+
+
+class CachingAdapter(HTTPAdapter):
+    """
+    Transport adapter which answers GET requests from a :class:`HTTPCache` and stores successful responses in it.
+
+    :param cache: :class:`HTTPCache` to use.
+    :param kwargs: Keyword arguments for `requests.adapters.HTTPAdapter`.
+    """
+
+    def __init__(self, cache, **kwargs):
+        self.cache = cache
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        if request.method != 'GET':
+            return super().send(request, **kwargs)
+        entry = self.cache.get(request.url)
+        if entry and time.time() - entry['stored'] < self.cache.ttl:
+            return self._cached_response(request, entry)
+        if entry and entry['etag']:
+            request.headers['If-None-Match'] = entry['etag']
+        if entry and entry['last_modified']:
+            request.headers['If-Modified-Since'] = entry['last_modified']
+
+        response = super().send(request, **kwargs)
+        if entry and response.status_code == 304:
+            self.cache.touch(request.url)
+            return self._cached_response(request, entry)
+        if response.status_code == 200:
+            self.cache.set(request.url, response)
+        return response
+
+    def _cached_response(self, request, entry):
+        response = requests.Response()
+        response.status_code = entry['status']
+        response.headers = CaseInsensitiveDict(entry['headers'])
+        response._content = entry['body']
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.url = request.url
+        response.request = request
+        response.reason = 'OK (cached)'
+        response.connection = self
+        return response
+
+
+# Cache used by all sessions created with make_session, see enable_http_cache
+http_cache = None
+
+
+def enable_http_cache(path='./data/http_cache.sqlite', ttl=86400, max_size=500 * 2 ** 20):
+    """
+    Cache the responses of all requests sent through :func:`make_session`,
+    i.e. by :func:`query_zenodo` and the PANGAEA usage statistics functions.
+    The requests of the OAI-PMH harvester are not cached.
+
+    :param path: ('./data/http_cache.sqlite') path to the SQLite database.
+    :param ttl: (86400) seconds a response is served without asking the server.
+    :param max_size: (500 MiB) maximum size of all cached bodies in bytes.
+    :return: The :class:`HTTPCache`.
+    """
+    global http_cache
+    http_cache = HTTPCache(path, ttl=ttl, max_size=max_size)
+    return http_cache
+
+
+# Upper bounds of the buckets of the latency histograms in seconds
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class RunMetrics:
+    """
+    Thread safe metrics of one run for the run report:
+
+    - duration of the pipeline stages, see :meth:`stage`
+    - counters, e.g. of harvested records, see :meth:`count`
+    - requests, retries, errors, bytes and a latency histogram per host, see :meth:`observe_response`
+
+    All sessions from :func:`make_session` report their responses to the module level instance :data:`metrics`,
+    which is written with :meth:`write_report` at the end of a run.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self):
+        """Forget all metrics and restart the run clock."""
+        with self._lock:
+            self.started = time.time()
+            self.stages = {}
+            self.counters = Counter()
+            self.hosts = {}
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Time a stage of the pipeline, used as context manager or as decorator.
+        Stages started within another stage of the same thread are named `<outer>.<inner>`.
+
+        :param name: Name of the stage.
+        """
+        stack = self._local.__dict__.setdefault('stack', [])
+        stack.append(name)
+        full_name = '.'.join(stack)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            stack.pop()
+            self.observe_stage(full_name, time.perf_counter() - start)
+
+    def observe_stage(self, name, seconds):
+        """Add a stage which was timed elsewhere, e.g. in another process."""
+        with self._lock:
+            stage = self.stages.setdefault(name, dict(calls=0, seconds=0., max_seconds=0.))
+            stage['calls'] += 1
+            stage['seconds'] += seconds
+            stage['max_seconds'] = max(stage['max_seconds'], seconds)
+
+    def count(self, name, n=1):
+        """Add `n` to the counter `name`."""
+        with self._lock:
+            self.counters[name] += n
+
+    def observe_response(self, response, *args, **kwargs):
+        """
+        Response hook of `requests` which counts the request, its retries, errors and bytes
+        and adds its latency to the histogram of its host.
+        Responses served from the HTTP cache are only counted as cached.
+        """
+        host = urlparse(response.url).netloc
+        cached = response.reason == 'OK (cached)'
+        retries = len(getattr(getattr(response.raw, 'retries', None), 'history', None) or ())
+        if kwargs.get('stream'):
+            n_bytes = int(response.headers.get('Content-Length', 0))
+        else:
+            n_bytes = len(response.content or b'')
+        latency = response.elapsed.total_seconds()
+        with self._lock:
+            metrics = self.hosts.setdefault(host, dict(requests=0, cached=0, retries=0, errors=0, bytes=0,
+                                                       latency_seconds=0., max_latency_seconds=0.,
+                                                       latency_histogram=[0] * (len(LATENCY_BUCKETS) + 1)))
+            metrics['requests'] += 1
+            metrics['bytes'] += n_bytes
+            metrics['retries'] += retries
+            metrics['errors'] += response.status_code >= 400
+            if cached:
+                metrics['cached'] += 1
+                return
+            metrics['latency_seconds'] += latency
+            metrics['max_latency_seconds'] = max(metrics['max_latency_seconds'], latency)
+            metrics['latency_histogram'][next((i for i, bound in enumerate(LATENCY_BUCKETS) if latency <= bound),
+                                              len(LATENCY_BUCKETS))] += 1
+
+    def report(self):
+        """
+        The metrics of the run as dictionary with the keys `started`, `seconds`, `stages`, `counters` and `hosts`.
+        The latency histogram of a host maps the upper bound of every bucket (`le_<seconds>`) to its number of
+        requests.
+        """
+        with self._lock:
+            hosts = {}
+            for host, metrics in self.hosts.items():
+                histogram = dict(zip([f'le_{bound}' for bound in LATENCY_BUCKETS] + ['inf'],
+                                     metrics['latency_histogram']))
+                n_timed = metrics['requests'] - metrics['cached']
+                hosts[host] = dict(metrics, latency_histogram=histogram,
+                                   mean_latency_seconds=metrics['latency_seconds'] / n_timed if n_timed else 0.)
+            return dict(started=datetime.fromtimestamp(self.started).isoformat(timespec='seconds'),
+                        seconds=time.time() - self.started,
+                        stages={name: dict(stage) for name, stage in self.stages.items()},
+                        counters=dict(self.counters),
+                        hosts=hosts)
+
+    def write_report(self, path, **info):
+        """
+        Write the run report to a JSON file.
+
+        :param path: Path to the JSON file.
+        :param info: Further entries of the report, e.g. the command and its arguments.
+        :return: The report.
+        """
+        report = dict(info, **self.report())
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=4, default=str)
+        log.info(f'Run report written to {path}')
+        return report
+
+
+# Metrics of the current run, see RunMetrics
+metrics = RunMetrics()
+
+
+@contextmanager
+def profiled(path=None):
+    """
+    Profile the code in the context with cProfile and dump the statistics to `path`,
+    which can be read with `pstats` or viewers like snakeviz. Does nothing without a path.
+    Only the calling thread is profiled, the time of worker threads shows up as waiting for them.
+
+    :param path: (None) file for the profile statistics.
+    """
+    if not path:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+        log.info(f'Profile written to {path}')
+
+
+def make_session(pool_size=10, max_retries=5, backoff_factor=0.5, cache=True):
+    """
+    Create a `requests.Session` with a pool of keep-alive connections which retries failed requests.
+    Requests answered with 429 or 5xx are retried with an exponential backoff, honouring `Retry-After` headers.
+    If :func:`enable_http_cache` was called, GET requests go through the HTTP cache.
+    All responses are counted in the run :data:`metrics`.
+
+    :param pool_size: (10) maximum number of open connections per host, should match the number of threads.
+    :param max_retries: (5) number of retries per request.
+    :param backoff_factor: (0.5) wait backoff_factor * 2 ** (retry - 1) seconds between retries.
+    :param cache: (True) use the HTTP cache, False for requests whose answer must be fresh, e.g. OAI-PMH harvests.
+    :return: requests.Session
+    """
+    retry = Retry(total=max_retries, backoff_factor=backoff_factor, status_forcelist=RETRY_STATUS_CODES,
+                  allowed_methods=['GET', 'HEAD'], respect_retry_after_header=True, raise_on_status=False)
+    if cache and http_cache is not None:
+        adapter = CachingAdapter(http_cache, pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    else:
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    # requests, retries, bytes and latency for the run report
+    session.hooks['response'].append(metrics.observe_response)
+    return session
+
+
+class SessionSickle(Sickle):
+    """
+    Sickle client which sends its requests through a `requests.Session`,
+    so the OAI-PMH harvester shares the retries and metrics of :func:`make_session`.
+
+    :param endpoint: The endpoint of the OAI interface.
+    :param session: (None) session to use, a new one from :func:`make_session` otherwise.
+    :param kwargs: Keyword arguments for `sickle.Sickle`.
+    """
+
+    def __init__(self, endpoint, session=None, **kwargs):
+        super().__init__(endpoint, **kwargs)
+        self.session = session or make_session(pool_size=1, cache=False)
+
+    def _request(self, kwargs):
+        if self.http_method == 'GET':
+            return self.session.get(self.endpoint, params=kwargs, **self.request_args)
+        return self.session.post(self.endpoint, data=kwargs, **self.request_args)
+
+
+class RateLimiter:
+    """
+    Thread safe rate limiter allowing at most `rate` requests per second and host.
+    It can also pause a host according to the rate limit headers of its responses, see :meth:`update`.
+
+    :param rate: Requests per second and host, None or 0 disables the limit.
+    """
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self._lock = threading.Lock()
+        self._next_slot = {}
+
+    def wait(self, url):
+        """Block until the next request to the host of `url` is allowed."""
+        host = urlparse(url).netloc
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + self.interval
+        time.sleep(max(0., slot - now))
+
+    def update(self, response):
+        """
+        Adapt to the rate limit headers (`X-RateLimit-Remaining`, `X-RateLimit-Reset`) of a response.
+        Requests to the host are paused until the reset time once no requests are remaining.
+        """
+        remaining = response.headers.get('X-RateLimit-Remaining')
+        reset = response.headers.get('X-RateLimit-Reset')
+        if remaining is None or reset is None or int(remaining) > 0:
+            return
+        host = urlparse(response.url).netloc
+        pause = max(0., float(reset) - time.time())
+        log.info(f'Rate limit of {host} reached, pausing for {pause:.0f} s')
+        with self._lock:
+            now = time.monotonic()
+            self._next_slot[host] = max(self._next_slot.get(host, now), now + pause)
+
+
+def _zenodo_total(data):
+    # the total is an integer in InvenioRDM and a dictionary in older Elasticsearch based responses
+    total = data.get('hits', {}).get('total', 0)
+    return total.get('value', 0) if isinstance(total, dict) else total
+
+
+def query_zenodo(community, page=1, size=100, base_url='https://zenodo.org/api/records/', max_workers=4,
+                 stream=False):
+    """
+    Query the Zenodo API and return all records of one community.
+    The first page gives the total number of records, the remaining pages are fetched concurrently over one session.
+    Failed requests are retried (see :func:`make_session`) and requests are paused when Zenodo's rate limit headers
+    say that the limit is used up. If a page still can not be fetched, a `requests.HTTPError` is raised instead of
+    returning an incomplete list.
+    Without an access token in the environment variable `ACCESS_TOKEN` Zenodo only returns 25 records per page.
+
+    :param community: Zenodo community identifier.
+    :param page: (1) first page to fetch.
+    :param size: (100) number of records per page.
+    :param base_url: URL of the records API.
+    :param max_workers: (4) number of pages to fetch concurrently.
+    :param stream: (False) return a generator yielding the records page by page instead of a list,
+                   it only fetches up to `max_workers` pages ahead of the records consumed.
+    :return: List or generator of record dictionaries.
+    """
+    records = _iter_zenodo_records(community, page, size, base_url, max_workers)
+    return records if stream else list(records)
+
+
+def _iter_zenodo_records(community, page, size, base_url, max_workers):
+    try:
+        headers = {"Authorization": f'Bearer {os.environ["ACCESS_TOKEN"]}'}
+    except KeyError:
+        headers = None
+        size = min(size, 25)
+    session = make_session(pool_size=max_workers)
+    rate_limiter = RateLimiter(None)
+
+    def fetch(p):
         params = {
             "communities": community,
-            "page": page,
+            "page": p,
             "size": size,
         }
-        try:
-            headers = {"Authorization": f'Bearer {os.environ["ACCESS_TOKEN"]}'}
-        except KeyError:
-            headers = None
-            params.update(size=25)
-        response = requests.get(base_url, params=params, headers=headers)
+        rate_limiter.wait(base_url)
+        response = session.get(base_url, params=params, headers=headers, timeout=60)
+        rate_limiter.update(response)
         if response.status_code != 200:
-            log.error(f"Failed to fetch data from Zenodo. Status code: {response.status_code}")
-            break
-
+            log.error(f"Failed to fetch page {p} from Zenodo. Status code: {response.status_code}")
+            raise requests.HTTPError(f'{response.status_code} for {response.url}', response=response)
         data = response.json()
-        records = data.get("hits", {}).get("hits", [])
-        all_records.extend(records)
+        n_records = len(data.get('hits', {}).get('hits', []))
+        metrics.count('zenodo_records', n_records)
+        log.info(f"Fetched {n_records} records from page {p}.")
+        return data
+
+    data = fetch(page)
+    yield from data.get('hits', {}).get('hits', [])
+    last_page = math.ceil(_zenodo_total(data) / size)
+
+    pages = iter(range(page + 1, last_page + 1))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # only fetch max_workers pages ahead of the consumer, executor.map would request all pages at once
+        pending = deque(executor.submit(fetch, p) for p in itertools.islice(pages, max_workers))
+        while pending:
+            data = pending.popleft().result()
+            for p in itertools.islice(pages, 1):
+                pending.append(executor.submit(fetch, p))
+            yield from data.get('hits', {}).get('hits', [])
+
+
+def load_harvest_state(state_file):
+    """
+    Read the incremental harvest state from `state_file`.
+
+    :param state_file: Path to the JSON state file.
+    :return: Dictionary with one entry per harvest job or an empty dictionary if the file does not exist yet.
+    """
+    if not os.path.exists(state_file):
+        return {}
+    with open(state_file, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+
+def save_harvest_state(state_file, state):
+    """
+    Write the incremental harvest state to `state_file`.
+    The file is replaced atomically so an interrupted write never leaves a broken state behind.
+
+    :param state_file: Path to the JSON state file.
+    :param state: Dictionary with one entry per harvest job.
+    """
+    tmp_file = f'{state_file}.tmp'
+    with open(tmp_file, 'w', encoding='utf-8') as file:
+        json.dump(state, file, ensure_ascii=False, indent=4)
+    os.replace(tmp_file, state_file)
+
+
+# Serialises updates of the harvest state by concurrent harvest jobs
+_state_lock = threading.Lock()
+
+
+def update_harvest_state(state_file, job_key, job_state):
+    """
+    Replace the state of one harvest job in `state_file` and keep the states of all other jobs.
+
+    :param state_file: Path to the JSON state file.
+    :param job_key: Key of the harvest job.
+    :param job_state: New state of the job.
+    """
+    with _state_lock:
+        state = load_harvest_state(state_file)
+        state[job_key] = job_state
+        save_harvest_state(state_file, state)
+
+
+ZENODO_DOI_PATTERN = re.compile(r'10\.5281/zenodo\.(\d+)', re.IGNORECASE)
+ZENODO_OAI_PATTERN = re.compile(r'^oai:zenodo\.org:(\d+)$')
+
+
+def extract_concept_doi(identifiers=(), relations=(), oai_identifier=None, is_version_of=()):
+    """
+    Extract the concept DOI shared by all versions of a data set.
+
+    An explicit `IsVersionOf` relation (oai_datacite) is used as is.
+    Dublin Core only lists the related identifiers without their relation type.
+    For Zenodo, the concept is the Zenodo DOI among the relations with a smaller record id than the record itself,
+    because the concept record is created together with the first version.
+    A Zenodo record without such a relation is its own concept.
+    Data sets of other repositories without an explicit relation have no concept DOI.
+    The jobs in `harvest.toml` harvest `oai_dc`, so their concept DOIs always come from the relations.
+
+    :param identifiers: Identifiers of the data set (`dc:identifier`).
+    :param relations: Related identifiers of the data set (`dc:relation`).
+    :param oai_identifier: (None) OAI identifier of the record, e.g. `oai:zenodo.org:123`.
+    :param is_version_of: DOIs from `IsVersionOf` relations.
+    :return: Concept DOI as `10.5281/zenodo.<id>` or the DOI of the explicit relation, None for no concept.
+    """
+    for doi in is_version_of:
+        if doi:
+            return doi.removeprefix('https://doi.org/').removeprefix('doi:').lower()
+    own = ZENODO_OAI_PATTERN.match(oai_identifier or '')
+    own = own or next(filter(None, map(ZENODO_DOI_PATTERN.search, identifiers)), None)
+    if own is None:
+        return None
+    record_id = int(own.group(1))
+    candidates = [int(match.group(1)) for match in map(ZENODO_DOI_PATTERN.search, relations) if match]
+    # the concept is usually the last relation, related versions or data sets may come before it
+    candidates = [candidate for candidate in candidates if candidate < record_id]
+    return f'10.5281/zenodo.{candidates[-1] if candidates else record_id}'
+
+
+def record_to_dataset(record):
+    """
+    Convert a Sickle record into the dataset dictionary stored in the harvested JSON files.
+
+    :param record: Sickle record which is not deleted.
+    :return: Dictionary with list valued metadata fields and the OAI header identifier and datestamp.
+    """
+    metadata = record.metadata
+    # give sensible defaults if no value is found for a key to avoid raising an error
+    dataset = {
+        'doi': metadata.get('identifier', 'No doi')[0],
+        'authors': metadata.get('creator', []),
+        'title': metadata.get('title', 'No title'),
+        'date': metadata.get('date', 'No date'),
+        'format': metadata.get('format', 'No format'),
+        'type': metadata.get('type', 'No type'),
+        'coverage': metadata.get('coverage', 'No coverage'),
+        'rights': metadata.get('rights', 'No rights'),
+        'relation': metadata.get('relation', 'No relation'),
+        'description': metadata.get('description', 'No description'),
+        'publisher': metadata.get('publisher', 'No publisher'),
+        'keywords': metadata.get('subject', []),
+    }
+
+    # Ensure multivalued fields are stored as lists
+    for key, value in dataset.items():
+        if not isinstance(value, list):
+            dataset[key] = [value]
+
+    # header fields are single valued, they are needed to merge incremental harvests
+    dataset['oai_identifier'] = record.header.identifier
+    dataset['datestamp'] = record.header.datestamp
+    dataset['concept_doi'] = extract_concept_doi(dataset['doi'], dataset['relation'], record.header.identifier,
+                                                 metadata.get('isVersionOf', []))
+    return dataset
+
+
+RECORD_FILE_SUFFIXES = ('.ndjson.zst', '.ndjson.gz', '.ndjson', '.json')
+
+
+def open_records_file(path, mode='rt'):
+    """
+    Open a records file in text mode.
+    Files ending in `.gz` are gzip compressed and files ending in `.zst` are zstd compressed.
+    The latter needs the optional `zstandard` package.
+
+    :param path: Path to the records file.
+    :param mode: ('rt') file mode, one of 'rt', 'wt' or 'at'.
+    :return: File object.
+    """
+    if path.endswith('.gz'):
+        return gzip.open(path, mode, encoding='utf-8')
+    if path.endswith('.zst'):
+        try:
+            import zstandard
+        except ImportError as e:
+            raise ImportError(f'The zstandard package is needed to open {path}') from e
+        return zstandard.open(path, mode, encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
 
-        log.info(f"Fetched {len(records)} records from page {page}.")
 
-        # Check if there are more pages
-        if len(records) < size:
-            break
+def write_records(path, records):
+    """
+    Write records to `path`.
+    A `.json` file gets one indented JSON list like the original harvest files.
+    Every other file gets one JSON object per line (NDJSON), which is written as the records come in.
+    That way `records` can be a generator and is never held in memory.
 
-        page += 1
+    :param path: Path to the output file, see :data:`RECORD_FILE_SUFFIXES` for supported suffixes.
+    :param records: Iterable of dictionaries.
+    :return: Number of written records.
+    """
+    with open_records_file(path, 'wt') as file:
+        if path.endswith('.json'):
+            records = list(records)
+            json.dump(records, file, ensure_ascii=False, indent=4)
+            return len(records)
+        n_records = 0
+        for record in records:
+            file.write(json.dumps(record, ensure_ascii=False) + '\n')
+            n_records += 1
+    return n_records
 
-    return all_records
 
+def read_records(path):
+    """
+    Read records from a file written by :func:`write_records` one by one.
+    A truncated last line, e.g. from an interrupted harvest, is skipped with a warning.
 
-def get_metadata_from_repository(oai_url, set_name, output_file, metadata_prefix='oai_dc'):
+    :param path: Path to the records file.
+    :return: Generator of dictionaries.
+    """
+    with open_records_file(path, 'rt') as file:
+        if path.endswith('.json'):
+            yield from json.load(file)
+            return
+        for line in file:
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                log.warning(f'Skipping incomplete line in {path}')
+
+
+def find_records_file(stem):
+    """
+    Find the records file for `stem` with any of the supported suffixes.
+
+    :param stem: Path without suffix, e.g. `./data/20251022-datasets_ac3_zenodo`.
+    :return: Path to the first existing file, compressed NDJSON files are preferred.
+    """
+    for suffix in RECORD_FILE_SUFFIXES:
+        if os.path.exists(stem + suffix):
+            return stem + suffix
+    raise FileNotFoundError(f'No records file found for {stem} ({", ".join(RECORD_FILE_SUFFIXES)})')
+
+
+def _last_changes(changes_file):
+    # position of the entry with the newest datestamp per identifier (the last one for equal datestamps)
+    last_change = {}
+    for i, entry in enumerate(read_records(changes_file)):
+        key = (entry.get('datestamp') or '', i)
+        last_change[entry['oai_identifier']] = max(key, last_change.get(entry['oai_identifier'], key))
+    return {identifier: i for identifier, (_, i) in last_change.items()}
+
+
+def latest_changes(changes_file, last_change=None):
+    """
+    Stream the entries of a change log which are still valid:
+    the entry with the newest datestamp per identifier, records as well as tombstones.
+
+    :param changes_file: NDJSON file with changed records and tombstones.
+    :param last_change: (None) position of the valid entry per identifier, computed from `changes_file` if not given.
+    :return: Generator of record dictionaries.
+    """
+    if last_change is None:
+        last_change = _last_changes(changes_file)
+    for i, change in enumerate(read_records(changes_file)):
+        if last_change[change['oai_identifier']] == i:
+            yield change
+
+
+def merge_records(base_file, changes_file, output_file):
+    """
+    Merge a change log of harvested records into the corpus of a previous harvest.
+    Both files are streamed, only the identifiers of the changed records are kept in memory.
+    The entry of a record with the newest datestamp in the change log wins (the last one for equal datestamps)
+    and entries flagged as `deleted` remove the record.
+
+    :param base_file: Records file of the previous harvest or None.
+    :param changes_file: NDJSON file with changed records and tombstones.
+    :param output_file: Records file to write the merged corpus to, may be the same as `base_file`.
+    :return: Number of records in the merged corpus.
+    """
+    last_change = _last_changes(changes_file)
+
+    def merged():
+        if base_file:
+            for dataset in read_records(base_file):
+                if dataset['oai_identifier'] not in last_change:
+                    yield dataset
+        for change in latest_changes(changes_file, last_change):
+            if not change.get('deleted'):
+                yield change
+
+    directory, name = os.path.split(output_file)
+    tmp_file = os.path.join(directory, f'.tmp-{name}')
+    n_records = write_records(tmp_file, merged())
+    os.replace(tmp_file, output_file)
+    return n_records
+
+
+OAI_NAMESPACE = '{http://www.openarchives.org/OAI/2.0/}'
+# Dublin Core fields used by record_to_dataset
+DC_FIELDS = ('identifier', 'creator', 'title', 'date', 'format', 'type', 'coverage', 'rights', 'relation',
+             'description', 'publisher', 'subject')
+# Map the element names of the oai_datacite metadata format to the Dublin Core fields
+DATACITE_FIELDS = {
+    'identifier': 'identifier',
+    'creatorName': 'creator',
+    'title': 'title',
+    'publicationYear': 'date',
+    'date': 'date',
+    'format': 'format',
+    'resourceType': 'type',
+    'geoLocationPlace': 'coverage',
+    'rights': 'rights',
+    'relatedIdentifier': 'relation',
+    'description': 'description',
+    'publisher': 'publisher',
+    'subject': 'subject',
+}
+FIELD_MAPS = {'oai_datacite': DATACITE_FIELDS}
+
+
+class IterparseRecordIterator:
+    """
+    Iterator over the records of an OAI-PMH ListRecords request which stream-parses every page with
+    `lxml.etree.iterparse` and only keeps the text of the selected metadata fields.
+    Each record element is cleared as soon as it is parsed, so no element tree of a whole page and no dictionary with
+    all metadata fields (e.g. long descriptions) is built.
+    The element names of other metadata formats like `oai_datacite` are mapped to Dublin Core fields
+    with :data:`FIELD_MAPS`, so they work with :func:`record_to_dataset`.
+
+    It is a drop-in replacement for the Sickle iterator:
+    it has a `resumption_token` attribute and yields records with `header`, `deleted` and `metadata` attributes.
+
+    :param session: requests.Session to send the requests with, see :func:`make_session`.
+    :param oai_url: URL to the OAI-PMH provider.
+    :param params: OAI-PMH arguments of the first request, e.g. `metadataPrefix`, `set` and `from`.
+    :param fields: (:data:`DC_FIELDS`) Dublin Core fields to keep.
+    :param metadata_prefix: ('oai_dc') metadata format of the records, used to look up the field map.
+    """
+
+    def __init__(self, session, oai_url, params, fields=DC_FIELDS, metadata_prefix='oai_dc'):
+        self.session = session
+        self.oai_url = oai_url
+        self.fields = set(fields)
+        self.field_map = FIELD_MAPS.get(metadata_prefix, {})
+        self.resumption_token = None
+        self._records = self._fetch(dict(params, verb='ListRecords'))
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while True:
+            record = next(self._records, None)
+            if record is not None:
+                return record
+            if not getattr(self.resumption_token, 'token', None):
+                raise StopIteration
+            self._records = self._fetch(dict(verb='ListRecords', resumptionToken=self.resumption_token.token))
+
+    def _fetch(self, params):
+        response = self.session.get(self.oai_url, params=params, timeout=120)
+        response.raise_for_status()
+        with metrics.stage('oai_parse'):
+            return self._parse(response.content)
+
+    def _parse(self, content):
+        records, token = [], None
+        for _, element in etree.iterparse(io.BytesIO(content), events=('end',)):
+            if element.tag == OAI_NAMESPACE + 'record':
+                records.append(self._parse_record(element))
+                # free the parsed record and its predecessors
+                element.clear()
+                while element.getprevious() is not None:
+                    del element.getparent()[0]
+            elif element.tag == OAI_NAMESPACE + 'resumptionToken':
+                token = ResumptionToken(token=element.text, cursor=element.get('cursor'),
+                                        complete_list_size=element.get('completeListSize'),
+                                        expiration_date=element.get('expirationDate'))
+            elif element.tag == OAI_NAMESPACE + 'error':
+                code = element.get('code', 'UNKNOWN')
+                raise getattr(oaiexceptions, code[0].upper() + code[1:], oaiexceptions.OAIError)(element.text or '')
+        # like Sickle, the token of the next page is known as soon as a page is fetched
+        self.resumption_token = token
+        return iter(records)
+
+    def _parse_record(self, element):
+        header = element.find(OAI_NAMESPACE + 'header')
+        record = SimpleNamespace(
+            header=SimpleNamespace(identifier=header.findtext(OAI_NAMESPACE + 'identifier'),
+                                   datestamp=header.findtext(OAI_NAMESPACE + 'datestamp')),
+            deleted=header.get('status') == 'deleted',
+            metadata={},
+        )
+        metadata = element.find(OAI_NAMESPACE + 'metadata')
+        if record.deleted or metadata is None:
+            return record
+        for child in metadata.iter(tag=etree.Element):
+            if len(child):
+                continue
+            # the DataCite resource type is often only given as attribute
+            text = (child.text or '').strip() or child.get('resourceTypeGeneral')
+            name = etree.QName(child).localname
+            name = self.field_map.get(name, name)
+            if text and name in self.fields:
+                record.metadata.setdefault(name, []).append(text)
+            if child.get('relationType') == 'IsVersionOf' and text:
+                # the concept DOI, see extract_concept_doi
+                record.metadata.setdefault('isVersionOf', []).append(text)
+        return record
+
+
+def oai_date_windows(sickle, start, window_days):
+    """
+    Split the time from `start` until now into consecutive `from`/`until` windows for OAI-PMH requests.
+    The datestamp granularity of the provider is taken from its Identify response.
+
+    :param sickle: Sickle client of the provider.
+    :param start: Datestamp of the first window or None to start at the earliest datestamp of the provider.
+    :param window_days: Length of a window in days.
+    :return: List of (from, until) datestamps, `until` of the last window is None.
+    """
+    identify = sickle.Identify()
+    day_granularity = getattr(identify, 'granularity', '') == 'YYYY-MM-DD'
+    fmt, unit = ('%Y-%m-%d', timedelta(days=1)) if day_granularity else ('%Y-%m-%dT%H:%M:%SZ', timedelta(seconds=1))
+    start = datetime.fromisoformat(start or identify.earliestDatestamp).replace(tzinfo=None)
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    windows = []
+    while True:
+        end = start + timedelta(days=window_days)
+        if end > now:
+            windows.append((start.strftime(fmt), None))
+            return windows
+        windows.append((start.strftime(fmt), (end - unit).strftime(fmt)))
+        start = end
+
+
+def _write_changes(records, changes, progress, on_page=None):
+    """
+    Write the records of a Sickle like iterator into a change log.
+    Deleted records are written as tombstones.
+
+    :param records: Iterator over records with a `resumption_token` attribute.
+    :param changes: Open change log.
+    :param progress: tqdm progress bar to update.
+    :param on_page: (None) called with the resumption token of the current page and the latest datestamp so far
+                    whenever a new page starts.
+    :return: Number of updated and deleted records and the latest datestamp.
+    """
+    n_updated, n_deleted, latest_datestamp = 0, 0, None
+    next_token = getattr(records.resumption_token, 'token', None)
+    for record in records:
+        # remember the token of the page the current record belongs to as a checkpoint
+        token = getattr(records.resumption_token, 'token', None)
+        if token != next_token and on_page:
+            changes.flush()
+            on_page(next_token, latest_datestamp)
+        next_token = token
+
+        datestamp = record.header.datestamp
+        if datestamp and (latest_datestamp is None or datestamp > latest_datestamp):
+            latest_datestamp = datestamp
+        if record.deleted:
+            # write a tombstone to remove the record from the corpus
+            entry = dict(oai_identifier=record.header.identifier, datestamp=datestamp, deleted=True)
+            n_deleted += 1
+        else:
+            entry = record_to_dataset(record)
+            n_updated += 1
+            logging.debug(f'Processed dataset: {entry["title"]}')
+        changes.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        progress.update()
+    return n_updated, n_deleted, latest_datestamp
+
+
+def get_metadata_from_repository(oai_url, set_name, output_file, metadata_prefix='oai_dc', state_file=None,
+                                 parser='sickle', fields=DC_FIELDS, window_days=None, max_workers=4,
+                                 host_slots=None, keep_changes=False):
     """
     Retrieves OAI-PMH metadata from an OAI-PMH provider given a `oai_url` and a `set_name`.
-    Writes all retrieved metadata for all data sets into one JSON file.
+    Writes all retrieved metadata for all data sets into one records file (see :func:`write_records`).
     Sickle can officially only handle the `oai_dc` (Dublin Core) metadata standard.
     Other metadata prefixes are generally possible but are not guaranteed to work.
 
+    Records are streamed into the change log `<output_file>.partial` (NDJSON) as they arrive,
+    which is merged into the output file once the harvest is complete.
+    So memory use does not depend on the size of the set and the change log of a failed harvest is still readable.
+
+    If a `state_file` is given, the harvest runs incrementally.
+    The state file remembers the latest datestamp and output file of the last successful harvest per
+    (`oai_url`, `set_name`, `metadata_prefix`).
+    The next harvest only asks for records changed since then and merges them into the previous output file.
+    Records flagged as deleted are removed from the corpus.
+    The resumption token of the current page is checkpointed after every page and when the harvest fails,
+    so the next call resumes where the failed one stopped.
+    Without a state file, the complete set is harvested and no output file is written if the harvest fails.
+
+    With `window_days` the harvest is split into `from`/`until` date windows (see :func:`oai_date_windows`),
+    which are harvested concurrently by at most `max_workers` threads.
+    Records showing up in more than one window are de-duplicated by their identifier when merging.
+    Finished windows are checkpointed, so an interrupted windowed harvest only repeats the unfinished windows.
+
     :param oai_url: URL to the OAI-PMH provider.
     :param set_name: Set to subset the returned data sets by.
-    :param output_file: Name of JSON file.
+    :param output_file: Name of the records file, e.g. `.json` or `.ndjson.gz`.
     :param metadata_prefix: (oai_dc) other metadata prefixes are possible but not guaranteed to work.
-    :return: Writes a JSON file to the current working directory.
+    :param state_file: (None) JSON file to keep the incremental harvest state in.
+    :param parser: ('sickle') 'iterparse' uses the faster :class:`IterparseRecordIterator`,
+                   which also supports `oai_datacite`.
+    :param fields: (:data:`DC_FIELDS`) Dublin Core fields to keep with the 'iterparse' parser,
+                   the others get their default value.
+    :param window_days: (None) length of the date windows in days, None harvests in one request sequence.
+    :param max_workers: (4) maximum number of concurrent requests to the provider for windowed harvests.
+    :param host_slots: (None) semaphore shared by all harvests of the same provider,
+                       every sequence of requests (one per window) holds one slot while it runs.
+    :param keep_changes: (False) keep the change log as `<output_file>.changes` to update the publication aggregates
+                         and indexes with, see :func:`update_stores`.
+    :return: Dictionary with the number of updated and deleted records and the number of records in the output file.
+             With `keep_changes` also `changes`, a dictionary with the `source` of the records (the harvest job),
+             the `base_file` the changes were merged into, the `output_file` and the change log `file`.
+             Writes a records file to the current working directory.
     """
-    sickle = Sickle(oai_url)
-    # Storage for results
-    datasets = []
+    host_slots = host_slots or nullcontext()
+    # the lists of changed records must be fresh, a cached page would hide the changes since it was stored
+    session = make_session(pool_size=max_workers, cache=False)
+    sickle = SessionSickle(oai_url, session=session)
+
+    def list_records(**kwargs):
+        if parser == 'iterparse':
+            return IterparseRecordIterator(session, oai_url, kwargs, fields=fields, metadata_prefix=metadata_prefix)
+        return sickle.ListRecords(**kwargs)
+
+    job_key = f'{oai_url}|{set_name}|{metadata_prefix}'
+    job_state = load_harvest_state(state_file).get(job_key, {}) if state_file else {}
+
+    # The corpus of the last harvest to merge the changes into
+    base_file = job_state.get('output_file')
+    if base_file and not os.path.exists(base_file):
+        logging.warning(f'{base_file} from the last harvest is missing, falling back to a full harvest.')
+        job_state, base_file = {}, None
+    partial_file = job_state.get('partial_file')
+    if not (partial_file and os.path.exists(partial_file)):
+        # no interrupted harvest to resume, start a new change log
+        partial_file = f'{output_file}.partial'
+        job_state = {key: job_state[key] for key in ('datestamp', 'output_file') if key in job_state}
+        open(partial_file, 'w').close()
+
+    params = dict(metadataPrefix=metadata_prefix, set=set_name)
+    if base_file and job_state.get('datestamp'):
+        params['from'] = job_state['datestamp']
+    progress = dict(updated=0, deleted=0, datestamp=job_state.get('pending_datestamp') or job_state.get('datestamp'),
+                    token=job_state.get('resumption_token'))
+    windows = [tuple(window) for window in job_state.get('windows', [])]
+    finished_windows = [tuple(window) for window in job_state.get('finished_windows', [])]
+    lock = threading.Lock()
+
+    def update_progress(n_updated, n_deleted, datestamp):
+        progress['updated'] += n_updated
+        progress['deleted'] += n_deleted
+        if datestamp and (progress['datestamp'] is None or datestamp > progress['datestamp']):
+            progress['datestamp'] = datestamp
+
+    def checkpoint():
+        if state_file:
+            checkpoint_state = dict(job_state, partial_file=partial_file, resumption_token=progress['token'],
+                                    pending_datestamp=progress['datestamp'])
+            if windows:
+                checkpoint_state.update(windows=windows, finished_windows=finished_windows)
+            update_harvest_state(state_file, job_key, checkpoint_state)
+
+    def on_page(token, datestamp):
+        progress['token'] = token
+        update_progress(0, 0, datestamp)
+        checkpoint()
+
+    def harvest_window(window, changes, pbar):
+        window_params = dict(params, **{'from': window[0]})
+        if window[1]:
+            window_params['until'] = window[1]
+        window_file = f'{partial_file}.{windows.index(window)}'
+        with host_slots, open(window_file, 'w', encoding='utf-8') as window_changes:
+            try:
+                result = _write_changes(list_records(**window_params), window_changes, pbar)
+            except NoRecordsMatch:
+                result = (0, 0, None)
+        # append the finished window to the change log of the harvest
+        with lock, open(window_file, 'r', encoding='utf-8') as window_changes:
+            shutil.copyfileobj(window_changes, changes)
+            changes.flush()
+            os.remove(window_file)
+            update_progress(*result)
+            finished_windows.append(window)
+            checkpoint()
 
     # Fetch records
     logging.info(f'\N{DOWNWARDS BLACK ARROW} Starting dataset retrieval from {oai_url}...')
-    try:
-        records = sickle.ListRecords(metadataPrefix=metadata_prefix, set=set_name)
-        for record in tqdm(records, 'Records', unit=' records'):
-            # Extract metadata from the record
-            if record.deleted:  # if the record is deleted continue to next one
-                continue
-            metadata = record.metadata
-            # give sensible defaults if no value is found for a key to avoid raising an error
-            dataset = {
-                'doi': metadata.get('identifier', 'No doi')[0],
-                'authors': metadata.get('creator', []),
-                'title': metadata.get('title', 'No title'),
-                'date': metadata.get('date', 'No date'),
-                'format': metadata.get('format', 'No format'),
-                'type': metadata.get('type', 'No type'),
-                'coverage': metadata.get('coverage', 'No coverage'),
-                'rights': metadata.get('rights', 'No rights'),
-                'relation': metadata.get('relation', 'No relation'),
-                'description': metadata.get('description', 'No description'),
-                'publisher': metadata.get('publisher', 'No publisher'),
-            }
-
-            # Ensure multivalued fields are stored as lists
-            for key, value in dataset.items():
-                if not isinstance(value, list):
-                    dataset[key] = [value]
-
-            datasets.append(dataset)
-            logging.debug(f'Processed dataset: {dataset['title']}')
-
-        logging.info(f'Dataset retrieval complete. Total records: {len(datasets)}')
-
-    except Exception as e:
-        logging.error(f'An error occurred during dataset retrieval: {e}')
-
-    # Export results to JSON
-    with open(output_file, 'w', encoding='utf-8') as file:
-        json.dump(datasets, file, ensure_ascii=False, indent=4)
+    if progress['token'] or finished_windows:
+        logging.info(f'Resuming the interrupted harvest from {partial_file}')
+    elif 'from' in params:
+        logging.info(f'Harvesting changes since {params["from"]} on top of {base_file}')
+    with open(partial_file, 'a', encoding='utf-8') as changes, tqdm(desc='Records', unit=' records') as pbar:
+        try:
+            if window_days or windows:
+                windows = windows or oai_date_windows(sickle, params.get('from'), window_days)
+                todo = [window for window in windows if window not in finished_windows]
+                logging.info(f'Harvesting {len(todo)} date windows with {max_workers} workers')
+                with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                    for future in [executor.submit(harvest_window, window, changes, pbar) for window in todo]:
+                        future.result()
+            else:
+                with host_slots:
+                    try:
+                        records = list_records(**(dict(resumptionToken=progress['token']) if progress['token']
+                                                  else params))
+                    except BadResumptionToken:
+                        logging.warning('Resumption token of the last checkpoint expired, restarting the harvest.')
+                        progress['token'] = None
+                        records = list_records(**params)
+                    update_progress(*_write_changes(records, changes, pbar, on_page=on_page))
+
+        except NoRecordsMatch:
+            pass
 
+        except Exception as e:
+            logging.error(f'An error occurred during dataset retrieval: {e}')
+            if state_file:
+                changes.flush()
+                checkpoint()
+                logging.error(f'Checkpoint written to {state_file}, retrieved records are kept in {partial_file}')
+            raise
+
+    if not progress['updated'] and not progress['deleted']:
+        logging.info('No new or changed records found.')
+    with metrics.stage('merge'):
+        n_records = merge_records(base_file, partial_file, output_file)
+    metrics.count('records_updated', progress['updated'])
+    metrics.count('records_deleted', progress['deleted'])
+    result = dict(updated=progress['updated'], deleted=progress['deleted'], records=n_records)
+    if keep_changes:
+        result['changes'] = dict(source=job_key, base_file=base_file, output_file=output_file,
+                                 file=f'{output_file}.changes')
+        os.replace(partial_file, result['changes']['file'])
+    else:
+        os.remove(partial_file)
+    logging.info(f'Dataset retrieval complete. Updated records: {progress["updated"]}, '
+                 f'deleted records: {progress["deleted"]}, total records: {n_records}')
     logging.info(f'Data exported to {output_file}')
 
+    if state_file:
+        update_harvest_state(state_file, job_key, dict(datestamp=progress['datestamp'], output_file=output_file))
+
+    return result
+
+
+def run_harvest_jobs(jobs, output_dir, date, state_file=None, host_limits=None, default_host_limit=2, max_jobs=8,
+                     aggregates=None, search_index=None, spatial_index=None):
+    """
+    Harvest many (provider, set, metadata prefix) jobs concurrently with :func:`get_metadata_from_repository`.
+    The number of concurrent request sequences per provider host is limited by `host_limits`,
+    so the total time approaches the one of the slowest provider instead of the sum of all jobs.
+    A failing job is reported and does not stop the other jobs.
+    The stores are only updated once all jobs finished (see :func:`update_stores`),
+    so they never mix the records of a harvest with the ones of the last complete harvest.
+
+    :param jobs: List of dictionaries with the keys `name`, `oai_url` and `set`.
+                 All other keys are passed on to :func:`get_metadata_from_repository`,
+                 e.g. `metadata_prefix`, `parser` or `window_days`.
+                 The records are written to `<output_dir>/<date>-datasets_<name>.ndjson.gz`.
+    :param output_dir: Directory for the records files.
+    :param date: Date string used in the file names.
+    :param state_file: (None) JSON file to keep the incremental harvest state in.
+    :param host_limits: (None) dictionary with the maximum number of concurrent request sequences per host.
+    :param default_host_limit: (2) limit for hosts missing in `host_limits`.
+    :param max_jobs: (8) maximum number of jobs running at the same time.
+    :param aggregates: (None) :class:`PublicationAggregates` updated with the records of all jobs.
+    :param search_index: (None) :class:`SearchIndex` updated with the records of all jobs.
+    :param spatial_index: (None) :class:`SpatialIndex` updated with the records of all jobs.
+    :return: List with one report dictionary per job with the keys `name`, `oai_url`, `set`, `output_file`,
+             `status` ('ok' or 'failed'), `seconds`, `records_per_second`, `error`
+             and the counts returned by :func:`get_metadata_from_repository`.
+    """
+    stores = {name: store for name, store in (('aggregates', aggregates), ('search_index', search_index),
+                                              ('spatial_index', spatial_index)) if store is not None}
+    host_limits = host_limits or {}
+    slots = {}
+    for job in jobs:
+        host = urlparse(job['oai_url']).netloc
+        slots.setdefault(host, threading.BoundedSemaphore(host_limits.get(host, default_host_limit)))
+
+    def run(job):
+        options = {key: value for key, value in job.items() if key not in ('name', 'oai_url', 'set')}
+        output_file = f'{output_dir}/{date}-datasets_{job["name"]}.ndjson.gz'
+        report = dict(name=job['name'], oai_url=job['oai_url'], set=job['set'], output_file=output_file,
+                      status='ok', error=None)
+        start = time.perf_counter()
+        try:
+            with metrics.stage(f'harvest.{job["name"]}'):
+                report.update(get_metadata_from_repository(job['oai_url'], job['set'], output_file,
+                                                           state_file=state_file,
+                                                           host_slots=slots[urlparse(job['oai_url']).netloc],
+                                                           keep_changes=bool(stores), **options))
+        except Exception as e:
+            log.exception(f'Harvest job {job["name"]} failed')
+            report.update(status='failed', error=f'{type(e).__name__}: {e}')
+        report['seconds'] = time.perf_counter() - start
+        n_harvested = report.get('updated', 0) + report.get('deleted', 0)
+        report['records_per_second'] = n_harvested / report['seconds'] if report['seconds'] else 0.
+        return report
+
+    with ThreadPoolExecutor(max_workers=max_jobs) as executor:
+        reports = list(executor.map(run, jobs))
+
+    for report in reports:
+        if report['status'] == 'ok':
+            logging.info(f'{report["name"]}: {report["updated"]} updated, {report["deleted"]} deleted, '
+                         f'{report["records"]} records in {report["seconds"]:.1f} s '
+                         f'({report["records_per_second"]:.0f} records/s)')
+        else:
+            logging.error(f'{report["name"]}: failed after {report["seconds"]:.1f} s - {report["error"]}')
+
+    changes = [report.pop('changes') for report in reports if 'changes' in report]
+    if stores and all(report['status'] == 'ok' for report in reports):
+        update_stores(stores, changes)
+    elif stores:
+        logging.warning(f'Not all harvest jobs finished, {", ".join(stores)} are not updated.')
+    for change_log in changes:
+        os.remove(change_log['file'])
+    return reports
+
+
+def update_stores(stores, changes):
+    """
+    Update the publication aggregates and indexes with the records of finished harvest jobs.
 
-def get_pangaea_usage_statistics(doi):
-    r = requests.get('https://doi.pangaea.de/'+doi+'?format=statistics')
+    Every store remembers the records file it was last updated with per harvest job.
+    The change log of a job is only applied if it was merged into this file.
+    Otherwise, e.g. for a full harvest or after a harvest in which another job failed,
+    the records of the job are replaced with the complete records file.
+
+    :param stores: Dictionary of name and store (:class:`PublicationAggregates`, :class:`SearchIndex`, ...).
+    :param changes: Changes of every job, see `keep_changes` of :func:`get_metadata_from_repository`.
+    """
+    for name, store in stores.items():
+        with metrics.stage(name):
+            for change_log in changes:
+                key = f'records_file|{change_log["source"]}'
+                if change_log['base_file'] and store.get_meta(key) == change_log['base_file']:
+                    store.apply(latest_changes(change_log['file']), source=change_log['source'])
+                else:
+                    store.apply(read_records(change_log['output_file']), source=change_log['source'], reset=True)
+                store.set_meta(key, change_log['output_file'])
+
+
+def pangaea_statistics_url(doi):
+    """
+    Build the URL of the usage statistics of a PANGAEA data set.
+    Accepts bare DOIs (`10.1594/PANGAEA.123`) as well as DOI URLs and skips the redirect via doi.org.
+
+    :param doi: DOI of the data set.
+    :return: URL of the statistics endpoint.
+    """
+    doi = doi.removeprefix('https://doi.org/').removeprefix('http://doi.org/')
+    if not doi.startswith('http'):
+        doi = f'https://doi.pangaea.de/{doi}'
+    return f'{doi}?format=statistics'
+
+
+def get_pangaea_usage_statistics(doi, session=None, rate_limiter=None):
+    """
+    Get the usage statistics of one PANGAEA data set.
+
+    :param doi: DOI of the data set, see :func:`pangaea_statistics_url`.
+    :param session: (None) session to reuse, a new one with retries is created otherwise.
+    :param rate_limiter: (None) :class:`RateLimiter` shared between threads.
+    :return: Dictionary with the statistics as returned by PANGAEA or with an `error` key if the request failed.
+    """
+    session = session or make_session(pool_size=1)
+    url = pangaea_statistics_url(doi)
     try:
-        j = json.loads(r.text)
-    except:
-        print('Problem with get_usage_statistics(', doi, ')')
-        j = {}
-    return j
+        if rate_limiter:
+            rate_limiter.wait(url)
+        r = session.get(url, timeout=30)
+        r.raise_for_status()
+        return r.json()
+    except (requests.RequestException, ValueError) as e:
+        log.warning(f'Could not get usage statistics for {doi}: {e}')
+        return {'error': str(e)}
+
+
+def fetch_pangaea_usage_statistics(dois, max_workers=8, rate=10, checkpoint_file=None):
+    """
+    Get the usage statistics of many PANGAEA data sets concurrently.
+    All threads share one session with pooled keep-alive connections and one per host rate limit.
+
+    If a `checkpoint_file` is given, every result is appended to it (NDJSON) as soon as it arrives.
+    DOIs with a successful result in the checkpoint file are not queried again,
+    so a rerun after a crash only fetches the missing DOIs.
+
+    :param dois: Iterable of DOIs, see :func:`pangaea_statistics_url`.
+    :param max_workers: (8) number of concurrent requests.
+    :param rate: (10) maximum number of requests per second and host.
+    :param checkpoint_file: (None) NDJSON file to append the results to, should be unique per snapshot.
+    :return: List with one dictionary per DOI in the input order with the keys
+             `doi`, `metadata_views`, `data_views`, `downloads` and `error` (None if the request succeeded).
+    """
+    dois = list(dois)
+    done = {}
+    if checkpoint_file and os.path.exists(checkpoint_file):
+        for result in read_records(checkpoint_file):
+            if result['error'] is None:
+                done[result['doi']] = result
+        log.info(f'Found {len(done)} DOIs in {checkpoint_file}, skipping them')
+    missing = list(dict.fromkeys(doi for doi in dois if doi not in done))
+
+    session = make_session(pool_size=max_workers)
+    rate_limiter = RateLimiter(rate)
+
+    def fetch(doi):
+        j = get_pangaea_usage_statistics(doi, session=session, rate_limiter=rate_limiter)
+        return dict(doi=doi,
+                    metadata_views=j.get('metadata_views', 0),
+                    data_views=j.get('data_views', 0),
+                    downloads=j.get('downloads', 0),
+                    error=j.get('error'))
+
+    new = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor, \
+            open_records_file(checkpoint_file, 'at') if checkpoint_file else nullcontext() as checkpoint:
+        futures = [executor.submit(fetch, doi) for doi in missing]
+        for future in tqdm(as_completed(futures), 'DOIs', total=len(futures), unit=' DOIs'):
+            result = future.result()
+            new[result['doi']] = result
+            if checkpoint:
+                checkpoint.write(json.dumps(result) + '\n')
+                checkpoint.flush()
+
+    results = [done.get(doi) or new[doi] for doi in dois]
+    n_errors = sum(result['error'] is not None for result in results)
+    metrics.count('pangaea_statistics', len(new))
+    metrics.count('pangaea_statistics_errors', n_errors)
+    if n_errors:
+        log.warning(f'Usage statistics could not be retrieved for {n_errors} of {len(dois)} DOIs')
+    return results
+
+
+USAGE_COLUMNS = ('metadata_views', 'data_views', 'downloads')
+
+
+def snapshot_date(date):
+    """Return a date given as `yyyymmdd`, `yyyy-mm-dd` or datetime as ISO string `yyyy-mm-dd`."""
+    if isinstance(date, datetime):
+        return date.date().isoformat()
+    date = str(date)
+    return datetime.strptime(date, '%Y%m%d').date().isoformat() if len(date) == 8 else date
+
+
+class UsageStore:
+    """
+    Append-only time series of usage statistics snapshots in a SQLite database,
+    one row per (`doi`, `publisher`, `snapshot_date`) with the metadata views, data views and downloads.
+    The deltas between snapshots are computed in SQL over the primary key index,
+    so trends of single DOIs or whole repositories do not need to load all snapshots.
+
+    :param path: ('./data/usage_statistics.sqlite') path to the SQLite database.
+    """
+
+    def __init__(self, path='./data/usage_statistics.sqlite'):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(
+            'CREATE TABLE IF NOT EXISTS usage (doi TEXT, publisher TEXT, snapshot_date TEXT, '
+            'metadata_views INTEGER, data_views INTEGER, downloads INTEGER, '
+            'PRIMARY KEY (doi, publisher, snapshot_date)) WITHOUT ROWID;'
+            'CREATE INDEX IF NOT EXISTS usage_publisher_date ON usage (publisher, snapshot_date);')
+
+    def add_snapshot(self, date, publisher, results):
+        """
+        Append the usage statistics of one repository at one date.
+        Results with an error are skipped, adding the same snapshot again replaces its values.
+
+        :param date: Date of the snapshot, see :func:`snapshot_date`.
+        :param publisher: Name of the repository, e.g. 'PANGAEA'.
+        :param results: Iterable of dictionaries with the keys `doi`, `metadata_views`, `data_views`, `downloads`
+                        and optionally `error`, e.g. from :func:`fetch_pangaea_usage_statistics`.
+        :return: Number of stored DOIs.
+        """
+        date = snapshot_date(date)
+        rows = [(result['doi'], publisher, date, *(int(result.get(column) or 0) for column in USAGE_COLUMNS))
+                for result in results if result.get('error') is None]
+        with self._lock, self._db:
+            self._db.executemany('INSERT OR REPLACE INTO usage VALUES (?, ?, ?, ?, ?, ?)', rows)
+        log.info(f'Stored usage statistics of {len(rows)} {publisher} DOIs for {date}')
+        return len(rows)
+
+    def has_snapshot(self, date, publisher):
+        """Return True if there is a snapshot of `publisher` at `date`."""
+        return self._db.execute('SELECT 1 FROM usage WHERE publisher = ? AND snapshot_date = ? LIMIT 1',
+                                (publisher, snapshot_date(date))).fetchone() is not None
+
+    def snapshot_dates(self, publisher=None):
+        """Return the dates of all snapshots (of `publisher`) in ascending order."""
+        rows = self._db.execute('SELECT DISTINCT snapshot_date FROM usage WHERE ? IS NULL OR publisher = ? '
+                                'ORDER BY snapshot_date', (publisher, publisher)).fetchall()
+        return [row[0] for row in rows]
+
+    def snapshot(self, date, publisher=None):
+        """
+        Usage statistics of all DOIs at one date.
+
+        :param date: Date of the snapshot, see :func:`snapshot_date`.
+        :param publisher: (None) only this repository.
+        :return: pandas.DataFrame with the columns doi, publisher, metadata_views, data_views and downloads.
+        """
+        return pd.read_sql_query('SELECT doi, publisher, metadata_views, data_views, downloads FROM usage '
+                                 'WHERE snapshot_date = ? AND (? IS NULL OR publisher = ?) ORDER BY publisher, doi',
+                                 self._db, params=(snapshot_date(date), publisher, publisher))
+
+    @staticmethod
+    def _delta_columns(partition):
+        # difference to the previous snapshot and growth rate relative to it for each usage column
+        columns = []
+        for column in USAGE_COLUMNS:
+            previous = f'LAG({column}) OVER (PARTITION BY {partition} ORDER BY snapshot_date)'
+            columns += [f'{column} - {previous} AS {column}_delta',
+                        f'CAST({column} - {previous} AS REAL) / NULLIF({previous}, 0) AS {column}_growth']
+        return ', '.join(columns)
+
+    def deltas(self, doi=None, publisher=None, start=None, end=None):
+        """
+        Usage statistics per DOI and snapshot with the difference to the previous snapshot of the DOI
+        (`<column>_delta`) and the growth rate relative to it (`<column>_growth`, NaN if the previous value is 0).
+        The first snapshot of a DOI has no delta.
+
+        :param doi: (None) only this DOI.
+        :param publisher: (None) only this repository.
+        :param start: (None) first snapshot date, the snapshot before it is still used for the deltas.
+        :param end: (None) last snapshot date.
+        :return: pandas.DataFrame sorted by publisher, doi and snapshot_date.
+        """
+        df = pd.read_sql_query(
+            f'SELECT doi, publisher, snapshot_date, {", ".join(USAGE_COLUMNS)}, '
+            f'{self._delta_columns("doi, publisher")} FROM usage '
+            'WHERE (? IS NULL OR doi = ?) AND (? IS NULL OR publisher = ?) AND (? IS NULL OR snapshot_date <= ?) '
+            'ORDER BY publisher, doi, snapshot_date',
+            self._db, params=(doi, doi, publisher, publisher, *[snapshot_date(end) if end else None] * 2))
+        return df[df['snapshot_date'] >= snapshot_date(start)] if start else df
+
+    def repository_totals(self, publisher=None):
+        """
+        Usage statistics summed per repository and snapshot with the number of DOIs,
+        the difference to the previous snapshot (`<column>_delta`) and the growth rate relative to it
+        (`<column>_growth`).
+
+        :param publisher: (None) only this repository.
+        :return: pandas.DataFrame sorted by publisher and snapshot_date.
+        """
+        totals = ', '.join(f'SUM({column}) AS {column}' for column in USAGE_COLUMNS)
+        return pd.read_sql_query(
+            f'SELECT publisher, snapshot_date, n_dois, {", ".join(USAGE_COLUMNS)}, '
+            f'{self._delta_columns("publisher")} FROM ('
+            f'  SELECT publisher, snapshot_date, COUNT(*) AS n_dois, {totals} FROM usage '
+            '  WHERE ? IS NULL OR publisher = ? GROUP BY publisher, snapshot_date'
+            ') ORDER BY publisher, snapshot_date',
+            self._db, params=(publisher, publisher))
+
+
+# Dublin Core fields with one value per data set, the remaining fields are kept as lists in the corpus
+SINGLE_VALUED_FIELDS = ('doi', 'title', 'date', 'type', 'publisher', 'description')
+CATEGORICAL_FIELDS = ['type', 'publisher']
+
+
+def first_values(s):
+    """
+    Replace the lists in a whole column by their first item at once (None for empty lists).
+    Scalar values are kept as they are.
+
+    :param s: pandas.Series with lists and/or scalars.
+    :return: pandas.Series with the same index.
+    """
+    exploded = s.reset_index(drop=True).explode()
+    first = exploded[~exploded.index.duplicated()]
+    first.index = s.index
+    return first.astype(object).where(first.notna(), None)
+
+
+def parse_dates(s):
+    """
+    Parse a whole column of Dublin Core dates at once.
+    ISO dates with or without time as well as year-only dates are accepted.
+    Time zones are converted to UTC and dropped, missing ('No date') or malformed dates become NaT.
+
+    :param s: pandas.Series with date strings.
+    :return: pandas.Series of dtype datetime64.
+    """
+    return pd.to_datetime(s, errors='coerce', format='ISO8601', utc=True).dt.tz_localize(None)
+
+
+def normalise_frame(df, columns=SINGLE_VALUED_FIELDS, date_column='date'):
+    """
+    Flatten the single valued list columns and parse the date column of a DataFrame built from harvested records.
+    Replaces ``df.map(extract_single_value)`` and parsing the dates row by row.
+
+    :param df: DataFrame with one record per row, see :func:`read_records`.
+    :param columns: (:data:`SINGLE_VALUED_FIELDS`) columns to replace by their first value.
+    :param date_column: ('date') column to parse with :func:`parse_dates`, None to skip it.
+    :return: Normalised copy of `df`.
+    """
+    df = df.copy()
+    for column in columns:
+        if column in df:
+            df[column] = first_values(df[column])
+    if date_column:
+        df[date_column] = parse_dates(df[date_column])
+    return df
+
+
+# Number of distinct values after which a field which hardly repeats (DOIs, titles, ...) is packed
+PACK_THRESHOLD = 4096
+
+
+class _PackedStrings:
+    # strings of a field which hardly repeats in one UTF-8 buffer, see _EncodedColumn
+    __slots__ = ('data', 'ends')
+
+    def __init__(self, strings=()):
+        self.data = bytearray()
+        self.ends = array('q')
+        for string in strings:
+            self.append(string)
+
+    def __len__(self):
+        return len(self.ends)
+
+    def __getitem__(self, code):
+        if code < 0:
+            return None
+        return self.data[self.ends[code - 1] if code else 0:self.ends[code]].decode()
+
+    def append(self, string):
+        self.data += string.encode()
+        self.ends.append(len(self.data))
+
+
+class _EncodedColumn:
+    # values of one field, see RecordTable
+    __slots__ = ('values', 'index', 'codes', 'offsets', 'is_list')
+    MISSING = -1
+    # code of None in packed fields
+    NONE = -2
+
+    def __init__(self, n_missing, is_list):
+        self.values = []
+        # value -> code while the field is dictionary encoded, None once it is packed
+        self.index = {}
+        self.codes = array('i', [self.MISSING] * n_missing)
+        # codes of record i are codes[offsets[i]:offsets[i + 1]], a single MISSING marks a missing field.
+        # None as long as every record has exactly one code, i.e. always for scalar fields
+        self.offsets = None
+        self.is_list = is_list
+
+    def encode(self, value):
+        if self.index is None:
+            if value is None:
+                return self.NONE
+            self.values.append(value if isinstance(value, str) else str(value))
+            return len(self.values) - 1
+        code = self.index.get(value)
+        if code is None:
+            code = self.index[value] = len(self.values)
+            self.values.append(value)
+            if code >= PACK_THRESHOLD and code > len(self.codes) // 2:
+                self._pack()
+        return code
+
+    def _pack(self):
+        # the values hardly repeat, a dictionary would cost more than it saves
+        if not all(isinstance(value, str) for value in self.index if value is not None):
+            return
+        none_code = self.index.get(None)
+        if none_code is not None:
+            self.codes = array('i', (self.NONE if code == none_code else code for code in self.codes))
+        self.values = _PackedStrings(value or '' for value in self.values)
+        self.index = None
+
+    def add(self, value):
+        # encode before looking up self.codes, packing the field replaces the array
+        if not self.is_list:
+            code = self.encode(value[0] if value else None) if isinstance(value, list) else self.encode(value)
+            self.codes.append(code)
+            return
+        if not isinstance(value, list):
+            value = [value]
+        codes = [self.encode(item) for item in value]
+        if len(codes) == 1 and self.offsets is None:
+            self.codes.append(codes[0])
+            return
+        if self.offsets is None:
+            self.offsets = array('I', range(len(self.codes) + 1))
+        self.codes.extend(codes)
+        self.offsets.append(len(self.codes))
+
+    def add_missing(self):
+        self.codes.append(self.MISSING)
+        if self.offsets is not None:
+            self.offsets.append(len(self.codes))
+
+    @property
+    def n_records(self):
+        return len(self.codes) if self.offsets is None else len(self.offsets) - 1
+
+    def bounds(self, i):
+        return (i, i + 1) if self.offsets is None else (self.offsets[i], self.offsets[i + 1])
+
+    def is_missing(self, i):
+        start, end = self.bounds(i)
+        return end - start == 1 and self.codes[start] == self.MISSING
+
+    def get(self, i):
+        if self.is_missing(i):
+            return None
+        start, end = self.bounds(i)
+        if not self.is_list:
+            return self.values[self.codes[start]]
+        return [self.values[code] for code in self.codes[start:end]]
+
+    def to_list(self, first=False):
+        values, codes, offsets, missing = self.values, self.codes, self.offsets, self.MISSING
+        if offsets is None:
+            if not self.is_list or first:
+                return [values[code] if code >= 0 else None for code in codes]
+            return [None if code == missing else [values[code]] for code in codes]
+        if first:
+            return [values[codes[start]] if end > start and codes[start] >= 0 else None
+                    for start, end in zip(offsets, offsets[1:])]
+        return [None if end - start == 1 and codes[start] == missing else [values[code] for code in codes[start:end]]
+                for start, end in zip(offsets, offsets[1:])]
+
+
+class RecordTable:
+    """
+    Compact in-memory table of harvested records to build the corpus from.
+
+    Every field is dictionary encoded: a distinct value like a publisher, a type, a license or an author name is
+    stored once and the records only hold its integer code in an array. List valued fields keep the codes of all
+    records in one array with the offsets of each record, so :meth:`values` of `authors` is the author ID table
+    the records refer to. Fields which hardly repeat, like DOIs, titles and datestamps, are packed into one UTF-8
+    buffer once they have :data:`PACK_THRESHOLD` distinct values.
+    Compared with a list of record dictionaries, which holds eleven lists and a separate string object for every
+    value of every record, memory drops by about an order of magnitude.
+
+    Fields are list valued if their first value is a list. Records without a field hold None,
+    scalars in list valued fields are wrapped in a list and lists in scalar fields are reduced to their first item.
+
+    :param records: (()) iterable of record dictionaries to add, see :func:`read_records`.
+    """
+
+    def __init__(self, records=()):
+        self._columns = {}
+        self._n_records = 0
+        self.extend(records)
+
+    def __len__(self):
+        return self._n_records
+
+    def __iter__(self):
+        return (self.record(i) for i in range(self._n_records))
+
+    @property
+    def fields(self):
+        """Names of the fields in the order they first appeared."""
+        return list(self._columns)
+
+    def append(self, record):
+        """Add a record dictionary to the table."""
+        columns = self._columns
+        for name, value in record.items():
+            column = columns.get(name)
+            if column is None:
+                column = columns[name] = _EncodedColumn(self._n_records, isinstance(value, list))
+            column.add(value)
+        self._n_records += 1
+        if len(record) < len(columns):
+            for column in columns.values():
+                if column.n_records < self._n_records:
+                    column.add_missing()
+
+    def extend(self, records):
+        """Add all record dictionaries of an iterable to the table."""
+        for record in records:
+            self.append(record)
+
+    def record(self, i):
+        """Record `i` as dictionary like it was added, without the fields it did not have."""
+        record = {}
+        for name, column in self._columns.items():
+            if not column.is_missing(i):
+                record[name] = column.get(i)
+        return record
+
+    def values(self, field):
+        """
+        Values of a field, the codes of the records index into this sequence.
+        Dictionary encoded fields give each distinct value once.
+        """
+        return self._columns[field].values
+
+    def codes(self, field, i):
+        """Codes of the values of `field` in record `i`, -1 if the record does not have the field, -2 for None."""
+        column = self._columns[field]
+        start, end = column.bounds(i)
+        return column.codes[start:end].tolist()
+
+    def column(self, field, first=False):
+        """
+        All values of a field as list, list valued fields give one list per record.
+
+        :param field: Name of the field.
+        :param first: (False) give only the first value of list valued fields (None for empty lists).
+        :return: List with one entry per record, the repeated values are the same objects.
+        """
+        return self._columns[field].to_list(first=first)
+
+    def to_frame(self, single_valued=SINGLE_VALUED_FIELDS, date_column='date'):
+        """
+        DataFrame of the records like :func:`normalise_frame` makes it from the record dictionaries,
+        but without building them first.
+
+        :param single_valued: (:data:`SINGLE_VALUED_FIELDS`) fields which hold their first value.
+        :param date_column: ('date') column to parse with :func:`parse_dates`, None to skip it.
+        :return: pandas.DataFrame
+        """
+        df = pd.DataFrame({field: pd.Series(self.column(field, first=True), dtype=object) if field in single_valued
+                           else self.column(field) for field in self._columns},
+                          index=pd.RangeIndex(self._n_records))
+        if date_column and date_column in df:
+            df[date_column] = parse_dates(df[date_column])
+        return df
+
+
+def corpus_frame(records):
+    """
+    Build the normalised corpus from harvested records.
+    Fields in :data:`SINGLE_VALUED_FIELDS` hold their first value, all other metadata fields stay lists.
+    `date` is parsed to datetime (NaT if missing), `type` and `publisher` are categorical,
+    and `concept_doi` holds the DOI shared by all versions of a data set (see :func:`extract_concept_doi`).
+
+    :param records: Iterable of record dictionaries (see :func:`read_records`) or a :class:`RecordTable`.
+    :return: pandas.DataFrame
+    """
+    table = records if isinstance(records, RecordTable) else RecordTable(records)
+    df = table.to_frame()
+    df[CATEGORICAL_FIELDS] = df[CATEGORICAL_FIELDS].astype('category')
+    if 'oai_identifier' not in df:
+        # records files written before the OAI identifier was stored, the DOI identifies the record as well
+        df['oai_identifier'] = df['doi']
+    # records harvested before the concept DOI was extracted by the harvester
+    missing = df['concept_doi'].isna() if 'concept_doi' in df else pd.Series(True, index=df.index)
+    if missing.any():
+        old = df[missing]
+        df.loc[missing, 'concept_doi'] = [
+            extract_concept_doi([doi] if isinstance(doi, str) else [], relation if isinstance(relation, list) else [],
+                                oai_identifier)
+            for doi, relation, oai_identifier in zip(old['doi'], old['relation'], old['oai_identifier'])]
+    return df
+
+
+@metrics.stage('write_corpus')
+def write_corpus(corpus_file, record_files):
+    """
+    Write the normalised corpus of one or more records files to a Parquet file.
+    Reading it back with `pandas.read_parquet(corpus_file, columns=[...])` only loads the selected columns
+    and needs no further preprocessing.
+
+    :param corpus_file: Path to the Parquet file.
+    :param record_files: List of records files, see :func:`read_records`.
+    :return: Number of data sets in the corpus.
+    """
+    # the records are collected in a compact table, not as list of dictionaries
+    df = corpus_frame(RecordTable(itertools.chain.from_iterable(read_records(file) for file in record_files)))
+    df.to_parquet(corpus_file, index=False)
+    logging.info(f'Corpus with {len(df)} data sets written to {corpus_file}')
+    return len(df)
+
+
+@metrics.stage('load_corpus')
+def load_corpus(date, columns=None, data_dir='./data', corpus='ac3', repositories=('zenodo', 'pangaea')):
+    """
+    Load the normalised corpus of a harvest, see :func:`write_corpus`.
+    Harvests without a corpus file are normalised from their records files.
+
+    :param date: Date of the harvest (yyyymmdd).
+    :param columns: (None) columns to load, all if None.
+    :param data_dir: ('./data') directory of the harvested files.
+    :param corpus: ('ac3') name of the corpus.
+    :param repositories: (('zenodo', 'pangaea')) names of the records files of harvests without a corpus file.
+    :return: pandas.DataFrame
+    """
+    corpus_file = f'{data_dir}/{date}-corpus_{corpus}.parquet'
+    if os.path.exists(corpus_file):
+        return pd.read_parquet(corpus_file, columns=columns)
+    # older harvests without a corpus file
+    record_files = [find_records_file(f'{data_dir}/{date}-datasets_{corpus}_{repository}')
+                    for repository in repositories]
+    df = corpus_frame(itertools.chain.from_iterable(read_records(file) for file in record_files))
+    return df[columns] if columns else df
+
+
+# Types of data set collections, which are not counted as publications
+COLLECTION_TYPES = ('dataset bundled publication', 'dataset bibliography', 'dataset publication series')
+
+
+class PublicationAggregates:
+    """
+    Materialised number of publications per year, publisher and type in a SQLite database,
+    which is updated with the changed and deleted records of every harvest instead of being computed from the corpus.
+
+    A publication is a data set with a date which is not a collection (:data:`COLLECTION_TYPES`).
+    All versions of a data set share their concept DOI (see :func:`extract_concept_doi`)
+    and only count once, with the date of the latest version.
+    Besides the counts, the database keeps one small row per record and an index of the latest version per concept DOI,
+    so the counts of a changed group of versions can be corrected without reading the corpus.
+
+    :param path: ('./data/publication_aggregates.sqlite') path to the SQLite database, ':memory:' for a temporary one.
+    """
+    # databases with another schema are rebuilt, the next harvest counts all records again
+    SCHEMA_VERSION = '2'
+
+    def __init__(self, path='./data/publication_aggregates.sqlite'):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        if self.get_meta('schema_version') != self.SCHEMA_VERSION:
+            self._db.executescript('DROP TABLE IF EXISTS publications; DROP TABLE IF EXISTS yearly_counts;'
+                                   'DROP TABLE IF EXISTS latest_versions; DELETE FROM meta;')
+            self.set_meta('schema_version', self.SCHEMA_VERSION)
+        self._db.executescript(
+            'CREATE TABLE IF NOT EXISTS publications (oai_identifier TEXT PRIMARY KEY, source TEXT, group_key TEXT, '
+            'date TEXT, year INTEGER, publisher TEXT, type TEXT);'
+            'CREATE INDEX IF NOT EXISTS publications_group ON publications (group_key);'
+            'CREATE INDEX IF NOT EXISTS publications_source ON publications (source);'
+            'CREATE TABLE IF NOT EXISTS yearly_counts (year INTEGER, publisher TEXT, type TEXT, count INTEGER, '
+            'PRIMARY KEY (year, publisher, type));'
+            'CREATE TABLE IF NOT EXISTS latest_versions (group_key TEXT PRIMARY KEY, oai_identifier TEXT);'
+            'CREATE TEMP TABLE changed (oai_identifier TEXT PRIMARY KEY);'
+            'CREATE TEMP TABLE affected (group_key TEXT PRIMARY KEY);')
+
+    def _add_counts(self, sign):
+        # add (or subtract) the latest versions of the affected groups
+        self._db.execute(
+            'INSERT INTO yearly_counts (year, publisher, type, count) '
+            'SELECT year, publisher, type, ? * COUNT(*) FROM temp.affected AS a '
+            'JOIN latest_versions AS l ON l.group_key = a.group_key '
+            'JOIN publications AS p ON p.oai_identifier = l.oai_identifier WHERE true GROUP BY year, publisher, type '
+            'ON CONFLICT (year, publisher, type) DO UPDATE SET count = count + excluded.count',
+            (sign,))
+
+    def _update_latest_versions(self):
+        # the latest version of each affected group, only dated data sets which are no collections are publications
+        placeholders = ', '.join('?' * len(COLLECTION_TYPES))
+        self._db.execute('DELETE FROM latest_versions WHERE group_key IN temp.affected')
+        self._db.execute(
+            'INSERT INTO latest_versions SELECT group_key, oai_identifier FROM ('
+            '  SELECT p.group_key, oai_identifier, ROW_NUMBER() OVER '
+            '    (PARTITION BY p.group_key ORDER BY date DESC, oai_identifier DESC) AS rank '
+            '  FROM publications AS p JOIN temp.affected AS a ON p.group_key = a.group_key '
+            f'  WHERE date IS NOT NULL AND type NOT IN ({placeholders})'
+            ') WHERE rank = 1',
+            COLLECTION_TYPES)
+
+    def apply_frame(self, df, deleted=(), source=None, reset=False):
+        """
+        Update the counts with changed records and deleted identifiers.
+
+        :param df: Normalised records (see :func:`corpus_frame`) with at least the columns oai_identifier, date,
+                   publisher, type and concept_doi.
+        :param deleted: Identifiers of deleted records.
+        :param source: (None) name of the harvest the records come from, e.g. the harvest job.
+        :param reset: (False) remove all records of `source` first, for a full harvest.
+        """
+        rows = []
+        if len(df):
+            # records without versions are their own group
+            group_key = df['concept_doi'].fillna(df['oai_identifier'])
+            dates = df['date'].dt.strftime('%Y-%m-%dT%H:%M:%S')
+            rows = list(zip(df['oai_identifier'], itertools.repeat(source), group_key.astype(object),
+                            dates.astype(object).where(dates.notna(), None),
+                            df['date'].dt.year.astype('Int64').astype(object).where(dates.notna(), None),
+                            df['publisher'].astype(object).fillna(''), df['type'].astype(object).fillna('')))
+            rows = [tuple(None if value is pd.NA or value != value else value for value in row) for row in rows]
+        with self._lock, self._db:
+            db = self._db
+            db.execute('DELETE FROM temp.changed')
+            db.execute('DELETE FROM temp.affected')
+            db.executemany('INSERT OR IGNORE INTO temp.changed VALUES (?)',
+                           [(row[0],) for row in rows] + [(identifier,) for identifier in deleted])
+            if reset:
+                db.execute('INSERT OR IGNORE INTO temp.changed SELECT oai_identifier FROM publications '
+                           'WHERE source IS ?', (source,))
+            # groups which lose or gain a record
+            db.execute('INSERT OR IGNORE INTO temp.affected SELECT group_key FROM publications '
+                       'WHERE oai_identifier IN temp.changed AND group_key IS NOT NULL')
+            db.executemany('INSERT OR IGNORE INTO temp.affected VALUES (?)',
+                           [(row[2],) for row in rows if row[2] is not None])
+            self._add_counts(-1)
+            db.execute('DELETE FROM publications WHERE oai_identifier IN temp.changed')
+            db.executemany('INSERT OR REPLACE INTO publications VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+            self._update_latest_versions()
+            self._add_counts(1)
+            db.execute('DELETE FROM yearly_counts WHERE count = 0')
+
+    def apply(self, records, source=None, reset=False, chunk_size=10000):
+        """
+        Update the counts with harvested records, e.g. the change log of a harvest.
+        The records are normalised in chunks, so memory use does not depend on the number of records.
+
+        :param records: Iterable of record dictionaries and tombstones, see :func:`read_records`.
+        :param source: (None) name of the harvest the records come from, e.g. the harvest job.
+        :param reset: (False) remove all records of `source` first, for a full harvest.
+        :param chunk_size: (10000) number of records normalised at once.
+        """
+        records = iter(records)
+        while chunk := list(itertools.islice(records, chunk_size)):
+            deleted = [record['oai_identifier'] for record in chunk if record.get('deleted')]
+            datasets = [record for record in chunk if not record.get('deleted')]
+            df = corpus_frame(datasets) if datasets else pd.DataFrame()
+            self.apply_frame(df, deleted, source=source, reset=reset)
+            reset = False
+        if reset:
+            self.apply_frame(pd.DataFrame(), source=source, reset=True)
+
+    def latest_version(self, concept_doi):
+        """Return the OAI identifier of the latest version of a data set or None."""
+        row = self._db.execute('SELECT oai_identifier FROM latest_versions WHERE group_key = ?',
+                               (concept_doi,)).fetchone()
+        return row[0] if row else None
+
+    def latest_version_ids(self):
+        """
+        Return the OAI identifiers of all publications (the latest version of every data set) as a set,
+        so de-duplicating the corpus is one lookup per record: ``df[df['oai_identifier'].isin(ids)]``.
+        """
+        return {row[0] for row in self._db.execute('SELECT oai_identifier FROM latest_versions')}
+
+    def get_meta(self, key, default=None):
+        """Return a value stored with :meth:`set_meta`."""
+        row = self._db.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key, value):
+        """Store a value like the date of the last complete harvest."""
+        with self._lock, self._db:
+            self._db.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)', (key, str(value)))
+
+    def counts(self):
+        """Return the materialised counts as a DataFrame with the columns year, publisher, type and count."""
+        return pd.read_sql_query('SELECT year, publisher, type, count FROM yearly_counts ORDER BY year, publisher, type',
+                                 self._db)
+
+    def yearly_publications(self):
+        """
+        Number of publications per year and publisher with the cumulative number of all publishers
+        (`cumulative_count`) and per publisher (`cumulative_count_<publisher>`).
+        Every publisher has a row in every year, like ``groupby(['year', 'publisher'], observed=False)``.
+
+        :return: pandas.DataFrame with one row per year and publisher.
+        """
+        df = pd.read_sql_query('SELECT year, publisher, SUM(count) AS count FROM yearly_counts '
+                               'GROUP BY year, publisher', self._db)
+        publishers = sorted(df['publisher'].unique())
+        index = pd.MultiIndex.from_product([sorted(df['year'].unique()), publishers], names=['year', 'publisher'])
+        df = df.set_index(['year', 'publisher'])['count'].reindex(index, fill_value=0).reset_index()
+        df['cumulative_count'] = df['count'].cumsum()
+        for publisher in publishers:
+            selection = df['publisher'] == publisher
+            df.loc[selection, f'cumulative_count_{publisher.lower()}'] = df.loc[selection, 'count'].cumsum()
+        return df
+
+
+def normalise_doi(doi):
+    """Return a DOI without resolver prefix in lower case, e.g. `10.1594/pangaea.123`, or None if it is none."""
+    match = re.search(r'10\.\d{4,9}/\S+', doi or '')
+    return match.group(0).lower() if match else None
+
+
+def duplicate_features(title, authors=()):
+    """
+    Features of a data set for near-duplicate detection: the words of the normalised title and the surnames of the
+    authors. DOIs are no features, the DOI of a data set differs in every repository.
+
+    :param title: Title of the data set.
+    :param authors: Authors as `Surname, Given names`.
+    :return: Set of strings.
+    """
+    title = unicodedata.normalize('NFKD', title or '').encode('ascii', 'ignore').decode().lower()
+    features = {f't:{word}' for word in re.findall(r'\w\w+', title)}
+    features.update(f'a:{author.split(",")[0].strip().lower()}' for author in authors if author)
+    return features
+
+
+def _direct_duplicate_links(df):
+    # pairs of positions linked by their identifiers: versions of a data set (same concept DOI) and data sets naming
+    # the DOI of a data set of another repository as relation, e.g. IsIdenticalTo
+    if 'concept_doi' in df:
+        versions = defaultdict(list)
+        for i, concept_doi in enumerate(df['concept_doi']):
+            if isinstance(concept_doi, str):
+                versions[concept_doi].append(i)
+        for positions in versions.values():
+            yield from zip(positions, positions[1:])
+    if 'relation' in df and 'publisher' in df:
+        positions = {doi: i for i, doi in enumerate(map(normalise_doi, df['doi'].where(df['doi'].notna(), None)))
+                     if doi}
+        publishers = df['publisher'].tolist()
+        for i, relation in enumerate(df['relation']):
+            for doi in map(normalise_doi, _as_list(relation)):
+                other = positions.get(doi)
+                if other is not None and publishers[other] != publishers[i]:
+                    yield i, other
+
+
+def _as_list(value):
+    # list columns of the corpus may be lists, numpy arrays (from Parquet) or missing
+    if isinstance(value, str):
+        return [value]
+    return list(value) if value is not None and not isinstance(value, float) else []
+
+
+@metrics.stage('find_duplicates')
+def find_duplicates(df, threshold=0.8, num_perm=128, bands=16, seed=1):
+    """
+    Flag clusters of near-duplicate data sets, e.g. the same data published on PANGAEA and Zenodo
+    or near-identical data sets of a series.
+
+    Every data set is represented by its :func:`duplicate_features`, whose MinHash signatures are indexed
+    with locality sensitive hashing (LSH) in `bands` bands.
+    Only data sets sharing a band are compared, so the run time grows with the number of similar data sets and not
+    quadratically with the corpus.
+    Candidates are confirmed with the exact Jaccard similarity of their features.
+    With the defaults, pairs with a similarity of 0.8 are found with a probability of about 95 %, 0.9 almost always.
+    Versions of a data set (same concept DOI) and data sets whose relations name the DOI of a data set of another
+    repository are linked directly, whatever their similarity.
+
+    :param df: Corpus with the columns oai_identifier, doi, title, date and optionally authors, relation,
+               publisher and concept_doi.
+    :param threshold: (0.8) minimum Jaccard similarity of the features of two duplicates.
+    :param num_perm: (128) number of hash functions of the MinHash signatures.
+    :param bands: (16) number of LSH bands, `num_perm` must be a multiple of it.
+    :param seed: (1) seed of the hash functions.
+    :return: DataFrame with the index of `df` and the columns `duplicate_cluster`
+             (OAI identifier of the earliest data set of the cluster or None) and
+             `duplicate` (True for all data sets of a cluster except the earliest one).
+    """
+    if num_perm % bands:
+        raise ValueError(f'num_perm ({num_perm}) must be a multiple of bands ({bands})')
+    rows = num_perm // bands
+    authors = df['authors'] if 'authors' in df else itertools.repeat(None)
+    features = [duplicate_features(title if isinstance(title, str) else '', _as_list(author))
+                for title, author in zip(df['title'], authors)]
+
+    # MinHash: minimum of ((a * x + b) mod p) & (2^32 - 1) over the 32 bit hashes x of the features
+    # for each hash function, the mask makes the permutations independent of the order of x
+    mersenne = np.uint64((1 << 61) - 1)
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, 1 << 32, num_perm, dtype=np.uint64)[:, None]
+    b = rng.integers(0, 1 << 32, num_perm, dtype=np.uint64)[:, None]
+    signatures = np.full((len(features), num_perm), mersenne, dtype=np.uint64)
+    for i, feature_set in enumerate(features):
+        if feature_set:
+            x = np.fromiter((zlib.crc32(feature.encode()) for feature in feature_set), np.uint64, len(feature_set))
+            signatures[i] = (((a * x + b) % mersenne) & np.uint64(0xFFFFFFFF)).min(axis=1)
+
+    # union-find over the linked and the confirmed pairs
+    parent = list(range(len(features)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for first, other in _direct_duplicate_links(df):
+        parent[find(other)] = find(first)
+
+    n_candidates = 0
+    has_features = np.array([bool(feature_set) for feature_set in features])
+    for band in range(bands):
+        keys = signatures[has_features, band * rows:(band + 1) * rows]
+        buckets = np.unique(keys, axis=0, return_inverse=True)[1].ravel()
+        members = np.flatnonzero(has_features)[np.argsort(buckets, kind='stable')]
+        bucket_sizes = np.bincount(buckets)
+        for bucket in np.split(members, np.cumsum(bucket_sizes)[:-1]):
+            # every pair of the bucket is a candidate, pairs already in the same cluster are skipped
+            for i, first in enumerate(bucket[:-1]):
+                for other in bucket[i + 1:]:
+                    if find(first) == find(other):
+                        continue
+                    n_candidates += 1
+                    common = len(features[first] & features[other])
+                    if common / (len(features[first]) + len(features[other]) - common) >= threshold:
+                        parent[find(other)] = find(first)
+
+    roots = pd.Series([find(i) for i in range(len(features))], index=df.index)
+    clustered = roots.duplicated(keep=False)
+    # the earliest data set of each cluster is the original
+    order = df.assign(_root=roots.to_numpy()).sort_values(['date', 'oai_identifier'], na_position='last')
+    originals = order[clustered.loc[order.index]].groupby('_root')['oai_identifier'].first()
+    result = pd.DataFrame(index=df.index)
+    result['duplicate_cluster'] = roots.map(originals).where(clustered, None)
+    result['duplicate'] = clustered & (result['duplicate_cluster'] != df['oai_identifier'])
+    log.info(f'Found {int(result["duplicate"].sum())} duplicates in {originals.size} clusters '
+             f'after {n_candidates} comparisons of {len(df)} data sets')
+    return result
+
+
+def publication_aggregates(df, date, path='./data/publication_aggregates.sqlite'):
+    """
+    Return the :class:`PublicationAggregates` of the harvest at `date`.
+    If the database holds the counts of another harvest, the publications of `df` are counted in memory.
+
+    :param df: Corpus of the harvest, see :func:`load_corpus`.
+    :param date: Date of the harvest (yyyymmdd).
+    :param path: ('./data/publication_aggregates.sqlite') database kept up to date by the harvest.
+    :return: PublicationAggregates
+    """
+    if os.path.exists(path):
+        aggregates = PublicationAggregates(path)
+        if aggregates.get_meta('harvest_date') == str(date):
+            return aggregates
+    aggregates = PublicationAggregates(':memory:')
+    aggregates.apply_frame(df)
+    return aggregates
+
+
+class _RecordIndex(abc.ABC):
+    """
+    Base of the indexes over the harvested records in a SQLite database (:class:`SearchIndex`, :class:`SpatialIndex`),
+    which are updated with the changed and deleted records of every harvest like :class:`PublicationAggregates`.
+
+    Every record has a row with its id in `TABLE`, which starts with the columns id, oai_identifier and source,
+    and optionally an entry with the same row id in the virtual table `ENTRIES`.
+    Subclasses give the remaining columns and the entry of a record with :meth:`_rows`.
+
+    :param path: Path to the SQLite database, ':memory:' for a temporary one.
+    """
+    # databases with another schema are rebuilt, the next harvest indexes all records again
+    SCHEMA_VERSION = None
+    # script creating TABLE and ENTRIES
+    SCHEMA = ''
+    TABLE = ''
+    ENTRIES = ''
+    ENTRY_COLUMNS = ()
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        if self.get_meta('schema_version') != self.SCHEMA_VERSION:
+            self._db.executescript(f'DROP TABLE IF EXISTS {self.TABLE}; DROP TABLE IF EXISTS {self.ENTRIES}; '
+                                   'DELETE FROM meta;')
+            self.set_meta('schema_version', self.SCHEMA_VERSION)
+        self._db.executescript(self.SCHEMA + 'CREATE TEMP TABLE changed (oai_identifier TEXT PRIMARY KEY);')
+
+    @abc.abstractmethod
+    def _rows(self, record):
+        """Return the columns of `record` in `TABLE` after its source and its entry in `ENTRIES` or None."""
+
+    def _apply_chunk(self, chunk, source, reset):
+        # the last entry of an identifier wins, like in a change log
+        datasets = {record['oai_identifier']: record for record in chunk}
+        datasets = [record for record in datasets.values() if not record.get('deleted')]
+        with self._lock, self._db:
+            db = self._db
+            db.execute('DELETE FROM temp.changed')
+            db.executemany('INSERT OR IGNORE INTO temp.changed VALUES (?)',
+                           [(record['oai_identifier'],) for record in chunk])
+            if reset:
+                db.execute(f'INSERT OR IGNORE INTO temp.changed SELECT oai_identifier FROM {self.TABLE} '
+                           'WHERE source IS ?', (source,))
+            db.execute(f'DELETE FROM {self.ENTRIES} WHERE rowid IN '
+                       f'(SELECT id FROM {self.TABLE} WHERE oai_identifier IN temp.changed)')
+            db.execute(f'DELETE FROM {self.TABLE} WHERE oai_identifier IN temp.changed')
+            first_id = db.execute(f'SELECT COALESCE(MAX(id), 0) + 1 FROM {self.TABLE}').fetchone()[0]
+            rows, entries = [], []
+            for i, record in enumerate(datasets, first_id):
+                columns, entry = self._rows(record)
+                rows.append((i, record['oai_identifier'], source, *columns))
+                if entry is not None:
+                    entries.append((i, *entry))
+            if rows:
+                db.executemany(f'INSERT INTO {self.TABLE} VALUES ({", ".join("?" * len(rows[0]))})', rows)
+            db.executemany(f'INSERT INTO {self.ENTRIES} ({", ".join(self.ENTRY_COLUMNS)}) '
+                           f'VALUES ({", ".join("?" * len(self.ENTRY_COLUMNS))})', entries)
+
+    def apply(self, records, source=None, reset=False, chunk_size=10000):
+        """
+        Update the index with harvested records, e.g. the change log of a harvest.
+
+        :param records: Iterable of record dictionaries and tombstones (see :func:`read_records`)
+                        or the rows of a corpus (``df.to_dict('records')``).
+        :param source: (None) name of the harvest the records come from, e.g. the harvest job.
+        :param reset: (False) remove all records of `source` first, for a full harvest.
+        :param chunk_size: (10000) number of records indexed in one transaction.
+        """
+        records = iter(records)
+        while chunk := list(itertools.islice(records, chunk_size)):
+            self._apply_chunk(chunk, source, reset)
+            reset = False
+        if reset:
+            self._apply_chunk([], source, reset=True)
+
+    def get_meta(self, key, default=None):
+        """Return a value stored with :meth:`set_meta`."""
+        row = self._db.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key, value):
+        """Store a value like the date of the last complete harvest."""
+        with self._lock, self._db:
+            self._db.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)', (key, str(value)))
+
+
+@functools.lru_cache
+def _load_record_index(cls, date, path, data_dir, columns=None):
+    # the index kept up to date by the harvest or the corpus of another harvest indexed in memory,
+    # each once per process
+    if os.path.exists(path):
+        index = cls(path)
+        if date is None or index.get_meta('harvest_date') == str(date):
+            return index
+    elif date is None:
+        raise FileNotFoundError(f'No index at {path}, run a harvest first.')
+    log.info(f'Indexing the corpus of {date} in memory')
+    df = load_corpus(date, list(columns) if columns else None, data_dir=data_dir)
+    index = cls(':memory:')
+    index.apply(df.to_dict('records'))
+    return index
+
+
+# Fields of the records in the full-text search index, see SearchIndex
+SEARCH_FIELDS = ('title', 'description', 'coverage', 'authors', 'keywords')
+# weights of the fields for ranking the matches (bm25), a match in the title counts most
+SEARCH_WEIGHTS = (10., 1., 2., 2., 5.)
+
+
+def _search_text(value, placeholder=None):
+    # all values of a (list valued) field as one text, without the default value of a missing field
+    if value is None or isinstance(value, float):
+        return ''
+    values = [value] if isinstance(value, str) else value
+    return '\n'.join(str(v) for v in values if v and v == v and v != placeholder)
+
+
+def _first_value(value):
+    # first value of a list valued field of a record, single values of a corpus frame are returned as they are
+    if value is None or isinstance(value, str):
+        return value
+    if not hasattr(value, '__len__'):
+        # dates of a corpus frame, NaT and NA are missing
+        return None if value is pd.NA or value != value else value.isoformat()
+    return str(value[0]) if len(value) else None
+
+
+def search_expression(text):
+    """
+    FTS5 query matching a free text: every word has to occur,
+    words joined by punctuation like 'Ny-Ålesund' or 'HALO-(AC)3' have to follow each other.
+
+    :param text: Free text, e.g. 'Ny-Ålesund radiosondes'.
+    :return: FTS5 query expression, e.g. '"Ny Ålesund" "radiosondes"'.
+    """
+    phrases = (' '.join(re.findall(r'\w+', word)) for word in text.split())
+    return ' '.join(f'"{phrase}"' for phrase in phrases if phrase)
+
+
+class SearchIndex(_RecordIndex):
+    """Full-text index (FTS5) over the title, description, coverage, authors and keywords of the records."""
+    SCHEMA_VERSION = '1'
+    SCHEMA = ('CREATE TABLE IF NOT EXISTS documents (id INTEGER PRIMARY KEY, oai_identifier TEXT UNIQUE, '
+              'source TEXT, doi TEXT, publisher TEXT, date TEXT);'
+              'CREATE INDEX IF NOT EXISTS documents_source ON documents (source);'
+              f'CREATE VIRTUAL TABLE IF NOT EXISTS search USING fts5({", ".join(SEARCH_FIELDS)}, '
+              "tokenize = 'porter unicode61 remove_diacritics 2');")
+    TABLE = 'documents'
+    # the row id of a record in the full-text table is its id in documents
+    ENTRIES = 'search'
+    ENTRY_COLUMNS = ('rowid', *SEARCH_FIELDS)
+
+    def __init__(self, path='./data/search_index.sqlite'):
+        super().__init__(path)
+
+    def _rows(self, record):
+        return ([_first_value(record.get(field)) for field in ('doi', 'publisher', 'date')],
+                [_search_text(record.get(field), f'No {field}') for field in SEARCH_FIELDS])
+
+    def search(self, query, publisher=None, limit=None, raw=False):
+        """
+        Data sets matching a query, the best matches first.
+        Words are matched without diacritics and by their English stem, e.g. 'Alesund radiosonde' finds
+        'Ny-Ålesund radiosondes'.
+
+        :param query: Words which all have to occur in the indexed fields, see :func:`search_expression`.
+        :param publisher: (None) only data sets of this repository, e.g. 'PANGAEA'.
+        :param limit: (None) maximum number of data sets.
+        :param raw: (False) `query` is an FTS5 query expression, e.g. 'title:dropsonde AND (HALO OR P5)'.
+        :return: List of dictionaries with the keys oai_identifier, doi, publisher, date and title.
+        """
+        expression = query if raw else search_expression(query)
+        if not expression:
+            return []
+        weights = ', '.join(map(str, SEARCH_WEIGHTS))
+        rows = self._db.execute(
+            'SELECT d.oai_identifier, d.doi, d.publisher, d.date, search.title FROM search '
+            'JOIN documents AS d ON d.id = search.rowid '
+            'WHERE search MATCH ? AND (? IS NULL OR d.publisher = ?) '
+            f'ORDER BY bm25(search, {weights}) LIMIT ?',
+            (expression, publisher, publisher, -1 if limit is None else limit))
+        columns = ('oai_identifier', 'doi', 'publisher', 'date', 'title')
+        return [dict(zip(columns, row)) for row in rows]
+
+    def matching_ids(self, query, publisher=None, raw=False):
+        """Return the OAI identifiers of all data sets matching a query (see :meth:`search`) as a set."""
+        return {result['oai_identifier'] for result in self.search(query, publisher=publisher, raw=raw)}
+
+
+def load_search_index(date=None, path='./data/search_index.sqlite', data_dir='./data'):
+    """
+    Return the :class:`SearchIndex` of the harvest at `date`.
+    If the index kept up to date by the harvest belongs to another harvest,
+    the corpus of `date` is indexed in memory.
+
+    :param date: (None) date of the harvest (yyyymmdd), None for the latest harvest.
+    :param path: ('./data/search_index.sqlite') index kept up to date by the harvest.
+    :param data_dir: ('./data') directory of the harvested files.
+    :return: SearchIndex
+    """
+    return _load_record_index(SearchIndex, date, path, data_dir)
+
+
+# Coordinates in the coverage of a record, e.g. 'MEDIAN LATITUDE: 78.92 * SOUTH-BOUND LATITUDE: 78.9 * ...' (PANGAEA),
+# 'name=Ny-Ålesund; north=78.92; east=11.93' (DCMI Point) or 'northlimit=79; southlimit=78; eastlimit=12; westlimit=11'
+# (DCMI Box), other values like 'DATE/TIME START: 2017-05-23' are skipped
+COVERAGE_PATTERN = re.compile(r'(?P<key>[a-z][a-z /-]*?)\s*[:=]\s*(?P<value>[-+]?\d+(?:\.\d+)?)(?![\d.])',
+                              re.IGNORECASE)
+# keys of the latitudes and longitudes of a location, all other keys ending with latitude or longitude are bounds
+LOCATION_KEYS = {'latitude', 'median latitude', 'lat', 'north', 'longitude', 'median longitude', 'lon', 'east'}
+# further keys of latitudes and longitudes besides the ones ending with latitude or longitude
+LATITUDE_KEYS = {'lat', 'north', 'south', 'northlimit', 'southlimit'}
+LONGITUDE_KEYS = {'lon', 'east', 'west', 'eastlimit', 'westlimit'}
+
+
+def parse_coverage(coverage):
+    """
+    Location and bounding box of a record from the coordinates in its coverage (see :data:`COVERAGE_PATTERN`).
+    The bounding box includes all coordinates of all coverage values, the location is the first given one
+    (e.g. the median of PANGAEA data sets) or the centre of the bounding box.
+    Coordinates out of range are skipped.
+
+    :param coverage: Coverage values of a record, e.g. ['LATITUDE: 78.9250 * LONGITUDE: 11.9300'].
+    :return: Tuple of the location (latitude, longitude) and the bounding box (south, west, north, east)
+             or None if the coverage has no latitude or no longitude.
+    """
+    if coverage is None or isinstance(coverage, float):
+        return None
+    latitudes, longitudes = [], []
+    location = {}
+    for value in [coverage] if isinstance(coverage, str) else coverage:
+        for match in COVERAGE_PATTERN.finditer(value or ''):
+            key, number = match.group('key').strip().lower(), float(match.group('value'))
+            if key.endswith('latitude') or key in LATITUDE_KEYS:
+                if -90 <= number <= 90:
+                    latitudes.append(number)
+                    if key in LOCATION_KEYS:
+                        location.setdefault('latitude', number)
+            elif key.endswith('longitude') or key in LONGITUDE_KEYS:
+                if -180 <= number <= 180:
+                    longitudes.append(number)
+                    if key in LOCATION_KEYS:
+                        location.setdefault('longitude', number)
+    if not latitudes or not longitudes:
+        return None
+    south, west, north, east = min(latitudes), min(longitudes), max(latitudes), max(longitudes)
+    return ((location.get('latitude', (south + north) / 2), location.get('longitude', (west + east) / 2)),
+            (south, west, north, east))
+
+
+class SpatialIndex(_RecordIndex):
+    """R*Tree of the locations and bounding boxes in the coverage of the records, see :func:`parse_coverage`."""
+    SCHEMA_VERSION = '2'
+    SCHEMA = ('CREATE TABLE IF NOT EXISTS locations (id INTEGER PRIMARY KEY, oai_identifier TEXT UNIQUE, '
+              'source TEXT, doi TEXT, publisher TEXT, latitude REAL, longitude REAL);'
+              'CREATE INDEX IF NOT EXISTS locations_source ON locations (source);'
+              'CREATE VIRTUAL TABLE IF NOT EXISTS boxes USING rtree(id, south, north, west, east);'
+              'CREATE TEMP TABLE selected (oai_identifier TEXT PRIMARY KEY);')
+    TABLE = 'locations'
+    # the id of the bounding box of a record is its id in locations, records without coordinates have none
+    ENTRIES = 'boxes'
+    ENTRY_COLUMNS = ('id', 'south', 'north', 'west', 'east')
+
+    def __init__(self, path='./data/spatial_index.sqlite'):
+        super().__init__(path)
+
+    def _rows(self, record):
+        columns = [_first_value(record.get(field)) for field in ('doi', 'publisher')]
+        parsed = parse_coverage(record.get('coverage'))
+        if parsed is None:
+            return [*columns, None, None], None
+        (latitude, longitude), (south, west, north, east) = parsed
+        return [*columns, latitude, longitude], (south, north, west, east)
+
+    def within(self, south, west, north, east, contained=False, publisher=None):
+        """
+        Data sets whose bounding box overlaps (or lies within) a bounding box.
+        Boxes across the antimeridian (`west` > `east`) are not supported.
+
+        :param south: Southern latitude of the box.
+        :param west: Western longitude of the box.
+        :param north: Northern latitude of the box.
+        :param east: Eastern longitude of the box.
+        :param contained: (False) only data sets whose bounding box lies completely within the box.
+        :param publisher: (None) only data sets of this repository, e.g. 'PANGAEA'.
+        :return: List of dictionaries with the keys oai_identifier, doi, publisher, latitude and longitude.
+        """
+        condition = ('b.south >= ? AND b.north <= ? AND b.west >= ? AND b.east <= ?' if contained else
+                     'b.north >= ? AND b.south <= ? AND b.east >= ? AND b.west <= ?')
+        rows = self._db.execute(
+            'SELECT l.oai_identifier, l.doi, l.publisher, l.latitude, l.longitude FROM boxes AS b '
+            f'JOIN locations AS l ON l.id = b.id WHERE {condition} AND (? IS NULL OR l.publisher = ?) '
+            'ORDER BY l.id',
+            (south, north, west, east, publisher, publisher))
+        columns = ('oai_identifier', 'doi', 'publisher', 'latitude', 'longitude')
+        return [dict(zip(columns, row)) for row in rows]
+
+    def matching_ids(self, south, west, north, east, contained=False, publisher=None):
+        """Return the OAI identifiers of all data sets in a bounding box (see :meth:`within`) as a set."""
+        return {result['oai_identifier'] for result in self.within(south, west, north, east, contained, publisher)}
+
+    def density(self, resolution=1., identifiers=None):
+        """
+        Number of data sets per grid cell of their location, counted in SQL.
+
+        :param resolution: (1.) size of the grid cells in degrees.
+        :param identifiers: (None) only count the data sets with these OAI identifiers, e.g. the latest versions.
+        :return: Dictionary with the lists latitudes and longitudes (south-western corner of every cell with data
+                 sets) and counts and the resolution.
+        """
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM temp.selected')
+            if identifiers is not None:
+                self._db.executemany('INSERT OR IGNORE INTO temp.selected VALUES (?)',
+                                     ((identifier,) for identifier in identifiers))
+            rows = self._db.execute(
+                # the coordinates are shifted to positive values, so casting to an integer rounds down
+                'SELECT CAST((latitude + 90) / ? AS INTEGER) AS i, '
+                'CAST((longitude + 180) / ? AS INTEGER) AS j, COUNT(*) FROM locations '
+                'WHERE latitude IS NOT NULL AND (? OR oai_identifier IN temp.selected) GROUP BY i, j ORDER BY i, j',
+                (resolution, resolution, identifiers is None)).fetchall()
+        return dict(latitudes=[i * resolution - 90 for i, _, _ in rows],
+                    longitudes=[j * resolution - 180 for _, j, _ in rows],
+                    counts=[count for _, _, count in rows], resolution=resolution)
+
+
+def load_spatial_index(date=None, path='./data/spatial_index.sqlite', data_dir='./data'):
+    """
+    Return the :class:`SpatialIndex` of the harvest at `date`.
+    If the index kept up to date by the harvest belongs to another harvest,
+    the corpus of `date` is indexed in memory.
+
+    :param date: (None) date of the harvest (yyyymmdd), None for the latest harvest.
+    :param path: ('./data/spatial_index.sqlite') index kept up to date by the harvest.
+    :param data_dir: ('./data') directory of the harvested files.
+    :return: SpatialIndex
+    """
+    return _load_record_index(SpatialIndex, date, path, data_dir,
+                              columns=('oai_identifier', 'doi', 'publisher', 'coverage'))
 
 
 def extract_single_value(x):
@@ -128,3 +2457,182 @@ def extract_single_value(x):
     return x
 
 
+# Same tokenisation as WordCloud.process_text with the default settings
+WORD_PATTERN = re.compile(r"\w[\w']*")
+# Substitutions applied to the titles before counting words for the word cloud
+TITLE_SUBSTITUTIONS = {
+    'Ny-Ålesund': 'NyÅlesund',
+    'Ny-Alesund': 'NyÅlesund',
+    'in situ': 'InSitu',
+    'in-situ': 'InSitu',
+    'measurements': 'measurement',
+}
+
+
+def _fuse_cases(counts, normalize_plurals=True):
+    # Count based version of wordcloud.tokenization.process_tokens:
+    # represent each word by its most common case and merge simple plurals into the singular
+    cases = defaultdict(dict)
+    for word, count in counts.items():
+        case_counts = cases[word.lower()]
+        case_counts[word] = case_counts.get(word, 0) + count
+    merged_plurals = {}
+    if normalize_plurals:
+        for key in list(cases):
+            if key.endswith('s') and not key.endswith('ss') and key[:-1] in cases:
+                singular_counts = cases[key[:-1]]
+                for word, count in cases.pop(key).items():
+                    singular_counts[word[:-1]] = singular_counts.get(word[:-1], 0) + count
+                merged_plurals[key] = key[:-1]
+    fused, standard_forms = {}, {}
+    for word_lower, case_counts in cases.items():
+        first = max(case_counts.items(), key=lambda item: item[1])[0]
+        fused[first] = sum(case_counts.values())
+        standard_forms[word_lower] = first
+    for plural, singular in merged_plurals.items():
+        standard_forms[plural] = standard_forms[singular]
+    return fused, standard_forms
+
+
+class TitleWordCounter:
+    """
+    Word frequencies of data set titles for `WordCloud.generate_from_frequencies`.
+
+    Every title is cleaned with one compiled substitution table and tokenised once like `WordCloud.process_text`.
+    The counts of words and of bigrams without stopwords are additive,
+    so they can be saved and updated with the titles of new records only (see :meth:`sync`).
+    :meth:`frequencies` detects collocations from the counts like WordCloud does for a text.
+
+    :param stopwords: Words to ignore (case insensitive).
+    :param substitutions: (:data:`TITLE_SUBSTITUTIONS`) dictionary of substrings to replace in the titles.
+    """
+
+    def __init__(self, stopwords=(), substitutions=None):
+        self.stopwords = sorted({word.lower() for word in stopwords})
+        self.substitutions = dict(TITLE_SUBSTITUTIONS if substitutions is None else substitutions)
+        self._stopwords = set(self.stopwords)
+        # longer keys first, so e.g. 'Ny-Ålesund' is not replaced partially by a shorter key
+        keys = sorted(self.substitutions, key=len, reverse=True)
+        self._substitute = re.compile('|'.join(map(re.escape, keys))) if keys else None
+        self.unigrams = Counter()
+        self.bigrams = Counter()
+        self.titles = {}
+
+    def tokenise(self, title):
+        """Return the words of a title after the substitutions, without possessive 's and numbers."""
+        if self._substitute:
+            title = self._substitute.sub(lambda m: self.substitutions[m.group(0)], title)
+        words = (word[:-2] if word.lower().endswith("'s") else word for word in WORD_PATTERN.findall(title))
+        return [word for word in words if not word.isdigit()]
+
+    def _count(self, title, sign):
+        words = self.tokenise(title or '')
+        for word in words:
+            if word.lower() not in self._stopwords:
+                self.unigrams[word] += sign
+        for word1, word2 in zip(words, words[1:]):
+            if word1.lower() not in self._stopwords and word2.lower() not in self._stopwords:
+                self.bigrams[f'{word1} {word2}'] += sign
+
+    def sync(self, titles):
+        """
+        Update the counts to the given titles.
+        Only titles with a new key or a changed text are tokenised, titles whose key is gone are subtracted.
+
+        :param titles: Dictionary of key (e.g. DOI) and title.
+        :return: Number of added and removed titles.
+        """
+        removed = [key for key, title in self.titles.items() if titles.get(key) != title]
+        for key in removed:
+            self._count(self.titles.pop(key), -1)
+        added = [key for key in titles if key not in self.titles]
+        for key in added:
+            self.titles[key] = titles[key]
+            self._count(titles[key], 1)
+        # drop words which are not used anymore
+        self.unigrams = +self.unigrams
+        self.bigrams = +self.bigrams
+        return len(added), len(removed)
+
+    def frequencies(self, collocation_threshold=30, normalize_plurals=True):
+        """
+        Word frequencies including bigrams which are collocations, like `WordCloud.process_text` with
+        `collocations=True`.
+
+        :param collocation_threshold: (30) minimum Dunning likelihood score of a bigram to count as collocation.
+        :param normalize_plurals: (True) merge words ending in 's' into the singular.
+        :return: Dictionary of word and count.
+        """
+        from wordcloud.tokenization import score
+
+        n_words = sum(self.unigrams.values())
+        counts, standard_forms = _fuse_cases(self.unigrams, normalize_plurals)
+        counts_bigrams, _ = _fuse_cases(self.bigrams, normalize_plurals)
+        original_counts = counts.copy()
+        for bigram, count in counts_bigrams.items():
+            word1, word2 = (standard_forms[word.lower()] for word in bigram.split(' '))
+            if score(count, original_counts[word1], original_counts[word2], n_words) > collocation_threshold:
+                counts[word1] -= count
+                counts[word2] -= count
+                counts[bigram] = count
+        return {word: count for word, count in counts.items() if count > 0}
+
+    def save(self, path):
+        """Save the counts together with the stopwords and substitutions they were made with."""
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(dict(stopwords=self.stopwords, substitutions=self.substitutions, titles=self.titles,
+                           unigrams=self.unigrams, bigrams=self.bigrams), file, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path, stopwords=(), substitutions=None):
+        """
+        Load counts saved with :meth:`save`.
+        If the file does not exist or was made with other stopwords or substitutions, an empty counter is returned.
+        """
+        counter = cls(stopwords, substitutions)
+        if not os.path.exists(path):
+            return counter
+        with open(path, 'r', encoding='utf-8') as file:
+            saved = json.load(file)
+        if saved['stopwords'] != counter.stopwords or saved['substitutions'] != counter.substitutions:
+            log.info(f'Stopwords or substitutions changed, counting all titles again instead of using {path}')
+            return counter
+        counter.titles = saved['titles']
+        counter.unigrams = Counter(saved['unigrams'])
+        counter.bigrams = Counter(saved['bigrams'])
+        return counter
+
+
+@functools.lru_cache(maxsize=16)
+def word_cloud_mask(shape='ellipse', width=640, height=480, path=None, threshold=250):
+    """
+    Mask for `WordCloud(mask=...)`, words are only placed on the pixels which are not 255 (white).
+    The mask is rasterised directly into an array and memoised by its parameters,
+    so the returned array is read only.
+
+    :param shape: ('ellipse') 'ellipse', 'rectangle' or 'image'.
+    :param width: (640) width in pixels, the ellipse and rectangle fill the whole width.
+    :param height: (480) height in pixels.
+    :param path: Image file for shape='image', it is resized to width and height if both are given.
+    :param threshold: (250) gray values of the image above this are outside the mask.
+    :return: 2D uint8 array with 0 inside and 255 outside of the shape.
+    """
+    if shape == 'ellipse':
+        y, x = np.ogrid[:height, :width]
+        # distance of the pixel centres from the centre of the ellipse relative to the semi-axes
+        inside = (((x + 0.5) / width * 2 - 1) ** 2 + ((y + 0.5) / height * 2 - 1) ** 2) <= 1
+    elif shape == 'rectangle':
+        inside = np.ones((height, width), dtype=bool)
+    elif shape == 'image':
+        from PIL import Image
+
+        with Image.open(path) as image:
+            image = image.convert('L')
+            if width and height:
+                image = image.resize((width, height))
+            inside = np.asarray(image) <= threshold
+    else:
+        raise ValueError(f'Unknown mask shape {shape!r}')
+    mask = np.where(inside, 0, 255).astype(np.uint8)
+    mask.setflags(write=False)
+    return mask
@@ -3,25 +3,102 @@
 | *author*: Johannes Röttenbacher
 | *created*: 10.12.2024
 
-Retrieve metadata from repositories and write them to a JSON file for each repository.
+Retrieve metadata from repositories and write them to a records file for each repository.
+The harvest jobs (provider, set, metadata prefix) are read from a TOML config file (default: ``harvest.toml``)
+and run concurrently with a limited number of concurrent requests per provider.
+By default only records changed since the last harvest are retrieved and merged into the last output file.
+Run with ``--full`` to harvest the complete sets again.
+Also run by ``python cli.py harvest``.
 """
+import argparse
 import functions as fn
+import json
 import logging
+import os
+import sys
 import time
+import tomllib
 
-# Set up logging
-logging.basicConfig(level=logging.INFO,
-                    format='%(message)s')
-console = logging.StreamHandler()
-console.setLevel(logging.INFO)
-logging.getLogger(__name__).addHandler(console)
-
-date = time.strftime("%Y%m%d", time.localtime())
-
-oai_urls = ['https://zenodo.org/oai2d', 'https://ws.pangaea.de/oai/provider']
-set_names = ['user-crc172-ac3', 'query~cHJvamVjdDpsYWJlbDpBQzM']
-output_dir = './data'
-output_files = [f'{output_dir}/{date}-datasets_ac3_zenodo.json',
-                f'{output_dir}/{date}-datasets_ac3_pangaea.json']
-for oai_url, set_name, output_file in zip(oai_urls, set_names, output_files):
-    fn.get_metadata_from_repository(oai_url, set_name, output_file)
\ No newline at end of file
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description="Harvest metadata from Zenodo and PANGAEA for the (AC)³ community"
+    )
+    parser.add_argument("--config", default="harvest.toml",
+                        help="TOML file with the harvest jobs.")
+    parser.add_argument("--full", action="store_true",
+                        help="Ignore the harvest state and harvest the complete sets again.")
+    return parser.parse_args()
+
+
+def main(config_file='harvest.toml', full=False):
+    """
+    Run the harvest jobs of a config file and update the corpus, the publication aggregates and the indexes.
+
+    :param config_file: ('harvest.toml') TOML file with the harvest jobs.
+    :param full: (False) ignore the harvest state and harvest the complete sets again.
+    :return: True if all harvest jobs finished.
+    """
+    with open(config_file, 'rb') as f:
+        config = tomllib.load(f)
+
+    date = time.strftime("%Y%m%d", time.localtime())
+
+    output_dir = config.get('output_dir', './data')
+    state_file = config.get('state_file', f'{output_dir}/harvest_state.json')
+    aggregates_file = f'{output_dir}/publication_aggregates.sqlite'
+    search_index_file = f'{output_dir}/search_index.sqlite'
+    spatial_index_file = f'{output_dir}/spatial_index.sqlite'
+    if full:
+        for file in (state_file, aggregates_file, search_index_file, spatial_index_file):
+            if os.path.exists(file):
+                os.remove(file)
+
+    # Publications per year, publisher and type for the plots, updated with the changes of every harvest
+    aggregates = fn.PublicationAggregates(aggregates_file)
+    # Full-text index of the records for `python cli.py search`, also updated with the changes of every harvest
+    search_index = fn.SearchIndex(search_index_file)
+    # Locations and bounding boxes parsed from the coverage of the records for bounding box queries and density maps
+    spatial_index = fn.SpatialIndex(spatial_index_file)
+
+    jobs = [config.get('defaults', {}) | job for job in config['jobs']]
+    with fn.metrics.stage('harvest_jobs'):
+        reports = fn.run_harvest_jobs(jobs, output_dir, date, state_file=state_file,
+                                      host_limits=config.get('host_limits'),
+                                      default_host_limit=config.get('default_host_limit', 2),
+                                      max_jobs=config.get('max_jobs', 8),
+                                      aggregates=aggregates, search_index=search_index,
+                                      spatial_index=spatial_index)
+    with open(f'{output_dir}/{date}-harvest_report.json', 'w', encoding='utf-8') as f:
+        json.dump(reports, f, indent=4)
+
+    if any(report['status'] == 'failed' for report in reports):
+        logging.error('Not all harvest jobs finished, the corpus is not updated.')
+        return False
+
+    # Normalised corpus of all repositories for the plotting scripts
+    fn.write_corpus(f'{output_dir}/{date}-corpus_{config.get("corpus", "ac3")}.parquet',
+                    [report['output_file'] for report in reports])
+    # the counts and the indexes are complete for this date
+    for store in (aggregates, search_index, spatial_index):
+        store.set_meta('harvest_date', date)
+    return True
+
+
+if __name__ == '__main__':
+    # Set up logging
+    logging.basicConfig(level=logging.INFO,
+                        format='%(message)s')
+    console = logging.StreamHandler()
+    console.setLevel(logging.INFO)
+    logging.getLogger(__name__).addHandler(console)
+
+    # Serve repeated requests within a day from ./data/http_cache.sqlite
+    fn.enable_http_cache()
+
+    args = get_args()
+    ok = main(args.config, args.full)
+    # timings, requests and counters of this run
+    fn.metrics.write_report(f'./data/{time.strftime("%Y%m%d", time.localtime())}-run_report_harvest.json',
+                            command='harvest', args=vars(args))
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,400 @@
+#!/usr/bin/env python
+"""
+| *author*: Johannes Röttenbacher
+| *created*: 17.10.2026
+
+Render functions for the figures of the plot scripts and a pipeline to render them in parallel.
+
+Each render function takes the aggregated numbers it shows, the style and the dpi and saves one figure.
+:func:`render_figures` runs a list of such jobs in a process pool with the non-interactive Agg backend
+and skips every job whose inputs did not change since the figure was rendered last.
+"""
+import colorsys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import functools
+import hashlib
+import inspect
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import sys
+import time
+import functions as fn
+import matplotlib
+
+# render without a display, figures are only saved to file
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import matplotlib.ticker as ticker
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+cm = 1 / 2.54
+FMT_DICT = dict(presentation=
+                dict(figsize=(15 * cm, 7.5 * cm),
+                     lw=2,
+                     fontsize=12,
+                     legendfontsize=10),
+                poster=
+                dict(figsize=(40 * cm, 15 * cm),
+                     lw=6,
+                     fontsize=40,
+                     legendfontsize=24
+                     ),
+                square=
+                dict(figsize=(15 * cm, 15 * cm),
+                     lw=2,
+                     fontsize=12,
+                     legendfontsize=10),
+                )
+USAGE_LABELS = ['Metadata Views', 'Data Views', 'Downloads']
+
+
+def render_wordcloud(output, frequencies, mask, wordcloud_kwargs, dpi=300):
+    """
+    Generate a word cloud from word frequencies and save it.
+
+    :param output: Figure file.
+    :param frequencies: Dictionary of word and count, e.g. from :meth:`functions.TitleWordCounter.frequencies`.
+    :param mask: Dictionary of keyword arguments for :func:`functions.word_cloud_mask`.
+    :param wordcloud_kwargs: Keyword arguments for `WordCloud`.
+    :param dpi: (300) resolution of the figure.
+    """
+    from wordcloud import WordCloud
+
+    wordcloud = WordCloud(mask=fn.word_cloud_mask(**mask), **wordcloud_kwargs)
+    wordcloud = wordcloud.generate_from_frequencies(frequencies)
+    fig, ax = plt.subplots(1)
+    ax.imshow(wordcloud, interpolation='bilinear')
+    ax.axis('off')
+    fig.savefig(output, dpi=dpi, transparent=False)
+    plt.close(fig)
+
+
+def yearly_publication_arrays(yearly_publications):
+    """
+    Aggregate arrays of the yearly publications for :func:`render_yearly_publications` and
+    :func:`render_yearly_publications_per_repo`.
+
+    :param yearly_publications: Data frame with the columns year, publisher, count, cumulative_count and
+                                cumulative_count_<publisher>, see
+                                :meth:`functions.PublicationAggregates.yearly_publications`.
+    :return: Dictionary with the lists years, publishers (in order of appearance), counts (per publisher and year),
+             cumulative (all publishers per year) and cumulative_per_publisher (per publisher and year).
+    """
+    publishers = list(yearly_publications['publisher'].unique())
+    years = sorted(yearly_publications['year'].unique().tolist())
+    by_year = yearly_publications.groupby(['publisher', 'year'])
+    counts = by_year['count'].sum().unstack('year').reindex(index=publishers, columns=years).fillna(0)
+    # the running total of all publishers at the end of each year, including the years before the first one shown
+    cumulative = yearly_publications.groupby('year')['cumulative_count'].max().reindex(years)
+    cumulative_per_publisher = [
+        yearly_publications[yearly_publications['publisher'] == publisher]
+        .groupby('year')[f'cumulative_count_{publisher.lower()}'].first().reindex(years).fillna(0).tolist()
+        for publisher in publishers]
+    return dict(years=years, publishers=publishers, counts=counts.astype(int).values.tolist(),
+                cumulative=cumulative.tolist(), cumulative_per_publisher=cumulative_per_publisher)
+
+
+def _desaturate(color, saturation=0.75):
+    # the muted bar colors of the former seaborn figures
+    hue, lightness, old_saturation = colorsys.rgb_to_hls(*matplotlib.colors.to_rgb(color))
+    return colorsys.hls_to_rgb(hue, lightness, old_saturation * saturation)
+
+
+def _bars_with_cumulative_line(ax, counts, cumulative, labels, fmt, colors=None, alpha=1., line_label=None):
+    # bars of the yearly counts (dodged for more than one series) and a line with markers of the cumulative counts
+    counts = np.atleast_2d(counts)
+    n_series, n_years = counts.shape
+    colors = colors or plt.rcParams['axes.prop_cycle'].by_key()['color']
+    x = np.arange(n_years)
+    width = 0.8 / n_series
+    for i, (series, label) in enumerate(zip(counts, labels)):
+        ax.bar(x + (i - (n_series - 1) / 2) * width, series, width=width, label=label, alpha=alpha,
+               color=_desaturate(colors[i % len(colors)]))
+    ax.plot(x, cumulative, marker='o', color='orange', lw=fmt['lw'], label=line_label)
+    ax.set_xlim(-0.5, n_years - 0.5)
+    # labels of the cumulative sum of the shown years
+    return x, np.cumsum(counts.sum(axis=0))
+
+
+def render_yearly_publications(output, years, publishers, counts, cumulative, fmt, dpi=300):
+    """
+    Bar chart of the yearly publications per repository with the cumulative publications of all repositories.
+
+    :param output: Figure file.
+    :param years: Years of the bars.
+    :param publishers: Names of the repositories.
+    :param counts: Publications per repository and year.
+    :param cumulative: Cumulative publications of all repositories per year.
+    :param fmt: Style from :data:`FMT_DICT`.
+    :param dpi: (300) resolution of the figure.
+    """
+    with plt.rc_context({'font.size': fmt['fontsize']}):
+        fig, ax = plt.subplots(1, figsize=fmt['figsize'], layout='constrained')
+        x, cumsum = _bars_with_cumulative_line(ax, counts, cumulative, publishers, fmt,
+                                               line_label='Cumulative\npublications')
+        for x_pos, y in zip(x, cumsum):
+            ax.text(x_pos, y + 0.2, str(int(y)), ha='right', fontsize=fmt['legendfontsize'])
+
+        # Add labels and title
+        ax.set(xlabel='Year', ylabel='Count', xticks=x, xticklabels=[str(year) for year in years])
+        # bars first, then the cumulative line
+        ax.legend(handles=[*ax.containers, *ax.lines], fontsize=fmt['legendfontsize'])
+        ax.tick_params(axis='x', rotation=45)  # Rotates the x-axis tick labels by 45 degrees
+        ax.yaxis.set_major_locator(plt.MultipleLocator(base=500))
+        fig.savefig(output, dpi=dpi)
+        plt.close(fig)
+
+
+def render_yearly_publications_per_repo(output, years, publishers, counts, cumulative_per_publisher, fmt, dpi=300):
+    """
+    Bar charts of the yearly publications with the cumulative publications, one row per repository.
+
+    :param output: Figure file.
+    :param years: Years of the bars.
+    :param publishers: Names of the repositories.
+    :param counts: Publications per repository and year.
+    :param cumulative_per_publisher: Cumulative publications per repository and year.
+    :param fmt: Style from :data:`FMT_DICT`.
+    :param dpi: (300) resolution of the figure.
+    """
+    with plt.rc_context({'font.size': fmt['fontsize']}):
+        # one row per publisher
+        fig, axes = plt.subplots(len(publishers), 1, figsize=fmt['figsize'], squeeze=False, layout='constrained')
+        axes = axes[:, 0]
+        for ax, publisher, series, cumulative in zip(axes, publishers, counts, cumulative_per_publisher):
+            x, cumsum = _bars_with_cumulative_line(ax, series, cumulative, [None], fmt, colors=['steelblue'],
+                                                   alpha=0.8, line_label='Cumulative publications')
+            # Annotate cumulative values
+            for x_pos, y in zip(x, cumsum):
+                ax.text(x_pos, y + 0.2, str(int(y)), ha='center', fontsize=fmt['legendfontsize'])
+            ax.set(xlabel='Year', ylabel='Count', title=publisher, xticks=x, xticklabels=[str(year) for year in years])
+            # a few round ticks, whether the repository has tens or thousands of publications
+            ax.yaxis.set_major_locator(ticker.MaxNLocator(nbins=5, steps=[1, 2, 5, 10], integer=True))
+
+        # Adjust legend (only one needed)
+        handles, labels = axes[0].get_legend_handles_labels()
+        fig.legend(handles, labels, loc='upper left',
+                   bbox_to_anchor=(0.15, 0.9),
+                   fontsize=fmt['legendfontsize'])
+        # the years are only labelled below the last row
+        for ax in axes[:-1]:
+            ax.set(xlabel='', xticklabels=[])
+        axes[-1].tick_params(axis='x', rotation=45)
+
+        fig.savefig(output, dpi=dpi, bbox_inches='tight')
+        plt.close(fig)
+
+
+def render_usage_pie(output, sums, title, fmt, dpi=300):
+    """
+    Pie chart of the summed metadata views, data views and downloads.
+
+    :param output: Figure file.
+    :param sums: Sums of the metadata views, data views and downloads.
+    :param title: Title of the chart.
+    :param fmt: Style from :data:`FMT_DICT`.
+    :param dpi: (300) resolution of the figure.
+    """
+    sums = list(sums)
+    with plt.rc_context({'font.size': fmt['fontsize']}):
+        fig, ax = plt.subplots(1, figsize=fmt['figsize'])
+        ax.pie(sums,
+               labels=USAGE_LABELS,
+               labeldistance=0.6,
+               pctdistance=0.5,
+               autopct=lambda p: f'{int(p * sum(sums) / 100):,}',
+               startangle=140
+               )
+        ax.set_title(title)
+        fig.savefig(output, dpi=dpi)
+        plt.close(fig)
+
+
+def render_usage_bar(output, sums, title, fmt, dpi=300):
+    """
+    Bar chart of the summed metadata views, data views and downloads.
+
+    :param output: Figure file.
+    :param sums: Sums of the metadata views, data views and downloads.
+    :param title: Title of the chart.
+    :param fmt: Style from :data:`FMT_DICT`.
+    :param dpi: (300) resolution of the figure.
+    """
+    with plt.rc_context({'font.size': fmt['fontsize']}):
+        fig, ax = plt.subplots(1, figsize=fmt['figsize'], layout='constrained')
+        bars = ax.bar(USAGE_LABELS, list(sums), color=['tab:blue', 'tab:orange', 'tab:green'])
+        ax.set_ylabel('Count')
+        ax.yaxis.set_major_formatter(ticker.FuncFormatter(lambda x, p: format(int(x), ',')))
+        for bar in bars:
+            yval = bar.get_height()
+            ax.text(bar.get_x() + bar.get_width() / 2, yval, f'{int(yval):,}', ha='center', va='bottom')
+        ax.set_title(title)
+        fig.savefig(output, dpi=dpi)
+        plt.close(fig)
+
+
+def render_usage_trend(output, totals, fmt, dpi=300):
+    """
+    Line charts of the summed metadata views, data views and downloads per repository over all snapshots.
+
+    :param output: Figure file.
+    :param totals: Data frame from :meth:`functions.UsageStore.repository_totals`.
+    :param fmt: Style from :data:`FMT_DICT`.
+    :param dpi: (300) resolution of the figure.
+    """
+    columns = ['metadata_views', 'data_views', 'downloads']
+    with plt.rc_context({'font.size': fmt['fontsize']}):
+        fig, axes = plt.subplots(len(columns), 1, figsize=(fmt['figsize'][0], 2 * fmt['figsize'][1]),
+                                 sharex=True, layout='constrained')
+        dates = np.asarray(totals['snapshot_date'], dtype='datetime64[D]')
+        for publisher in totals['publisher'].unique():
+            selection = (totals['publisher'] == publisher).to_numpy()
+            for ax, column in zip(axes, columns):
+                ax.plot(dates[selection], totals.loc[selection, column], marker='o', lw=fmt['lw'], label=publisher)
+        for ax, label in zip(axes, USAGE_LABELS):
+            ax.set_ylabel(label)
+            ax.yaxis.set_major_formatter(ticker.FuncFormatter(lambda x, p: format(int(x), ',')))
+        axes[0].legend(fontsize=fmt['legendfontsize'])
+        axes[-1].tick_params(axis='x', rotation=45)
+        fig.savefig(output, dpi=dpi)
+        plt.close(fig)
+
+
+def render_density_map(output, latitudes, longitudes, counts, resolution, fmt, dpi=300):
+    """
+    Map of the number of data sets per grid cell of their location over the extent of all cells,
+    with the longitudes scaled to the mean latitude.
+
+    :param output: Figure file.
+    :param latitudes: Southern latitude of every cell with data sets.
+    :param longitudes: Western longitude of every cell with data sets.
+    :param counts: Number of data sets of every cell.
+    :param resolution: Size of the cells in degrees.
+    :param fmt: Style from :data:`FMT_DICT`.
+    :param dpi: (300) resolution of the figure.
+    """
+    latitudes, longitudes = np.asarray(latitudes, dtype=float), np.asarray(longitudes, dtype=float)
+    # the cells are filled into a grid at once, empty cells are not drawn
+    rows = np.rint((latitudes - latitudes.min()) / resolution).astype(int)
+    columns = np.rint((longitudes - longitudes.min()) / resolution).astype(int)
+    grid = np.zeros((rows.max() + 1, columns.max() + 1))
+    grid[rows, columns] = counts
+    latitude_edges = latitudes.min() + resolution * np.arange(grid.shape[0] + 1)
+    longitude_edges = longitudes.min() + resolution * np.arange(grid.shape[1] + 1)
+    with plt.rc_context({'font.size': fmt['fontsize']}):
+        fig, ax = plt.subplots(1, figsize=fmt['figsize'], layout='constrained')
+        mesh = ax.pcolormesh(longitude_edges, latitude_edges, np.ma.masked_equal(grid, 0), cmap='viridis',
+                             norm=matplotlib.colors.LogNorm(vmin=1, vmax=max(grid.max(), 1)))
+        ax.set_aspect(1 / np.cos(np.deg2rad(latitude_edges.mean())))
+        ax.grid(ls=':', lw=0.5)
+        ax.set(xlabel='Longitude (°E)', ylabel='Latitude (°N)')
+        colorbar = fig.colorbar(mesh, ax=ax, label='Data sets')
+        colorbar.ax.yaxis.set_major_locator(ticker.LogLocator(subs=(1, 2, 5)))
+        colorbar.ax.yaxis.set_major_formatter(ticker.FuncFormatter(lambda x, p: format(int(x), ',')))
+        colorbar.ax.yaxis.set_minor_formatter(ticker.NullFormatter())
+        fig.savefig(output, dpi=dpi)
+        plt.close(fig)
+
+
+def _jsonable(obj):
+    # canonical representation of the render inputs for hashing
+    if hasattr(obj, 'to_json'):
+        return json.loads(obj.to_json(orient='split', date_format='iso'))
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    return str(obj)
+
+
+@functools.lru_cache
+def _module_source(module_name):
+    return inspect.getsource(sys.modules[module_name])
+
+
+def render_key(func, kwargs):
+    """
+    Hash of a render job: the source code of the module of the render function and all its inputs
+    (data, style, dpi, ...).
+    The whole module is hashed, as the render functions share helpers like :func:`_bars_with_cumulative_line`.
+
+    :param func: Render function.
+    :param kwargs: Keyword arguments of the render function without the output file.
+    :return: Hex digest.
+    """
+    payload = json.dumps([func.__name__, _module_source(func.__module__), kwargs], sort_keys=True,
+                         default=_jsonable)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _render(func, output, kwargs):
+    start = time.perf_counter()
+    func(output, **kwargs)
+    return output, time.perf_counter() - start
+
+
+@fn.metrics.stage('render_figures')
+def render_figures(jobs, max_workers=None, manifest_file='./figures/render_manifest.json'):
+    """
+    Render figures in a process pool and skip the ones which are up to date.
+
+    The hash of every rendered figure is kept in the manifest file.
+    A figure is up to date if it exists and its hash did not change.
+    If only the file name changed (e.g. the date in it), an existing figure with the same hash is copied.
+
+    :param jobs: List of dictionaries with func (render function), output (figure file) and kwargs (inputs).
+    :param max_workers: Number of processes, defaults to the number of CPUs.
+    :param manifest_file: ('./figures/render_manifest.json') JSON file with the hash of each figure.
+    :return: Dictionary with the lists of rendered, copied and skipped figures.
+             The render time of each function is added to the run :data:`functions.metrics` (`render.<function>`).
+    """
+    manifest = {}
+    if os.path.exists(manifest_file):
+        with open(manifest_file, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    rendered_by_key = {key: output for output, key in manifest.items() if os.path.exists(output)}
+
+    report = dict(rendered=[], copied=[], skipped=[])
+    pending = {}
+    for job in jobs:
+        output = job['output']
+        key = render_key(job['func'], job['kwargs'])
+        if manifest.get(output) == key and os.path.exists(output):
+            report['skipped'].append(output)
+        elif key in rendered_by_key:
+            shutil.copyfile(rendered_by_key[key], output)
+            manifest[output] = key
+            report['copied'].append(output)
+        else:
+            pending[output] = (job, key)
+
+    try:
+        if pending:
+            # forkserver starts the workers from a clean process, fork would copy the threads of the caller
+            method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else None
+            executor = ProcessPoolExecutor(max_workers=min(max_workers or os.cpu_count(), len(pending)),
+                                           mp_context=multiprocessing.get_context(method))
+            with executor:
+                futures = {executor.submit(_render, job['func'], output, job['kwargs']): output
+                           for output, (job, key) in pending.items()}
+                for future in as_completed(futures):
+                    output, seconds = future.result()
+                    fn.metrics.observe_stage(f'render.{pending[output][0]["func"].__name__}', seconds)
+                    manifest[output] = pending[output][1]
+                    report['rendered'].append(output)
+                    log.info(f'Saved {output}')
+    finally:
+        # keep the hashes of the figures rendered so far, also if a job failed
+        os.makedirs(os.path.dirname(manifest_file) or '.', exist_ok=True)
+        with open(manifest_file, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+    log.info(f"Rendered {len(report['rendered'])}, copied {len(report['copied'])} "
+             f"and skipped {len(report['skipped'])} up to date figures")
+    for name in report:
+        fn.metrics.count(f'figures_{name}', len(report[name]))
+    return report
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+"""
+| *author*: Johannes Röttenbacher
+| *created*: 17.10.2026
+
+Tests of the concept DOI shared by all versions of a data set.
+"""
+from types import SimpleNamespace
+import functions as fn
+
+DATACITE_PAGE = b"""<?xml version="1.0" encoding="UTF-8"?>
+<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/">
+  <ListRecords>
+    <record>
+      <header>
+        <identifier>oai:zenodo.org:1234567</identifier>
+        <datestamp>2021-03-01T10:00:00Z</datestamp>
+      </header>
+      <metadata>
+        <oai_datacite xmlns="http://schema.datacite.org/oai/oai-1.1/">
+          <payload>
+            <resource xmlns="http://datacite.org/schema/kernel-4">
+              <identifier identifierType="DOI">10.5281/zenodo.1234567</identifier>
+              <titles><title>Radiosonde record at Ny-Alesund</title></titles>
+              <relatedIdentifiers>
+                <relatedIdentifier relatedIdentifierType="DOI"
+                                   relationType="IsSupplementTo">10.5281/zenodo.1000</relatedIdentifier>
+                <relatedIdentifier relatedIdentifierType="DOI"
+                                   relationType="IsVersionOf">10.5281/zenodo.1234500</relatedIdentifier>
+              </relatedIdentifiers>
+            </resource>
+          </payload>
+        </oai_datacite>
+      </metadata>
+    </record>
+  </ListRecords>
+</OAI-PMH>
+"""
+
+
+def test_concept_from_relations():
+    # related data sets with a larger id are newer, the last smaller Zenodo DOI is the concept
+    relations = ['https://doi.org/10.1594/PANGAEA.845373', 'https://doi.org/10.5281/zenodo.1000',
+                 'https://doi.org/10.5281/zenodo.1234566', 'https://doi.org/10.5281/zenodo.2000000']
+    assert fn.extract_concept_doi(['https://doi.org/10.5281/zenodo.1234567'], relations,
+                                  'oai:zenodo.org:1234567') == '10.5281/zenodo.1234566'
+
+
+def test_concept_from_is_version_of():
+    assert fn.extract_concept_doi(['10.5281/zenodo.1234567'], ['https://doi.org/10.5281/zenodo.1234566'],
+                                  'oai:zenodo.org:1234567',
+                                  ['https://doi.org/10.5281/ZENODO.1234500']) == '10.5281/zenodo.1234500'
+    # other repositories only have a concept with an explicit relation
+    assert fn.extract_concept_doi(['10.1594/PANGAEA.2'], [], 'oai:pangaea.de:doi:10.1594/PANGAEA.2',
+                                  ['doi:10.1594/PANGAEA.1']) == '10.1594/pangaea.1'
+
+
+def test_concept_fallback():
+    # a Zenodo record without a relation to an older record is its own concept
+    assert fn.extract_concept_doi([], ['https://doi.org/10.5281/zenodo.2000000'],
+                                  'oai:zenodo.org:1234567') == '10.5281/zenodo.1234567'
+    assert fn.extract_concept_doi(['https://doi.org/10.5281/zenodo.1234567']) == '10.5281/zenodo.1234567'
+    assert fn.extract_concept_doi(['10.1594/PANGAEA.845373'], ['https://doi.org/10.5281/zenodo.1'],
+                                  'oai:pangaea.de:doi:10.1594/PANGAEA.845373') is None
+
+
+def test_is_version_of_from_oai_datacite():
+    response = SimpleNamespace(content=DATACITE_PAGE, raise_for_status=lambda: None)
+    session = SimpleNamespace(get=lambda *args, **kwargs: response)
+    records = fn.IterparseRecordIterator(session, 'https://zenodo.org/oai2d', dict(metadataPrefix='oai_datacite'),
+                                         metadata_prefix='oai_datacite')
+    dataset = fn.record_to_dataset(next(records))
+    assert dataset['relation'] == ['10.5281/zenodo.1000', '10.5281/zenodo.1234500']
+    assert dataset['concept_doi'] == '10.5281/zenodo.1234500'
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+"""
+| *author*: Johannes Röttenbacher
+| *created*: 17.10.2026
+
+Tests of the near-duplicate detection.
+"""
+import pandas as pd
+import functions as fn
+
+AUTHORS = ['Maturilli, Marion', 'Ebell, Kerstin']
+TITLE = 'Radiosonde record at Ny-Ålesund, 1993-2014'
+
+
+def corpus(*records):
+    """Corpus frame with the columns find_duplicates reads, records give the values which differ."""
+    defaults = dict(title=TITLE, authors=AUTHORS, relation=None, concept_doi=None)
+    df = pd.DataFrame([defaults | record for record in records])
+    df['date'] = pd.to_datetime(df['date'])
+    return df
+
+
+def clusters(df, **kwargs):
+    result = fn.find_duplicates(df, **kwargs)
+    return dict(zip(df['oai_identifier'], result['duplicate_cluster'])), dict(zip(df['oai_identifier'],
+                                                                                 result['duplicate']))
+
+
+def test_same_data_set_on_pangaea_and_zenodo():
+    df = corpus(dict(oai_identifier='oai:pangaea.de:doi:10.1594/PANGAEA.845373', doi='10.1594/PANGAEA.845373',
+                     publisher='PANGAEA', date='2015-03-01'),
+                dict(oai_identifier='oai:zenodo.org:1234567', doi='https://doi.org/10.5281/zenodo.1234567',
+                     publisher='Zenodo', concept_doi='10.5281/zenodo.1234566', date='2018-05-01',
+                     relation=['https://doi.org/10.5281/zenodo.1234566']))
+    cluster, duplicate = clusters(df)
+    assert set(cluster.values()) == {'oai:pangaea.de:doi:10.1594/PANGAEA.845373'}
+    assert duplicate == {'oai:pangaea.de:doi:10.1594/PANGAEA.845373': False, 'oai:zenodo.org:1234567': True}
+
+
+def test_relation_to_a_data_set_of_another_repository():
+    df = corpus(dict(oai_identifier='oai:pangaea.de:doi:10.1594/PANGAEA.1', doi='10.1594/PANGAEA.1',
+                     publisher='PANGAEA', date='2020-01-01', title='Radiosondes of the campaign'),
+                dict(oai_identifier='oai:zenodo.org:20', doi='10.5281/zenodo.20', publisher='Zenodo',
+                     date='2021-01-01', title='Raw data', relation=['https://doi.org/10.1594/PANGAEA.1']))
+    _, duplicate = clusters(df)
+    assert duplicate == {'oai:pangaea.de:doi:10.1594/PANGAEA.1': False, 'oai:zenodo.org:20': True}
+
+
+def test_two_versions_on_zenodo():
+    df = corpus(dict(oai_identifier='oai:zenodo.org:11', doi='10.5281/zenodo.11', publisher='Zenodo',
+                     concept_doi='10.5281/zenodo.10', date='2020-01-01', title='Cloud radar, version 1'),
+                dict(oai_identifier='oai:zenodo.org:12', doi='10.5281/zenodo.12', publisher='Zenodo',
+                     concept_doi='10.5281/zenodo.10', date='2021-01-01', title='Cloud radar reprocessed, version 2'))
+    cluster, duplicate = clusters(df)
+    assert set(cluster.values()) == {'oai:zenodo.org:11'}
+    assert duplicate['oai:zenodo.org:12']
+
+
+def test_unrelated_data_sets_in_the_same_bucket():
+    # with one hash function per band, data sets sharing half of their features share many buckets
+    df = corpus(dict(oai_identifier='oai:pangaea.de:1', doi='10.1594/PANGAEA.1', publisher='PANGAEA',
+                     date='2020-01-01', title='Radiosonde profiles Ny-Ålesund 2017'),
+                dict(oai_identifier='oai:pangaea.de:2', doi='10.1594/PANGAEA.2', publisher='PANGAEA',
+                     date='2020-02-01', title='Dropsonde profiles HALO campaign'),
+                dict(oai_identifier='oai:pangaea.de:3', doi='10.1594/PANGAEA.3', publisher='PANGAEA',
+                     date='2020-03-01', title='Dropsonde profiles HALO campaign'))
+    cluster, duplicate = clusters(df, bands=128)
+    assert pd.isna(cluster['oai:pangaea.de:1'])
+    assert cluster['oai:pangaea.de:2'] == cluster['oai:pangaea.de:3'] == 'oai:pangaea.de:2'
+    assert list(duplicate.values()) == [False, False, True]
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+"""
+| *author*: Johannes Röttenbacher
+| *created*: 17.10.2026
+
+Tests of the incremental harvest against a small OAI-PMH stub.
+"""
+from html import escape
+import http.server
+import json
+import threading
+from urllib.parse import parse_qs, urlparse
+import pytest
+import functions as fn
+
+RECORD = """<record><header{status}><identifier>{identifier}</identifier><datestamp>{datestamp}</datestamp></header>
+<metadata><oai_dc:dc xmlns:oai_dc="http://www.openarchives.org/OAI/2.0/oai_dc/"
+ xmlns:dc="http://purl.org/dc/elements/1.1/"><dc:identifier>{doi}</dc:identifier><dc:title>{title}</dc:title>
+<dc:date>{date}</dc:date><dc:publisher>{publisher}</dc:publisher><dc:type>Dataset</dc:type></oai_dc:dc></metadata>
+</record>"""
+
+
+class OAIStubHandler(http.server.BaseHTTPRequestHandler):
+    """
+    ListRecords of the records of a :class:`OAIStub` in pages of two records, selected by set and `from`.
+    The resumption token is `<set>|<from>|<offset>`.
+    """
+
+    def do_GET(self):
+        stub = self.server.stub
+        params = {key: values[0] for key, values in parse_qs(urlparse(self.path).query).items()}
+        stub.requests.append(params)
+        if 'resumptionToken' in params:
+            set_name, start, offset = params['resumptionToken'].split('|')
+            offset = int(offset)
+        else:
+            set_name, start, offset = params['set'], params.get('from', ''), 0
+        if set_name in stub.failing_sets or params.get('resumptionToken') in stub.failing_tokens:
+            self.send_error(404)
+            return
+        records = [record for record in stub.records if record['set'] == set_name and record['datestamp'] >= start]
+        if not records:
+            body = '<error code="noRecordsMatch">No records</error>'
+        else:
+            page = records[offset:offset + stub.page_size]
+            token = f'{set_name}|{start}|{offset + stub.page_size}' if offset + stub.page_size < len(records) else ''
+            body = ''.join(RECORD.format(status=' status="deleted"' if record.get('deleted') else '',
+                                         **{key: escape(str(value)) for key, value in record.items()})
+                           for record in page)
+            body = f'<ListRecords>{body}<resumptionToken>{token}</resumptionToken></ListRecords>'
+        content = f'<OAI-PMH xmlns="http://www.openarchives.org/OAI/2.0/">{body}</OAI-PMH>'.encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/xml')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+class OAIStub:
+    """OAI-PMH provider serving `records`, requests for a failing set or resumption token are answered with a 404."""
+
+    def __init__(self):
+        self.records, self.requests = [], []
+        self.failing_sets, self.failing_tokens = set(), set()
+        self.page_size = 2
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), OAIStubHandler)
+        self.server.daemon_threads = True
+        self.server.stub = self
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}/oai'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def add(self, set_name, n, datestamp='2024-01-01T00:00:00Z', start=0):
+        for i in range(start, start + n):
+            self.records.append(dict(set=set_name, identifier=f'oai:{set_name}:{i}', datestamp=datestamp,
+                                     doi=f'10.1234/{set_name}.{i}', title=f'Radiosonde profiles {set_name} {i}',
+                                     date=f'20{10 + i}-01-01', publisher=set_name.upper()))
+
+    def update(self, identifier, **values):
+        next(record for record in self.records if record['identifier'] == identifier).update(values)
+
+
+@pytest.fixture
+def stub():
+    stub = OAIStub()
+    yield stub
+    stub.server.shutdown()
+    stub.server.server_close()
+
+
+def harvest(stub, tmp_path, date, set_name='a'):
+    output_file = str(tmp_path / f'{date}-datasets_{set_name}.ndjson.gz')
+    result = fn.get_metadata_from_repository(stub.url, set_name, output_file, state_file=str(tmp_path / 'state.json'),
+                                             parser='iterparse')
+    return result, {record['oai_identifier']: record for record in fn.read_records(output_file)}
+
+
+def test_interrupted_harvest_resumes_from_its_resumption_token(stub, tmp_path):
+    stub.add('a', 5)
+    stub.failing_tokens.add('a||4')
+    with pytest.raises(Exception):
+        harvest(stub, tmp_path, '20240101')
+    state = json.loads((tmp_path / 'state.json').read_text())
+    assert [job['resumption_token'] for job in state.values()] == ['a||2']
+
+    stub.failing_tokens.clear()
+    stub.requests.clear()
+    result, records = harvest(stub, tmp_path, '20240101')
+    # the pages before the checkpoint are not requested again
+    assert [request.get('resumptionToken') for request in stub.requests] == ['a||2', 'a||4']
+    assert sorted(records) == [f'oai:a:{i}' for i in range(5)]
+    assert result['records'] == 5
+
+
+def test_second_harvest_asks_for_changes_since_the_first(stub, tmp_path):
+    stub.add('a', 2, datestamp='2023-12-01T00:00:00Z')
+    stub.add('a', 1, start=2)
+    harvest(stub, tmp_path, '20240101')
+    stub.update('oai:a:1', datestamp='2024-02-01T00:00:00Z', title='Radiosonde profiles, reprocessed')
+    stub.add('a', 1, datestamp='2024-02-02T00:00:00Z', start=3)
+    stub.requests.clear()
+    result, records = harvest(stub, tmp_path, '20240201')
+    assert stub.requests[0]['from'] == '2024-01-01T00:00:00Z'
+    # from is inclusive, the latest record of the first harvest is harvested again
+    assert result['updated'] == 3
+    assert sorted(records) == [f'oai:a:{i}' for i in range(4)]
+    assert records['oai:a:1']['title'] == ['Radiosonde profiles, reprocessed']
+
+    stub.requests.clear()
+    harvest(stub, tmp_path, '20240301')
+    assert stub.requests[0]['from'] == '2024-02-02T00:00:00Z'
+
+
+def test_deleted_record_is_removed_from_the_corpus(stub, tmp_path):
+    stub.add('a', 3)
+    harvest(stub, tmp_path, '20240101')
+    stub.update('oai:a:0', datestamp='2024-02-01T00:00:00Z', deleted=True)
+    result, records = harvest(stub, tmp_path, '20240201')
+    assert result['deleted'] == 1
+    assert sorted(records) == ['oai:a:1', 'oai:a:2']
+
+
+def test_stores_are_unchanged_if_one_job_fails(stub, tmp_path):
+    stub.add('a', 3)
+    stub.add('b', 2)
+    jobs = [dict(name=name, oai_url=stub.url, set=name, parser='iterparse') for name in ('a', 'b')]
+    aggregates = fn.PublicationAggregates(str(tmp_path / 'aggregates.sqlite'))
+    search_index = fn.SearchIndex(str(tmp_path / 'search.sqlite'))
+
+    def run(date):
+        reports = fn.run_harvest_jobs(jobs, str(tmp_path), date, state_file=str(tmp_path / 'state.json'),
+                                      aggregates=aggregates, search_index=search_index)
+        return [report['status'] for report in reports]
+
+    assert run('20240101') == ['ok', 'ok']
+    counts = aggregates.counts()
+    assert counts['count'].sum() == 5
+    assert len(search_index.matching_ids('radiosonde')) == 5
+
+    stub.add('a', 2, datestamp='2024-02-01T00:00:00Z', start=3)
+    stub.update('oai:a:0', datestamp='2024-02-01T00:00:00Z', deleted=True)
+    stub.failing_sets.add('b')
+    assert run('20240201') == ['ok', 'failed']
+    assert aggregates.counts().equals(counts)
+    assert len(search_index.matching_ids('radiosonde')) == 5
+
+    # the next complete harvest brings the stores up to date
+    stub.failing_sets.clear()
+    assert run('20240301') == ['ok', 'ok']
+    assert aggregates.counts()['count'].sum() == 6
+    assert search_index.matching_ids('radiosonde') == {'oai:a:1', 'oai:a:2', 'oai:a:3', 'oai:a:4', 'oai:b:0',
+                                                       'oai:b:1'}
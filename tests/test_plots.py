@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+"""
+| *author*: Johannes Röttenbacher
+| *created*: 17.10.2026
+
+Tests of the arrays the publication figures are drawn from and of the layout of the figures.
+"""
+import matplotlib
+import numpy as np
+import pandas as pd
+import pytest
+import functions as fn
+import plots
+
+
+def yearly_publications():
+    """Yearly publications of two repositories, with years before the ones shown and a year with one repository."""
+    dates = ['2014-05-01', '2015-03-01', '2015-07-01', '2016-01-01', '2016-02-01', '2016-06-01',
+             '2017-04-01', '2018-08-01', '2018-09-01', '2018-10-01']
+    publishers = ['PANGAEA', 'Zenodo', 'PANGAEA', 'PANGAEA', 'Zenodo', 'Zenodo',
+                  'PANGAEA', 'PANGAEA', 'Zenodo', 'PANGAEA']
+    df = pd.DataFrame(dict(oai_identifier=[f'oai:test:{i}' for i in range(len(dates))],
+                           date=pd.to_datetime(dates), publisher=publishers, type='Dataset', concept_doi=None))
+    aggregates = fn.PublicationAggregates(':memory:')
+    aggregates.apply_frame(df)
+    return aggregates.yearly_publications()
+
+
+def test_cumulative_is_running_total_of_all_publishers():
+    yearly = yearly_publications()
+    shown = yearly[yearly['year'] >= 2016]
+    arrays = plots.yearly_publication_arrays(shown)
+    offset = yearly.loc[yearly['year'] < 2016, 'count'].sum()
+    expected = offset + np.cumsum(np.sum(arrays['counts'], axis=0))
+    assert arrays['years'] == [2016, 2017, 2018]
+    assert arrays['cumulative'] == expected.tolist() == [6, 7, 10]
+
+
+def test_cumulative_per_publisher():
+    arrays = plots.yearly_publication_arrays(yearly_publications())
+    for publisher, counts, cumulative in zip(arrays['publishers'], arrays['counts'],
+                                             arrays['cumulative_per_publisher']):
+        assert cumulative == np.cumsum(counts).tolist(), publisher
+
+
+@pytest.fixture
+def saved_figures(monkeypatch):
+    """Figures saved by the render functions, kept open to inspect their layout."""
+    figures = []
+    savefig = matplotlib.figure.Figure.savefig
+
+    def keep(fig, *args, **kwargs):
+        savefig(fig, *args, **kwargs)
+        figures.append(fig)
+
+    monkeypatch.setattr(matplotlib.figure.Figure, 'savefig', keep)
+    monkeypatch.setattr(plots.plt, 'close', lambda fig=None: None)
+    yield figures
+    for fig in figures:
+        matplotlib.pyplot.close(fig)
+
+
+def within_figure(fig, ax):
+    """True if the axes with all its labels and tick labels lies within the figure."""
+    extent, bbox = ax.get_tightbbox(), fig.bbox.padded(1)
+    return bbox.x0 <= extent.x0 and extent.x1 <= bbox.x1 and bbox.y0 <= extent.y0 and extent.y1 <= bbox.y1
+
+
+def render_all(output_dir):
+    fmt = plots.FMT_DICT['presentation']
+    arrays = plots.yearly_publication_arrays(yearly_publications())
+    plots.render_yearly_publications(output_dir / 'yearly.png', arrays['years'], arrays['publishers'],
+                                     arrays['counts'], arrays['cumulative'], fmt, dpi=100)
+    plots.render_yearly_publications_per_repo(output_dir / 'per_repo.png', arrays['years'], arrays['publishers'],
+                                              arrays['counts'], arrays['cumulative_per_publisher'], fmt, dpi=100)
+    plots.render_usage_bar(output_dir / 'usage_bar.png', [1200, 800, 300], 'Zenodo', fmt, dpi=100)
+
+
+def test_saved_figures_keep_their_labels(tmp_path, saved_figures):
+    # the second round renders in the same process, as the workers of render_figures do
+    render_all(tmp_path)
+    render_all(tmp_path)
+    yearly, per_repo, usage_bar = saved_figures[-3:]
+    for fig in (yearly, usage_bar):
+        assert fig.axes[0].get_ylabel() == 'Count'
+        assert within_figure(fig, fig.axes[0])
+    assert yearly.axes[0].get_xlabel() == 'Year'
+    upper, lower = per_repo.axes
+    assert lower.get_xlabel() == 'Year' and upper.get_xticklabels()[0].get_text() == ''
+    # the title of the lower row stays below the upper row
+    assert lower.title.get_window_extent().y1 <= upper.get_tightbbox().y0 + 1
+
+
+def test_render_figures_skips_up_to_date_figures(tmp_path):
+    manifest = tmp_path / 'render_manifest.json'
+    fmt = plots.FMT_DICT['presentation']
+    jobs = [dict(func=plots.render_usage_bar, output=str(tmp_path / f'usage_{name}.png'),
+                 kwargs=dict(sums=sums, title=name, fmt=fmt, dpi=50))
+            for name, sums in [('Zenodo', [1200, 800, 300]), ('PANGAEA', [900, 400, 100])]]
+    report = plots.render_figures(jobs, max_workers=2, manifest_file=str(manifest))
+    assert sorted(report['rendered']) == sorted(job['output'] for job in jobs)
+    assert all((tmp_path / f'usage_{name}.png').exists() for name in ('Zenodo', 'PANGAEA'))
+    report = plots.render_figures(jobs, max_workers=2, manifest_file=str(manifest))
+    assert report['rendered'] == [] and len(report['skipped']) == 2
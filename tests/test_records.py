@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+"""
+| *author*: Johannes Röttenbacher
+| *created*: 17.10.2026
+
+Tests of the compact table the corpus is built from.
+"""
+import pandas as pd
+import pytest
+import functions as fn
+
+
+def records(n):
+    """Records with list and scalar fields, None values, missing fields and more distinct values than packed."""
+    return [dict(oai_identifier=f'oai:test:{i}',
+                 doi=None if i % 7 == 0 else f'10.5281/zenodo.{i}',
+                 concept_doi=None if i == 0 else f'10.5281/zenodo.c{i}',
+                 creator=[f'Author {i}', f'Group {i % 3}'] if i % 5 else [f'Author {i}'],
+                 title=[f'Radiosonde profiles {i}'],
+                 date=[f'2020-01-0{i % 9 + 1}'],
+                 publisher=['PANGAEA' if i % 2 else 'Zenodo'],
+                 **({'relation': [f'10.1594/PANGAEA.{i}']} if i % 11 == 0 else {}))
+            for i in range(n)]
+
+
+@pytest.mark.parametrize('n', [10, fn.PACK_THRESHOLD * 2 + 100])
+def test_round_trip(n):
+    expected = records(n)
+    table = fn.RecordTable(expected)
+    assert len(table) == n
+    assert [table.record(i) for i in range(n)] == expected
+
+
+def test_uniform_records_with_leading_none():
+    expected = [dict(doi=f'10.1/{i}', concept_doi=None if i == 0 else f'10.1/c{i}') for i in range(6000)]
+    table = fn.RecordTable(expected)
+    assert list(table) == expected
+    assert table.column('concept_doi')[:2] == [None, '10.1/c1']
+
+
+def test_codes_and_values():
+    table = fn.RecordTable([dict(publisher='PANGAEA', creator=['A', 'B']),
+                            dict(publisher='Zenodo', creator=['B']),
+                            dict(publisher='PANGAEA')])
+    assert list(table.values('publisher')) == ['PANGAEA', 'Zenodo']
+    assert [table.codes('publisher', i) for i in range(3)] == [[0], [1], [0]]
+    # the author ID table the records refer to
+    assert list(table.values('creator')) == ['A', 'B']
+    assert [table.codes('creator', i) for i in range(3)] == [[0, 1], [1], [-1]]
+    assert table.column('creator') == [['A', 'B'], ['B'], None]
+    assert table.column('creator', first=True) == ['A', 'B', None]
+
+
+def test_scalars_in_list_fields_and_lists_in_scalar_fields():
+    table = fn.RecordTable([dict(creator=['A'], doi='10.1/a'), dict(creator='B', doi=['10.1/b', '10.1/c'])])
+    assert table.record(1) == dict(creator=['B'], doi='10.1/b')
+
+
+@pytest.mark.parametrize('n', [10, fn.PACK_THRESHOLD * 2 + 100])
+def test_to_frame_matches_normalise_frame(n):
+    expected = fn.normalise_frame(pd.DataFrame(records(n)))
+    # missing fields are None in the table and NaN in a frame of record dictionaries
+    expected = expected.astype(object).where(expected.notna(), None).astype(expected.dtypes.to_dict())
+    pd.testing.assert_frame_equal(fn.RecordTable(records(n)).to_frame(), expected)
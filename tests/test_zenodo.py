@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+"""
+| *author*: Johannes Röttenbacher
+| *created*: 17.10.2026
+
+Tests of the Zenodo records API client against the stand-in of the benchmark.
+"""
+import itertools
+import time
+import pytest
+import benchmark
+import functions as fn
+
+
+@pytest.fixture
+def stand_in(monkeypatch):
+    # without an access token Zenodo answers 25 records per page, 40 pages for 1000 records
+    monkeypatch.delenv('ACCESS_TOKEN', raising=False)
+    server = benchmark.start_stand_ins(benchmark.SyntheticCorpus(4000))
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_stream_fetches_pages_as_they_are_consumed(stand_in):
+    records = fn.query_zenodo('crc172-ac3', base_url=f'{stand_in.url}/api/records/', max_workers=4, stream=True)
+    # the first record of the second page
+    consumed = list(itertools.islice(records, 26))
+    # give pages fetched ahead of time a chance to arrive
+    time.sleep(0.2)
+    # the first two pages and the pages fetched ahead of the consumer
+    assert stand_in.requests <= 2 + 4
+    consumed += list(records)
+    assert stand_in.requests == 40
+    assert [record['doi'] for record in consumed] == [
+        record['doi'] for record in fn.query_zenodo('crc172-ac3', base_url=f'{stand_in.url}/api/records/')]